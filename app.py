@@ -1,11 +1,13 @@
+import argparse
 import sys
 from pathlib import Path
-import requests
 
 # Add the src directory to the Python path to allow for package imports
 sys.path.append(str(Path(__file__).resolve().parent))
 
-from src.image_generator.core import generate_and_save_image
+from src.image_generator.core import generate_and_save_image, set_backend
+from src.image_generator.logs import configure_logging
+from src.image_generator.store import get_store
 from src.image_generator.tasks import (
     style_transfer, 
     chat_with_image, 
@@ -16,6 +18,13 @@ from src.image_generator.tasks import (
 
 def main():
     """Main function to run image generation tasks."""
+
+    parser = argparse.ArgumentParser(description="Gemini Image Generation Tool")
+    parser.add_argument("--backend", choices=["gemini", "fake"], help="Image backend to use (default: IMAGE_BACKEND or 'gemini').")
+    args = parser.parse_args()
+    configure_logging("text")
+    if args.backend:
+        set_backend(args.backend)
     
     print("Welcome to the Gemini Image Generation Tool!")
     print("What would you like to do?")
@@ -52,6 +61,7 @@ def main():
                 base_image_path = Path("images") / base_image_filename
                 image_url = "https://cdn-images-1.medium.com/proxy/1*TWO2meqMNnS1-6XSO6yv7Q.png"
                 base_image_path.parent.mkdir(exist_ok=True)
+                import requests  # only needed for this optional download
                 try:
                     print(f"Downloading base image to {base_image_path}...")
                     response = requests.get(image_url)
@@ -78,8 +88,7 @@ def main():
                 output_filename = "styled_image.png"
             
             output_path = Path("output") / output_filename
-            output_path.parent.mkdir(exist_ok=True)
-            generated_image.save(output_path)
+            output_path = get_store().put(generated_image, style_prompt, alias=output_path)
             print(f"✅ Styled image saved as {output_path}")
         else:
             print("❌ Style transfer failed.")
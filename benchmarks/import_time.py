@@ -0,0 +1,85 @@
+"""
+Import-time budget check for the CLI entry points.
+
+Runs `python -X importtime -c "import <module>"` in fresh interpreters, takes
+the fastest of several runs and fails if the module's cumulative import time
+exceeds the budget, or if a heavy dependency that should only be loaded on
+first use (the Gemini SDK, PIL, requests) is imported eagerly.
+
+Usage:
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --module src.image_generator.batch --budget-ms 150
+"""
+import argparse
+import subprocess
+import sys
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+# Imported lazily on the code paths that need them; seeing one at import time is a regression
+DEFERRED_MODULES = ("google.genai", "PIL", "requests")
+
+
+def measure(module):
+    """
+    Imports `module` in a fresh interpreter under -X importtime.
+
+    Returns:
+        tuple[float, set[str]]: The module's cumulative import time in milliseconds and every module imported.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=REPO_ROOT,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr}")
+
+    cumulative_us = None
+    imported = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = (field.strip() for field in line[len("import time:"):].split("|"))
+        if not cumulative.isdigit():
+            continue  # the header line
+        imported.add(name)
+        if name == module:
+            cumulative_us = int(cumulative)
+    if cumulative_us is None:
+        raise RuntimeError(f"No import time reported for {module}")
+    return cumulative_us / 1000, imported
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fail if importing a module exceeds its import-time budget.")
+    parser.add_argument("--module", default="app", help="Module to import (default: app).")
+    parser.add_argument("--budget-ms", type=float, default=100.0, help="Maximum cumulative import time in ms (default: 100).")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters to try; the fastest run counts.")
+    args = parser.parse_args(argv)
+
+    timings = []
+    eager = set()
+    for _ in range(max(1, args.runs)):
+        elapsed_ms, imported = measure(args.module)
+        timings.append(elapsed_ms)
+        eager |= {name for name in imported if any(name == m or name.startswith(m + ".") for m in DEFERRED_MODULES)}
+
+    best = min(timings)
+    print(f"⏱️ import {args.module}: {best:.1f} ms (best of {len(timings)}, budget {args.budget_ms:.0f} ms)")
+    failed = False
+    if best > args.budget_ms:
+        print(f"❌ Import time is over budget by {best - args.budget_ms:.1f} ms.")
+        failed = True
+    if eager:
+        print(f"❌ Heavy modules imported eagerly: {', '.join(sorted(eager))}")
+        failed = True
+    if not failed:
+        print("✅ Within budget.")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,468 @@
+"""
+Load tests for the server and the batch engine against the offline fake backend.
+
+`server` starts server.py with the fake backend (or targets --url) and drives
+POST /generate-image/ either closed-loop (--concurrency clients sending back to
+back) or open-loop (--rate requests per second with Poisson arrivals; latency
+is measured from each request's scheduled arrival, so a saturated server shows
+up as latency instead of being hidden by the client slowing down).
+
+`batch` writes a synthetic prompt file and runs it through batch.run_file.
+
+Both report throughput, p50/p95/p99 latency, error rate, CPU seconds and peak
+RSS, save the results as JSON and, given --baseline, fail when a metric is
+worse than the baseline by more than --max-regression.
+
+Usage:
+    python benchmarks/load_test.py server --concurrency 32 --requests 2000 --latency 0.5
+    python benchmarks/load_test.py server --rate 50 --duration 30 --workers 4
+    python benchmarks/load_test.py batch --requests 500 --concurrency 16 --baseline benchmarks/results/batch-base.json
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from http.client import HTTPConnection
+from pathlib import Path
+from urllib.parse import urlsplit
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+RESULTS_DIR = REPO_ROOT / "benchmarks" / "results"
+
+# Metrics compared against a baseline, and whether a higher value is better
+TRACKED_METRICS = (
+    ("throughput_rps", True),
+    ("latency_ms.p50", False),
+    ("latency_ms.p95", False),
+    ("latency_ms.p99", False),
+    ("cpu_seconds_per_request", False),
+    ("peak_rss_mb", False),
+)
+
+
+def percentile(values, p):
+    """Nearest-rank p-th percentile (0-100) of `values`, or None if there are none."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, -(-p * len(ordered) // 100) - 1)
+    return ordered[min(int(rank), len(ordered) - 1)]
+
+
+def summarize(latencies, errors, duration):
+    """Builds the common result fields from successful latencies (seconds) and an error Counter."""
+    succeeded = len(latencies)
+    total = succeeded + sum(errors.values())
+    ms = [latency * 1000 for latency in latencies]
+    return {
+        "requests": total,
+        "succeeded": succeeded,
+        "failed": total - succeeded,
+        "error_rate": (total - succeeded) / total if total else 0.0,
+        "errors": dict(errors),
+        "duration_s": duration,
+        "throughput_rps": succeeded / duration if duration else 0.0,
+        "latency_ms": {
+            "p50": percentile(ms, 50),
+            "p95": percentile(ms, 95),
+            "p99": percentile(ms, 99),
+            "max": max(ms) if ms else None,
+            "mean": sum(ms) / len(ms) if ms else None,
+        },
+    }
+
+
+def fake_backend_env(args):
+    """Environment that points the code under test at the fake backend with the requested latency."""
+    return {
+        "IMAGE_BACKEND": "fake",
+        "FAKE_LATENCY": str(args.latency),
+        "FAKE_LATENCY_DISTRIBUTION": args.latency_distribution,
+        "FAKE_LATENCY_JITTER": str(args.latency_jitter),
+        "FAKE_ERROR_RATE": str(args.error_rate),
+        "FAKE_SEED": str(args.seed),
+    }
+
+
+# --- Process accounting (Linux /proc; None elsewhere) ---
+def _process_tree(pid):
+    """The pid and all its descendants."""
+    children = {}
+    for entry in Path("/proc").iterdir():
+        if not entry.name.isdigit():
+            continue
+        try:
+            stat = (entry / "stat").read_text()
+        except OSError:
+            continue
+        parent = int(stat.rpartition(")")[2].split()[1])
+        children.setdefault(parent, []).append(int(entry.name))
+    tree, pending = [], [pid]
+    while pending:
+        current = pending.pop()
+        tree.append(current)
+        pending.extend(children.get(current, []))
+    return tree
+
+
+def _cpu_seconds(pids):
+    ticks = os.sysconf("SC_CLK_TCK")
+    total = 0.0
+    for pid in pids:
+        try:
+            fields = Path(f"/proc/{pid}/stat").read_text().rpartition(")")[2].split()
+        except OSError:
+            continue
+        total += (int(fields[11]) + int(fields[12])) / ticks  # utime + stime
+    return total
+
+
+def _rss_mb(pids):
+    total = 0
+    for pid in pids:
+        try:
+            for line in Path(f"/proc/{pid}/status").read_text().splitlines():
+                if line.startswith("VmRSS:"):
+                    total += int(line.split()[1])
+        except OSError:
+            continue
+    return total / 1024
+
+
+class ProcessMonitor:
+    """Samples the RSS of a process tree in the background and reads its CPU time."""
+
+    def __init__(self, pid, interval=0.25):
+        self.pid = pid
+        self.interval = interval
+        self.peak_rss_mb = None
+        self.available = Path("/proc/self/stat").exists()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        if self.available:
+            self.cpu_at_start = _cpu_seconds(_process_tree(self.pid))
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            rss = _rss_mb(_process_tree(self.pid))
+            self.peak_rss_mb = max(self.peak_rss_mb or 0.0, rss)
+
+    def stop(self):
+        """Stops sampling and returns (CPU seconds used since start, peak RSS in MB)."""
+        if not self.available:
+            return None, None
+        cpu = _cpu_seconds(_process_tree(self.pid)) - self.cpu_at_start
+        self._stop.set()
+        self._thread.join()
+        return cpu, self.peak_rss_mb
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(args, workdir):
+    """Starts server.py on the fake backend and waits until it answers. Returns (process, base URL, log path)."""
+    port = _free_port()
+    env = {**os.environ, **fake_backend_env(args), "OUTPUT_STORE_DIR": str(Path(workdir) / "store")}
+    log_path = Path(workdir) / "server.log"
+    command = [sys.executable, str(REPO_ROOT / "server.py"), "--backend", "fake", "--port", str(port)]
+    if args.workers > 1:
+        command += ["--workers", str(args.workers)]
+        env["IMAGE_CACHE_DIR"] = str(Path(workdir) / "cache")
+    with open(log_path, "wb") as log:
+        process = subprocess.Popen(command, cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server.py exited with {process.returncode}; see {log_path}")
+        try:
+            connection = HTTPConnection("127.0.0.1", port, timeout=1)
+            connection.request("GET", "/stats")
+            if connection.getresponse().status == 200:
+                connection.close()
+                return process, url, log_path
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"server.py did not start within 60 s; see {log_path}")
+
+
+class Client:
+    """Sends /generate-image/ requests over one keep-alive connection per thread."""
+
+    def __init__(self, url, args, run_id):
+        parts = urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.timeout = args.timeout
+        self.run_id = run_id
+        self.response_format = "path" if args.save else "base64"
+        self.save = args.save
+        self._local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._local.connection = HTTPConnection(self.host, self.port, timeout=self.timeout)
+        return connection
+
+    def send(self, index):
+        """Sends request `index`. Returns None on success or an error label (status code or exception name)."""
+        body = json.dumps({
+            "prompt": f"load test {self.run_id} request {index}",
+            "response_format": self.response_format,
+            "save_to_disk": self.save,
+        })
+        connection = self._connection()
+        try:
+            connection.request("POST", "/generate-image/", body, {"Content-Type": "application/json"})
+            response = connection.getresponse()
+            response.read()
+        except Exception as e:
+            connection.close()
+            self._local.connection = None
+            return type(e).__name__
+        return None if response.status == 200 else str(response.status)
+
+
+def _closed_loop(client, args):
+    """--concurrency clients, each sending its next request as soon as the previous one returns."""
+    latencies, errors, lock = [], Counter(), threading.Lock()
+    indices = itertools.count()
+    deadline = time.monotonic() + args.duration if args.duration else None
+
+    def worker():
+        while True:
+            index = next(indices)
+            if (args.requests and index >= args.requests) or (deadline and time.monotonic() >= deadline):
+                return
+            started = time.perf_counter()
+            error = client.send(index)
+            elapsed = time.perf_counter() - started
+            with lock:
+                if error is None:
+                    latencies.append(elapsed)
+                else:
+                    errors[error] += 1
+
+    threads = [threading.Thread(target=worker) for _ in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors
+
+
+def _open_loop(client, args):
+    """Requests arrive at --rate per second (Poisson), whether or not earlier ones have finished."""
+    latencies, errors, lock = [], Counter(), threading.Lock()
+    rng = random.Random(args.seed)
+    total = args.requests or int(args.rate * args.duration)
+
+    def send(index, scheduled):
+        error = client.send(index)
+        elapsed = time.perf_counter() - scheduled  # includes any time spent waiting for a free client thread
+        with lock:
+            if error is None:
+                latencies.append(elapsed)
+            else:
+                errors[error] += 1
+
+    with ThreadPoolExecutor(max_workers=args.max_outstanding) as pool:
+        scheduled = time.perf_counter()
+        for index in range(total):
+            scheduled += rng.expovariate(args.rate)
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(send, index, scheduled)
+    return latencies, errors
+
+
+def run_server_benchmark(args):
+    workdir = tempfile.mkdtemp(prefix="load_test_")
+    process = None
+    url = args.url
+    if url is None:
+        process, url, log_path = start_server(args, workdir)
+        print(f"🚀 Started server.py ({args.workers} worker(s)) at {url}, log {log_path}")
+    monitor = ProcessMonitor(process.pid).start() if process else None
+    client = Client(url, args, run_id=f"{os.getpid()}-{int(time.time())}")
+    mode = "open" if args.rate else "closed"
+    print(f"🧪 {mode}-loop load: " + (f"{args.rate}/s" if args.rate else f"{args.concurrency} clients"))
+
+    client_cpu = time.process_time()
+    started = time.perf_counter()
+    try:
+        latencies, errors = (_open_loop if args.rate else _closed_loop)(client, args)
+        duration = time.perf_counter() - started
+    finally:
+        server_cpu, peak_rss = monitor.stop() if monitor else (None, None)
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+
+    result = summarize(latencies, errors, duration)
+    result["mode"] = mode
+    result["client_cpu_seconds"] = time.process_time() - client_cpu
+    result["cpu_seconds"] = server_cpu
+    result["cpu_seconds_per_request"] = server_cpu / result["requests"] if server_cpu is not None and result["requests"] else None
+    result["peak_rss_mb"] = peak_rss
+    return result
+
+
+def run_batch_benchmark(args):
+    workdir = Path(tempfile.mkdtemp(prefix="load_test_"))
+    os.environ.update(fake_backend_env(args))
+    os.environ["OUTPUT_STORE_DIR"] = str(workdir / "store")
+    sys.path.insert(0, str(REPO_ROOT))
+    from src.image_generator.batch import run_file
+
+    prompts_file = workdir / "prompts.jsonl"
+    with open(prompts_file, "w", encoding="utf-8") as f:
+        for index in range(args.requests or 1000):
+            f.write(json.dumps({"prompt": f"synthetic batch prompt {index}"}) + "\n")
+
+    latencies, errors = [], Counter()
+
+    def on_result(record):
+        if record["status"] == "success":
+            latencies.append(record["latency"])
+        else:
+            errors[record["error_class"] or "error"] += 1
+
+    print(f"🧪 Batch: {args.requests or 1000} prompts, concurrency {args.concurrency}")
+    import resource
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    started = time.perf_counter()
+    run_file(prompts_file, output_dir=workdir / "output", concurrency=args.concurrency, on_result=on_result)
+    duration = time.perf_counter() - started
+    after = resource.getrusage(resource.RUSAGE_SELF)
+
+    result = summarize(latencies, errors, duration)
+    result["cpu_seconds"] = (after.ru_utime + after.ru_stime) - (usage.ru_utime + usage.ru_stime)
+    result["cpu_seconds_per_request"] = result["cpu_seconds"] / result["requests"] if result["requests"] else None
+    result["peak_rss_mb"] = after.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+    return result
+
+
+def _lookup(result, path):
+    for key in path.split("."):
+        result = result.get(key) if isinstance(result, dict) else None
+    return result
+
+
+def compare(result, baseline, max_regression, max_error_rate_increase):
+    """Returns a description of every metric that regressed beyond the thresholds."""
+    regressions = []
+    for path, higher_is_better in TRACKED_METRICS:
+        current, previous = _lookup(result, path), _lookup(baseline, path)
+        if current is None or not previous:
+            continue
+        change = (current - previous) / previous
+        if (-change if higher_is_better else change) > max_regression:
+            regressions.append(f"{path}: {previous:.4g} -> {current:.4g} ({change:+.1%})")
+    if result["error_rate"] - baseline.get("error_rate", 0.0) > max_error_rate_increase:
+        regressions.append(f"error_rate: {baseline.get('error_rate', 0.0):.2%} -> {result['error_rate']:.2%}")
+    return regressions
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test the server or the batch engine against the fake backend.")
+    parser.add_argument("benchmark", choices=["server", "batch"])
+    load = parser.add_argument_group("load")
+    load.add_argument("--requests", type=int, default=None, help="Requests (or batch prompts) to send (default: 1000, or --duration).")
+    load.add_argument("--duration", type=float, default=None, help="Seconds to run the server benchmark instead of a request count.")
+    load.add_argument("--concurrency", type=int, default=16, help="Closed-loop clients, or batch concurrency (default: 16).")
+    load.add_argument("--rate", type=float, default=None, help="Open-loop arrival rate in requests per second.")
+    load.add_argument("--max-outstanding", type=int, default=256, help="Open-loop cap on requests in flight from the client.")
+    load.add_argument("--timeout", type=float, default=120.0, help="Per-request timeout in seconds.")
+    load.add_argument("--save", action="store_true", help="Ask the server to save images instead of returning them inline.")
+    server = parser.add_argument_group("server")
+    server.add_argument("--url", default=None, help="Target an already running server instead of starting one.")
+    server.add_argument("--workers", type=int, default=1, help="Worker processes for the started server.")
+    fake = parser.add_argument_group("fake backend")
+    fake.add_argument("--latency", type=float, default=0.2, help="Model latency in seconds (default: 0.2).")
+    fake.add_argument("--latency-distribution", default="lognormal", choices=["fixed", "uniform", "lognormal"])
+    fake.add_argument("--latency-jitter", type=float, default=0.5, help="Jitter, or lognormal sigma (default: 0.5).")
+    fake.add_argument("--error-rate", type=float, default=0.0, help="Fraction of model calls failing transiently.")
+    fake.add_argument("--seed", type=int, default=0)
+    report = parser.add_argument_group("results")
+    report.add_argument("--output", default=None, help="Results JSON path (default: benchmarks/results/<benchmark>-<time>.json).")
+    report.add_argument("--baseline", default=None, help="Earlier results JSON to compare against.")
+    report.add_argument("--max-regression", type=float, default=0.10, help="Allowed relative regression per metric (default: 0.10).")
+    report.add_argument("--max-error-rate-increase", type=float, default=0.01, help="Allowed error rate increase (default: 0.01).")
+    args = parser.parse_args(argv)
+    if args.rate is not None and args.rate <= 0:
+        parser.error("--rate must be positive")
+    if args.requests is None and args.duration is None:
+        args.requests = 1000
+    if args.benchmark == "batch" and args.duration is not None and args.requests is None:
+        parser.error("the batch benchmark needs --requests")
+
+    result = run_server_benchmark(args) if args.benchmark == "server" else run_batch_benchmark(args)
+    config = {key: value for key, value in vars(args).items() if key not in ("output", "baseline")}
+    output = {
+        "benchmark": args.benchmark,
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "git_commit": _git_commit(),
+        "config": config,
+        **result,
+    }
+
+    latency = result["latency_ms"]
+    print(
+        f"📊 {result['succeeded']}/{result['requests']} ok in {result['duration_s']:.1f}s: "
+        f"{result['throughput_rps']:.1f} req/s, p50 {latency['p50'] or 0:.0f} ms, p95 {latency['p95'] or 0:.0f} ms, "
+        f"p99 {latency['p99'] or 0:.0f} ms, errors {result['error_rate']:.2%}"
+    )
+    if result["cpu_seconds"] is not None:
+        print(f"   CPU {result['cpu_seconds']:.1f}s, peak RSS {result['peak_rss_mb'] or 0:.0f} MB")
+
+    output_path = Path(args.output) if args.output else RESULTS_DIR / f"{args.benchmark}-{datetime.now():%Y%m%d-%H%M%S}.json"
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    output_path.write_text(json.dumps(output, indent=2, sort_keys=True) + "\n", encoding="utf-8")
+    print(f"💾 Results saved to {output_path}")
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+        if (baseline.get("benchmark"), baseline.get("mode")) != (args.benchmark, result.get("mode")):
+            print("⚠️ The baseline is from a different benchmark or load mode; the comparison may not be meaningful.")
+        regressions = compare(result, baseline, args.max_regression, args.max_error_rate_increase)
+        if regressions:
+            print(f"❌ Regressions against {args.baseline}:")
+            for regression in regressions:
+                print(f"   {regression}")
+            return 1
+        print(f"✅ No regression beyond {args.max_regression:.0%} against {args.baseline}.")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
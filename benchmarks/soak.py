@@ -0,0 +1,136 @@
+"""
+Soak test for memory and file-handle growth in the server.
+
+Sends many requests to the FastAPI app in-process, against the offline fake
+backend, mixing requests with no base images, a base image file on disk and
+unique base64 uploads (so every upload is decoded again). RSS and the number
+of open file descriptors are sampled as it runs. After a warm-up, the median
+RSS of the later samples must stay within a tolerance of the earlier ones and
+the open file count must stay within its own tolerance.
+
+Usage:
+    python benchmarks/soak.py
+    python benchmarks/soak.py --requests 2000 --image-size 4000x3000
+"""
+import argparse
+import base64
+import os
+import statistics
+import sys
+import tempfile
+from io import BytesIO
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+
+def rss_mb():
+    """Resident set size of this process in MB, from /proc (Linux) or the peak RSS elsewhere."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except OSError:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def open_fds():
+    """Number of open file descriptors, or None where /proc/self/fd and /dev/fd are unavailable."""
+    for fd_dir in ("/proc/self/fd", "/dev/fd"):
+        try:
+            return len(os.listdir(fd_dir))
+        except OSError:
+            continue
+    return None
+
+
+def make_fixture(directory, width, height):
+    """Writes a noisy JPEG of the given size and returns its path and bytes."""
+    from PIL import Image
+    image = Image.effect_noise((width, height), 64).convert("RGB")
+    buffer = BytesIO()
+    image.save(buffer, "JPEG", quality=90)
+    path = Path(directory) / "soak_base.jpg"
+    path.write_bytes(buffer.getvalue())
+    return path, buffer.getvalue()
+
+
+def build_request(index, base_path, jpeg_bytes):
+    kind = index % 3
+    request = {"prompt": f"soak request {index}", "response_format": "base64", "save_to_disk": False}
+    if kind == 1:
+        request["base_image_paths"] = [str(base_path)]
+    elif kind == 2:
+        # Bytes after the JPEG end marker are ignored by decoders but make every upload unique
+        request["base_images_b64"] = [base64.b64encode(jpeg_bytes + index.to_bytes(4, "big")).decode("ascii")]
+    if index % 10 == 0:
+        request["response_format"] = "path"
+        request["save_to_disk"] = True
+    return request
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fail if server RSS or open files grow under sustained load.")
+    parser.add_argument("--requests", type=int, default=10000, help="Requests to send (default: 10000).")
+    parser.add_argument("--image-size", default="2400x1600", help="Base image size, WIDTHxHEIGHT (default: 2400x1600).")
+    parser.add_argument("--sample-every", type=int, default=500, help="Requests between samples (default: 500).")
+    parser.add_argument("--warmup", type=float, default=0.2, help="Fraction of requests before the baseline sample.")
+    parser.add_argument("--max-rss-growth-mb", type=float, default=64.0, help="Allowed growth in median RSS after warm-up.")
+    parser.add_argument("--max-fd-growth", type=int, default=8, help="Allowed growth in open file descriptors after warm-up.")
+    args = parser.parse_args(argv)
+    width, height = (int(v) for v in args.image_size.lower().split("x"))
+
+    workdir = tempfile.mkdtemp(prefix="soak_")
+    os.environ["IMAGE_BACKEND"] = "fake"
+    os.environ.setdefault("FAKE_LATENCY", "0")
+    os.environ.setdefault("OUTPUT_STORE_DIR", str(Path(workdir) / "store"))
+    # Keep the encoded-payload cache small so it fills up early in the run
+    os.environ.setdefault("BASE_IMAGE_CACHE_MB", "16")
+    sys.path.insert(0, str(REPO_ROOT))
+
+    from fastapi.testclient import TestClient
+    import server
+
+    base_path, jpeg_bytes = make_fixture(workdir, width, height)
+    print(f"🧪 Soak: {args.requests} requests, {width}x{height} JPEG base image, work dir {workdir}")
+
+    samples = []
+    failures = 0
+    baseline_at = int(args.requests * args.warmup)
+    with TestClient(server.app) as client:
+        for index in range(args.requests):
+            response = client.post("/generate-image/", json=build_request(index, base_path, jpeg_bytes))
+            if response.status_code != 200:
+                failures += 1
+                if failures <= 5:
+                    print(f"⚠️ Request {index} failed with {response.status_code}: {response.text[:200]}")
+            if (index + 1) % args.sample_every == 0 or index + 1 == baseline_at:
+                samples.append((index + 1, rss_mb(), open_fds()))
+                print(f"   {index + 1:>6} requests: RSS {samples[-1][1]:7.1f} MB, open files {samples[-1][2]}")
+
+    baseline = next((s for s in samples if s[0] >= baseline_at), samples[0])
+    after = [s for s in samples if s[0] >= baseline[0]]
+    # The allocator makes single RSS samples swing by tens of MB; compare the halves' medians to see a trend
+    half = max(1, len(after) // 2)
+    rss_growth = statistics.median(s[1] for s in after[-half:]) - statistics.median(s[1] for s in after[:half])
+    fd_growth = max(s[2] for s in after) - baseline[2] if baseline[2] is not None else 0
+    print(f"📈 After warm-up: RSS +{rss_growth:.1f} MB, open files +{fd_growth}, {failures} failed requests")
+
+    failed = False
+    if failures:
+        print(f"❌ {failures} requests failed.")
+        failed = True
+    if rss_growth > args.max_rss_growth_mb:
+        print(f"❌ RSS grew by more than {args.max_rss_growth_mb:.0f} MB.")
+        failed = True
+    if fd_growth > args.max_fd_growth:
+        print(f"❌ Open file descriptors grew by more than {args.max_fd_growth}.")
+        failed = True
+    if not failed:
+        print("✅ Memory and file handles stayed flat.")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,9 +1,22 @@
+import argparse
+import asyncio
+import base64
+import binascii
+import functools
+import hashlib
+import hmac
+import json
+import logging
+import os
+import uuid
 import uvicorn
 import time
-from fastapi import FastAPI, HTTPException
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import FastAPI, Header, HTTPException, Query, Request
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
 from pydantic import BaseModel, Field
-from typing import List, Optional
-from PIL import Image
+from typing import Dict, List, Literal, Optional
 from pathlib import Path
 
 # Add the src directory to the Python path to allow for package imports
@@ -11,19 +24,180 @@ import sys
 sys.path.append(str(Path(__file__).resolve().parent))
 
 # Import your existing, well-structured image generation logic
-from src.image_generator.core import generate_image
+from src.image_generator.core import (
+    MAX_VARIANTS, achat_generate_image, agenerate_image, astream_variants, create_chat, get_backend, get_shared_state,
+    limiter, set_backend
+)
+from src.image_generator.resilience import GenerationError, QUOTA, TRANSIENT, SAFETY, FATAL
+from src.image_generator.images import DecodeBudgetBusyError, ImageTooLargeError, prepare_base_image, request_budget
+from src.image_generator import metrics
+from src.image_generator.batch import BatchProgress, run_items
+from src.image_generator.events import EventStream
+from src.image_generator.jobs import JobQueue, QueueFullError, SUCCEEDED, FAILED
+from src.image_generator.logs import configure_logging, get_logger, log_event
+from src.image_generator.profiling import ProfilerBusyError, collapsed, sample_stacks
+from src.image_generator.sessions import SessionStore
+from src.image_generator.store import get_store
+from src.image_generator.tracing import end_trace, start_trace
+from src.image_generator.variants import rank
+
+# The server logs JSON lines (LOG_FORMAT=text for plain messages); each carries its request id
+configure_logging("json")
+logger = get_logger("server")
 
 # --- API Data Models ---
 # Define what the input to our API should look like
 class ImageRequest(BaseModel):
     prompt: str
     base_image_paths: Optional[List[str]] = Field(default=None, description="List of local file paths for base images.")
+    base_images_b64: Optional[List[str]] = Field(default=None, description="Base images uploaded inline as base64 strings or data URLs.")
+    response_format: Literal["path", "base64", "bytes"] = Field(default="path", description="'path' returns the saved file path, 'base64' embeds the image in the JSON, 'bytes' returns the raw image as the response body.")
+    save_to_disk: bool = Field(default=True, description="Persist the generated image under output/. Can be disabled for 'base64' and 'bytes' responses.")
+    bypass_cache: bool = Field(default=False, description="Skip the response cache (when IMAGE_CACHE_DIR enables it) and force a fresh sample; the new result still refreshes the cache.")
 
 # Define what the output from our API will look like
 class ImageResponse(BaseModel):
     status: str
     message: str
     image_path: Optional[str] = None
+    image_base64: Optional[str] = None
+    mime_type: Optional[str] = None
+
+class VariantsRequest(ImageRequest):
+    count: int = Field(default=4, ge=1, le=MAX_VARIANTS, description="Number of variants to generate concurrently.")
+    score: Optional[Literal["size", "entropy"]] = Field(default=None, description="Cheap local score to rank the variants by: 'size' (encoded bytes) or 'entropy' (pixel histogram).")
+    seed: Optional[int] = Field(default=None, description="Base sampling seed. Each model call asking for n candidates uses seed + (its first variant's position), i.e. seed + i * n for call i (seed + i with one candidate per call). Every variant reports its call's seed and candidate number. Defaults to a random seed.")
+    stream: bool = Field(default=False, description="Stream one NDJSON line per variant as it completes, followed by a summary line with the ranking.")
+    priority: Literal["high", "normal", "low"] = Field(default="normal", description="Queue priority of the variants' model calls.")
+
+class VariantResponse(BaseModel):
+    index: int
+    status: str
+    seed: int
+    candidate: int
+    score: Optional[float] = None
+    latency: Optional[float] = None
+    image_path: Optional[str] = None
+    image_base64: Optional[str] = None
+    mime_type: Optional[str] = None
+    error: Optional[str] = None
+
+class VariantsResponse(BaseModel):
+    status: str
+    message: str
+    ranking: List[int]
+    variants: List[VariantResponse]
+
+class BatchItem(BaseModel):
+    prompt: str
+    base_image_paths: Optional[List[str]] = Field(default=None, description="Local file paths of this item's base images.")
+    output_name: Optional[str] = Field(default=None, description="File name inside the batch's output folder. Defaults to batch_<index>.png.")
+
+class BatchRequest(BaseModel):
+    items: List[BatchItem] = Field(min_length=1, max_length=int(os.getenv("BATCH_MAX_ITEMS", "10000")))
+    concurrency: int = Field(default=4, ge=1, le=int(os.getenv("BATCH_MAX_CONCURRENCY", "32")), description="Generations in flight for this batch.")
+    requests_per_minute: Optional[float] = Field(default=None, gt=0, description="Cap on requests started per minute.")
+    priority: Literal["high", "normal", "low"] = Field(default="low", description="Queue priority of the batch's generations; 'low' lets interactive requests go first.")
+
+class BatchStatusResponse(BaseModel):
+    batch_id: str
+    status: str
+    total: int
+    queued: int
+    running: int
+    succeeded: int
+    failed: int
+    output_dir: str
+    manifest_path: str
+    events_url: str
+
+class JobRequest(ImageRequest):
+    priority: Literal["high", "normal", "low"] = Field(default="normal", description="Queue priority for this job.")
+
+class JobStatusResponse(BaseModel):
+    job_id: str
+    status: str
+    priority: str
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    wait_seconds: float
+    image_path: Optional[str] = None
+    error: Optional[str] = None
+
+class SessionResponse(ImageResponse):
+    session_id: str
+    turn: int
+
+class SessionStatusResponse(BaseModel):
+    session_id: str
+    turns: int
+    prompts: List[str]
+    created_at: float
+    last_used: float
+    memory_bytes: int
+    image_path: Optional[str] = None
+    mime_type: Optional[str] = None
+
+class OutputRecord(BaseModel):
+    digest: str
+    path: str
+    prompt: str
+    base_hashes: List[str]
+    model: Optional[str] = None
+    mime_type: Optional[str] = None
+    size_bytes: int
+    width: Optional[int] = None
+    height: Optional[int] = None
+    latency: Optional[float] = None
+    created_at: float
+
+class StatsResponse(BaseModel):
+    coalesced_requests: int
+    inflight_requests: int
+    concurrency_limit: int
+    queue_depth: int
+    running_jobs: int
+    workers: int
+    oldest_wait_seconds: float
+    active_sessions: int
+    session_memory_bytes: int
+    sessions_expired: int
+    sessions_evicted: int
+    worker_pid: int
+    shared_counters: Dict[str, int] = Field(default_factory=dict, description="Counters summed across all workers sharing SHARED_STATE_PATH.")
+
+# HTTP status returned for each class of generation error
+ERROR_STATUS_CODES = {QUOTA: 429, TRANSIENT: 503, SAFETY: 422, FATAL: 500}
+
+# --- Request coalescing ---
+class SingleFlight:
+    """
+    Lets identical concurrent requests share one execution.
+
+    The first caller for a key starts the work; every duplicate that arrives
+    while it is still running awaits the same result instead of starting its own.
+    """
+
+    def __init__(self):
+        self._inflight = {}
+        self.coalesced = 0
+
+    async def run(self, key, factory):
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # Shield so one disconnecting caller does not cancel the work for the others
+        return await asyncio.shield(task)
+
+    def __len__(self):
+        return len(self._inflight)
+
+single_flight = SingleFlight()
 
 # --- FastAPI Application ---
 app = FastAPI(
@@ -32,59 +206,762 @@ app = FastAPI(
     version="1.0.0"
 )
 
-@app.post("/generate-image/", response_model=ImageResponse)
-async def create_image_endpoint(request: ImageRequest):
+@app.middleware("http")
+async def request_timing_middleware(request: Request, call_next):
+    """
+    Traces each request: every timed stage (queue, load, encode, model, decode, save)
+    is summed per request and returned in a Server-Timing header together with the
+    request id (taken from X-Request-ID when the caller sends one). The same timings
+    are logged as a "request_finished" event.
+    """
+    trace, token = start_trace(request.headers.get("x-request-id"))
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        response.headers["Server-Timing"] = trace.server_timing()
+        response.headers["X-Request-ID"] = trace.request_id
+        return response
+    finally:
+        log_event(
+            logger, logging.INFO, f"{request.method} {request.url.path} {status} in {trace.elapsed * 1000:.0f} ms",
+            "request_finished", method=request.method, path=request.url.path, status=status,
+            timings_ms=trace.timings_ms(),
+        )
+        end_trace(token)
+
+def _load_base_images(base_image_paths, budget=None):
+    """
+    Loads, downsizes and encodes the requested base images.
+
+    Encoded payloads are cached by path and modification time, so a reference
+    image reused across requests is only encoded once. Runs in a worker thread
+    so slow disks do not stall the event loop. Images too large for the
+    request's memory budget are rejected with 413, and images that cannot get
+    room in the server-wide decode budget in time with 503.
+    """
+    for path_str in base_image_paths:
+        if not Path(path_str).exists():
+            raise HTTPException(status_code=400, detail=f"File not found: {path_str}")
+    encoded_images = []
+    for path_str in base_image_paths:
+        try:
+            encoded_images.append(prepare_base_image(path_str, budget=budget))
+        except DecodeBudgetBusyError as e:
+            raise HTTPException(status_code=503, detail=f"Server is busy decoding other images: {e}")
+        except ImageTooLargeError as e:
+            raise HTTPException(status_code=413, detail=f"Image {path_str} is too large: {e}")
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Failed to open image {path_str}: {e}")
+    saved = sum(image.bytes_saved for image in encoded_images)
+    log_event(
+        logger, logging.INFO, f"📦 Base images: {saved / 1024:.0f} KB saved by preprocessing",
+        "base_images_loaded", count=len(encoded_images), bytes_saved=saved,
+    )
+    return encoded_images
+
+def _decode_base_images(base_images_b64, budget=None):
+    """
+    Decodes, downsizes and encodes base images uploaded as base64.
+
+    Accepts plain base64 or data URLs. Runs in a worker thread.
     """
-    Generates an image based on a prompt and optional base images.
-    Returns the path to the saved image.
+    encoded_images = []
+    for position, data in enumerate(base_images_b64, start=1):
+        if data.startswith("data:"):
+            data = data.partition(",")[2]
+        try:
+            raw_bytes = base64.b64decode(data, validate=True)
+        except (binascii.Error, ValueError) as e:
+            raise HTTPException(status_code=400, detail=f"Base image {position} is not valid base64: {e}")
+        try:
+            encoded_images.append(prepare_base_image(raw_bytes, budget=budget))
+        except DecodeBudgetBusyError as e:
+            raise HTTPException(status_code=503, detail=f"Server is busy decoding other images: {e}")
+        except ImageTooLargeError as e:
+            raise HTTPException(status_code=413, detail=f"Base image {position} is too large: {e}")
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Base image {position} could not be decoded: {e}")
+    return encoded_images
+
+def _request_key(request):
+    """
+    Identifies requests that can share one generation.
+
+    Uploads are keyed by a hash of their base64 text. Hashing several MB takes
+    long enough to stall other requests, so call this off the event loop when
+    the request carries uploads.
     """
-    print(f"Received request to generate image with prompt: {request.prompt}")
-    
-    pil_images = []
+    uploads = tuple(hashlib.sha256(data.encode()).hexdigest() for data in request.base_images_b64 or ())
+    return (request.prompt, tuple(request.base_image_paths or ()), uploads, request.save_to_disk, request.bypass_cache)
+
+def _save_generated_image(generated_image, prompt, base_images, latency):
+    """
+    Writes a generated image's bytes to the output store and returns its path.
+
+    The bytes are written exactly as the model returned them; no decode or
+    recompression happens on the request path. Files are named by content
+    hash, so concurrent requests never collide.
+    """
+    return get_store().put(generated_image, prompt, base_images=base_images, model=get_backend().model, latency=latency)
+
+async def _prepare_request_images(request):
+    """Loads path and base64 base images for a request, off the event loop, within one memory budget."""
+    base_images = []
+    budget = request_budget()
     if request.base_image_paths:
-        for path_str in request.base_image_paths:
-            path = Path(path_str)
-            if not path.exists():
-                raise HTTPException(status_code=400, detail=f"File not found: {path_str}")
-            try:
-                pil_images.append(Image.open(path))
-            except Exception as e:
-                raise HTTPException(status_code=500, detail=f"Failed to open image {path_str}: {e}")
+        base_images += await asyncio.to_thread(_load_base_images, request.base_image_paths, budget)
+    if request.base_images_b64:
+        base_images += await asyncio.to_thread(_decode_base_images, request.base_images_b64, budget)
+    return base_images
+
+async def _generate_and_save(request, chat=None):
+    """
+    Runs one generation end to end.
+
+    Args:
+        request (ImageRequest): The generation request.
+        chat (optional): A refinement session's chat to send the request as its next turn.
+
+    Returns:
+        tuple: The GeneratedImage and the path it was saved to (None when save_to_disk is off).
+    """
+    base_images = await _prepare_request_images(request)
+    # Finished jobs keep their request for /jobs/{id}/result; drop the uploads, which are encoded now
+    request.base_images_b64 = None
+    started = time.perf_counter()
 
     try:
-        # Call your core logic
-        generated_image = generate_image(
-            prompt=request.prompt,
-            base_images=pil_images if pil_images else None
-        )
+        # Call your core logic without blocking the event loop
+        if chat is not None:
+            generated_image = await achat_generate_image(
+                chat,
+                prompt=request.prompt,
+                base_images=base_images if base_images else None,
+                raw=True,
+                raise_errors=True
+            )
+        else:
+            generated_image = await agenerate_image(
+                prompt=request.prompt,
+                base_images=base_images if base_images else None,
+                bypass_cache=request.bypass_cache,
+                raw=True,
+                raise_errors=True
+            )
 
-        if generated_image:
+        save_path = None
+        if request.save_to_disk:
             # Save the generated image to a file
-            output_dir = Path("output")
-            output_dir.mkdir(exist_ok=True)
-            
-            # Use timestamp-based naming to guarantee uniqueness
-            timestamp = int(time.time() * 1000)  # milliseconds since epoch
-            output_filename = f"server_generated_{Path.cwd().name}_{timestamp}.png"
-            save_path = output_dir / output_filename
-            
-            generated_image.save(save_path)
-            
-            print(f"✅ Image successfully generated and saved to {save_path}")
-            return {"status": "success", "message": "Image generated successfully.", "image_path": str(save_path)}
+            save_path = await asyncio.to_thread(
+                _save_generated_image, generated_image, request.prompt, base_images, time.perf_counter() - started
+            )
+            log_event(
+                logger, logging.INFO, f"✅ Image successfully generated and saved to {save_path}",
+                "image_generated", path=str(save_path), size_bytes=len(generated_image.data),
+            )
         else:
-            # This handles cases where the model returns an empty response (e.g., safety filters)
-            print("❌ Image generation failed. The model may have returned an empty response.")
-            raise HTTPException(status_code=500, detail="Image generation failed. The model may have returned an empty response due to safety filters or other issues.")
+            log_event(
+                logger, logging.INFO,
+                f"✅ Image successfully generated ({len(generated_image.data) / 1024:.0f} KB, kept in memory)",
+                "image_generated", path=None, size_bytes=len(generated_image.data),
+            )
+        return generated_image, save_path
 
+    except GenerationError as e:
+        # Safety blocks, exhausted quota retries etc. map to distinct status codes
+        log_event(
+            logger, logging.ERROR, f"❌ Image generation failed ({e.kind}): {e}", "generation_failed", kind=e.kind, error=str(e)
+        )
+        raise HTTPException(status_code=ERROR_STATUS_CODES[e.kind], detail=f"Image generation failed ({e.kind}): {e}")
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"An unexpected error occurred: {e}")
+        logger.exception(f"An unexpected error occurred: {e}", extra={"event": "unexpected_error"})
         raise HTTPException(status_code=500, detail=str(e))
 
+async def _run_job(request):
+    """Job handler shared by /generate-image/ and /jobs."""
+    generated_image, save_path = await _generate_and_save(request)
+    if request.response_format == "path":
+        generated_image = None  # only the path is returned, so do not keep the bytes around
+    return generated_image, save_path
+
+async def _run_session_turn(turn):
+    """Job handler for one refinement turn; `turn` is a (session, request) pair."""
+    session, request = turn
+    return await _generate_and_save(request, chat=session.chat)
+
+async def _run_model_call(call):
+    """Job handler for one model call of a fan-out; `call` is an async function without arguments."""
+    return await call()
+
+def _queued(priority):
+    """Returns a `submit` for astream_variants that runs each model call as a job in the shared queue."""
+    def submit(call):
+        return job_queue.wait(_submit_job(call, priority, handler=_run_model_call), forget=True)
+    return submit
+
+async def _variant_results(request, base_images):
+    """
+    Generates a request's variants concurrently and yields each as soon as it is saved.
+
+    Yields:
+        tuple: The Variant and its VariantResponse fields.
+    """
+    started = time.perf_counter()
+    failed = 0
+    async for variant in astream_variants(
+        request.prompt, request.count, base_images or None, raw=True, score=request.score, seed=request.seed,
+        submit=_queued(request.priority),
+    ):
+        result = {"index": variant.index, "status": "success", "seed": variant.seed, "candidate": variant.candidate,
+                  "score": variant.score, "latency": round(variant.latency, 3)}
+        if variant.ok and request.save_to_disk:
+            try:
+                save_path = await asyncio.to_thread(
+                    _save_generated_image, variant.image, request.prompt, base_images, variant.latency
+                )
+                result["image_path"] = str(save_path)
+            except Exception as e:
+                variant.error = GenerationError(f"Could not save the image: {e}", FATAL)
+        if variant.ok:
+            if request.response_format == "base64":
+                result["image_base64"] = base64.b64encode(variant.image.data).decode("ascii")
+            result["mime_type"] = variant.image.mime_type
+            variant.image = None  # the response line holds everything the caller gets
+        else:
+            failed += 1
+            result["status"] = "failed"
+            result["error"] = f"{variant.error.kind}: {variant.error}"
+        yield variant, result
+    log_event(
+        logger, logging.INFO, f"🎨 {request.count} variant(s) requested, {failed} failed, in {time.perf_counter() - started:.2f}s",
+        "variants_finished", count=request.count, failed=failed, seconds=round(time.perf_counter() - started, 3),
+    )
+
+async def _stream_variants(results):
+    """Renders variant results as NDJSON: one line per variant as it completes, then the ranking."""
+    variants = []
+    async for variant, result in results:
+        variants.append(variant)
+        yield json.dumps(result) + "\n"
+    status = "success" if any(variant.ok for variant in variants) else "failed"
+    yield json.dumps({"status": status, "ranking": [variant.index for variant in rank(variants)]}) + "\n"
+
+def _validate_request(request):
+    if request.response_format == "path" and not request.save_to_disk:
+        raise HTTPException(status_code=400, detail="response_format 'path' requires save_to_disk.")
+
+def _image_response(request, generated_image, save_path):
+    """Builds the response in the format the request asked for."""
+    image_path = str(save_path) if save_path is not None else None
+    if request.response_format == "bytes":
+        headers = {"X-Image-Path": image_path} if image_path else None
+        return Response(content=generated_image.data, media_type=generated_image.mime_type, headers=headers)
+    response = {"status": "success", "message": "Image generated successfully.", "image_path": image_path}
+    if request.response_format == "base64":
+        response["image_base64"] = base64.b64encode(generated_image.data).decode("ascii")
+        response["mime_type"] = generated_image.mime_type
+    return response
+
+# Every generation runs through this pool, so its size governs server capacity. By default it
+# matches the limiter's starting limit (GEMINI_CONCURRENCY): the model calls the server makes
+# before the limiter has seen any feedback. Work beyond that waits here, where priorities and
+# the queue depth apply, instead of piling up inside the limiter. Set JOB_WORKERS to go higher.
+job_queue = JobQueue(
+    _run_job,
+    workers=int(os.getenv("JOB_WORKERS") or limiter.stats()["limit"]),
+    max_queued=int(os.getenv("JOB_QUEUE_MAX", "1000")),
+    max_finished=int(os.getenv("JOB_MAX_FINISHED", "1000")),
+)
+
+# Refinement sessions keep their chat and latest image server-side between turns
+session_store = SessionStore.from_env(create_chat)
+
+def _submit_job(request, priority, handler=None):
+    try:
+        return job_queue.submit(request, priority, handler)
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+def _job_status(job):
+    error = None
+    if job.error is not None:
+        error = job.error.detail if isinstance(job.error, HTTPException) else str(job.error)
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "priority": job.priority,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+        "wait_seconds": job.wait_seconds,
+        "image_path": str(job.result[1]) if job.result is not None and job.result[1] is not None else None,
+        "error": error,
+    }
+
+def _get_job(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+    return job
+
+@app.post("/generate-image/", response_model=ImageResponse)
+async def create_image_endpoint(request: ImageRequest):
+    """
+    Generates an image based on a prompt and optional base images, given as
+    server-side paths or uploaded inline as base64.
+    Returns the path to the saved image, the image as base64, or the raw image bytes.
+
+    Identical requests (same prompt and base images) that arrive while one
+    is already in flight wait for that result instead of calling the model again.
+    """
+    log_event(
+        logger, logging.INFO, f"Received request to generate image with prompt: {request.prompt}",
+        "request_received", prompt=request.prompt,
+    )
+    _validate_request(request)
+
+    # The generation itself always keeps the bytes so every coalesced caller can get its own format
+    generation = request.model_copy(update={"response_format": "bytes"})
+    key = await asyncio.to_thread(_request_key, request) if request.base_images_b64 else _request_key(request)
+    generated_image, save_path = await single_flight.run(
+        key, lambda: job_queue.wait(_submit_job(generation, "normal"), forget=True)
+    )
+    return _image_response(request, generated_image, save_path)
+
+@app.post("/variants", response_model=VariantsResponse)
+async def variants_endpoint(request: VariantsRequest):
+    """
+    Generates `count` variants of a prompt concurrently, so k variants take about
+    as long as one. Every model call of the fan-out runs as a job in the shared
+    queue, at the request's `priority`. Models that return several candidates
+    per call are asked for them in one response, and every image part is kept.
+
+    Returns the variants ranked by the optional `score`, best first. With
+    `stream`, each variant is sent as an NDJSON line the moment it is ready,
+    followed by a {"status", "ranking"} line. Variants are saved like single
+    generations and returned as paths or base64; 'bytes' is not supported.
+    """
+    log_event(
+        logger, logging.INFO, f"Received request for {request.count} variants of prompt: {request.prompt}",
+        "variants_received", prompt=request.prompt, count=request.count,
+    )
+    _validate_request(request)
+    if request.response_format == "bytes":
+        raise HTTPException(status_code=400, detail="response_format 'bytes' cannot carry several images; use 'path' or 'base64'.")
+    # Each model call of the fan-out is a job; refuse up front rather than partway through a stream
+    if not job_queue.has_room(request.count):
+        raise HTTPException(status_code=503, detail=f"The job queue has no room for {request.count} more jobs.")
+    base_images = await _prepare_request_images(request)
+    request.base_images_b64 = None
+    results = _variant_results(request, base_images)
+    if request.stream:
+        return StreamingResponse(_stream_variants(results), media_type="application/x-ndjson")
+
+    collected = [item async for item in results]
+    variants = [variant for variant, _ in collected]
+    if not any(variant.ok for variant in variants):
+        error = variants[0].error
+        raise HTTPException(status_code=ERROR_STATUS_CODES[error.kind], detail=f"Image generation failed ({error.kind}): {error}")
+    ranking = [variant.index for variant in rank(variants)]
+    by_index = {variant.index: result for variant, result in collected}
+    failed = sum(not variant.ok for variant in variants)
+    return {
+        "status": "success",
+        "message": f"Generated {len(variants) - failed} of {len(variants)} variants.",
+        "ranking": ranking,
+        "variants": [by_index[index] for index in ranking],
+    }
+
+@app.post("/jobs", response_model=JobStatusResponse, status_code=202)
+async def submit_job_endpoint(request: JobRequest):
+    """
+    Queues an image generation and returns its job id immediately.
+    Poll GET /jobs/{job_id} for its status and GET /jobs/{job_id}/result for the image path.
+    """
+    _validate_request(request)
+    job = _submit_job(request, request.priority)
+    log_event(
+        logger, logging.INFO, f"Queued job {job.id} ({request.priority}) with prompt: {request.prompt}",
+        "job_queued", job_id=job.id, priority=request.priority, prompt=request.prompt,
+    )
+    return _job_status(job)
+
+@app.get("/jobs/{job_id}", response_model=JobStatusResponse)
+async def job_status_endpoint(job_id: str):
+    """
+    Returns a job's status, timestamps and time spent waiting in the queue.
+    """
+    return _job_status(_get_job(job_id))
+
+@app.get("/jobs/{job_id}/result", response_model=ImageResponse)
+async def job_result_endpoint(job_id: str):
+    """
+    Returns a finished job's image in the format the job asked for.
+    Answers 409 while the job is still queued or running, and the job's error status if it failed.
+    """
+    job = _get_job(job_id)
+    if job.status == SUCCEEDED:
+        return _image_response(job.payload, *job.result)
+    if job.status == FAILED:
+        if isinstance(job.error, HTTPException):
+            raise job.error
+        raise HTTPException(status_code=500, detail=str(job.error))
+    raise HTTPException(status_code=409, detail=f"Job {job_id} is still {job.status}.")
+
+# --- Batches ---
+async def _run_batch_item(payload):
+    """Job handler for one batch item; `payload` is a (prompt, base images) pair."""
+    prompt, base_images = payload
+    return await agenerate_image(prompt, base_images=base_images, raw=True, raise_errors=True)
+
+class BatchRun:
+    """
+    A batch submitted through the server, driven by the batch engine on the batch executor.
+
+    The engine's threads only orchestrate: every item's generation is submitted
+    to the shared job queue, so batches count against the same worker bound as
+    all other generations. The engine publishes its progress on `events`; a
+    silent BatchProgress listens to it for the status endpoint, and SSE
+    clients subscribe to it.
+    """
+
+    def __init__(self, total, priority, loop):
+        self.id = uuid.uuid4().hex
+        self.priority = priority
+        self.loop = loop
+        self.output_dir = Path("output") / "batches" / self.id
+        self.manifest_path = self.output_dir / "batch_manifest.jsonl"
+        self.events = EventStream(max_history=int(os.getenv("BATCH_EVENT_HISTORY", "10000")))
+        self.progress = BatchProgress(total, echo=False)
+        self.events.add_listener(self.progress.handle)
+        self.task = None
+
+    @property
+    def status(self):
+        if self.task is None or not self.task.done():
+            return "running"
+        return "failed" if self.task.cancelled() or self.task.exception() is not None else "finished"
+
+    def generate(self, prompt, base_images):
+        """Generates one item through the job queue. Called from the batch engine's worker threads."""
+        return asyncio.run_coroutine_threadsafe(self._generate(prompt, base_images), self.loop).result()
+
+    async def _generate(self, prompt, base_images):
+        try:
+            job = job_queue.submit((prompt, base_images), self.priority, handler=_run_batch_item)
+        except QueueFullError as e:
+            raise GenerationError(str(e), TRANSIENT) from e
+        return await job_queue.wait(job, forget=True)
+
+    def finished(self, task):
+        """Logs the outcome once the batch engine returns."""
+        if task.cancelled() or task.exception() is not None:
+            error = "cancelled" if task.cancelled() else str(task.exception())
+            log_event(logger, logging.ERROR, f"❌ Batch {self.id} stopped: {error}", "batch_failed", batch_id=self.id, error=error)
+            return
+        progress = self.progress
+        log_event(
+            logger, logging.INFO, f"🎉 Batch {self.id} finished: {progress.succeeded} succeeded, {progress.failed} failed",
+            "batch_finished", batch_id=self.id, succeeded=progress.succeeded, failed=progress.failed,
+        )
+
+batch_runs = OrderedDict()
+BATCH_MAX_RETAINED = int(os.getenv("BATCH_MAX_RETAINED", "100"))
+
+# Batch engines run on their own threads, never on the loop's default executor that the
+# request path uses for to_thread work; at most this many batches run at once
+BATCH_MAX_RUNNING = int(os.getenv("BATCH_MAX_RUNNING", "4"))
+batch_executor = ThreadPoolExecutor(max_workers=BATCH_MAX_RUNNING, thread_name_prefix="batch")
+
+def _get_batch(batch_id):
+    run = batch_runs.get(batch_id)
+    if run is None:
+        raise HTTPException(status_code=404, detail=f"Batch not found: {batch_id}")
+    return run
+
+def _batch_status(run):
+    progress = run.progress
+    return {
+        "batch_id": run.id,
+        "status": run.status,
+        "total": progress.total,
+        "queued": progress.queued,
+        "running": progress.running,
+        "succeeded": progress.succeeded,
+        "failed": progress.failed,
+        "output_dir": str(run.output_dir),
+        "manifest_path": str(run.manifest_path),
+        "events_url": f"/batches/{run.id}/events",
+    }
+
+def _sse(event):
+    """Formats an event as a server-sent event; its id lets clients resume with Last-Event-ID."""
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+@app.post("/batches", response_model=BatchStatusResponse, status_code=202)
+async def submit_batch_endpoint(request: BatchRequest):
+    """
+    Starts a batch of generations and returns its id immediately.
+
+    Items are generated concurrently by the batch engine and saved under
+    output/batches/{batch_id}/, with a JSONL manifest. Follow progress with
+    GET /batches/{batch_id}/events (server-sent events) or poll GET /batches/{batch_id}.
+
+    Each item's generation runs as a job in the shared queue at the batch's
+    `priority`. At most BATCH_MAX_RUNNING batches run at once; further
+    submissions are refused with 503.
+    """
+    running = sum(1 for run in batch_runs.values() if not run.task.done())
+    if running >= BATCH_MAX_RUNNING:
+        raise HTTPException(status_code=503, detail=f"{running} batches are already running (BATCH_MAX_RUNNING={BATCH_MAX_RUNNING}).")
+    items = [(position, item.prompt, item.base_image_paths, item.output_name)
+             for position, item in enumerate(request.items, start=1)]
+    loop = asyncio.get_running_loop()
+    run = BatchRun(len(items), request.priority, loop)
+    # Executor threads start with an empty context, so the batch does not add its stages to this request's trace
+    run.task = loop.run_in_executor(batch_executor, functools.partial(
+        run_items,
+        items,
+        output_dir=run.output_dir,
+        concurrency=request.concurrency,
+        requests_per_minute=request.requests_per_minute,
+        manifest_path=run.manifest_path,
+        collect=False,
+        events=run.events,
+        generate=run.generate,
+    ))
+    run.task.add_done_callback(run.finished)
+    batch_runs[run.id] = run
+    while len(batch_runs) > BATCH_MAX_RETAINED:
+        oldest_id, oldest = next(iter(batch_runs.items()))
+        if not oldest.task.done():
+            break
+        del batch_runs[oldest_id]
+    log_event(
+        logger, logging.INFO, f"Started batch {run.id} with {len(items)} item(s)",
+        "batch_started", batch_id=run.id, items=len(items), concurrency=request.concurrency,
+    )
+    return _batch_status(run)
+
+@app.get("/batches/{batch_id}", response_model=BatchStatusResponse)
+async def batch_status_endpoint(batch_id: str):
+    """
+    Returns a batch's progress: items queued, running, succeeded and failed.
+    """
+    return _batch_status(_get_batch(batch_id))
+
+@app.get("/batches/{batch_id}/events")
+async def batch_events_endpoint(
+    batch_id: str,
+    after: int = Query(default=0, ge=0, description="Only send events after this id."),
+    last_event_id: Optional[str] = Header(default=None),
+):
+    """
+    Streams a batch's progress as server-sent events, one per line of work:
+    batch_started, then queued, started and finished (with latency and output
+    path) or failed (with error class) per item, and finally batch_finished.
+    Events already emitted are replayed first, so downstream work can start on
+    each image as soon as it lands. Reconnecting clients resume after their
+    Last-Event-ID. The stream ends when the batch does.
+    """
+    run = _get_batch(batch_id)
+    if last_event_id and last_event_id.isdigit():
+        after = max(after, int(last_event_id))
+
+    async def stream():
+        async for event in run.events.subscribe(after, heartbeat=float(os.getenv("SSE_HEARTBEAT_SECONDS", "15"))):
+            yield ": keep-alive\n\n" if event is None else _sse(event)
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def _get_session(session_id):
+    session = session_store.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail=f"Session not found or expired: {session_id}")
+    return session
+
+async def _session_turn(session, request):
+    """
+    Runs the next turn of a session and returns the response in the requested format.
+
+    Turns on one session run one at a time; the lock is held outside the job
+    queue so a waiting turn does not occupy a worker.
+    """
+    async with session.lock:
+        generation = request.model_copy(update={"response_format": "bytes"})
+        generated_image, save_path = await job_queue.wait(
+            _submit_job((session, generation), "normal", handler=_run_session_turn), forget=True
+        )
+        session_store.record_turn(session, request.prompt, generated_image, save_path)
+
+    response = _image_response(request, generated_image, save_path)
+    if isinstance(response, Response):
+        response.headers["X-Session-Id"] = session.id
+        response.headers["X-Session-Turn"] = str(session.turns)
+        return response
+    return {**response, "session_id": session.id, "turn": session.turns}
+
+@app.post("/sessions", response_model=SessionResponse)
+async def create_session_endpoint(request: ImageRequest):
+    """
+    Starts a refinement session with its first generation and returns the session id.
+
+    Follow-up instructions go to POST /sessions/{session_id}/turns. The server
+    keeps the conversation (including the latest image) so later turns only
+    send the new instruction. Idle sessions expire after SESSION_TTL_SECONDS.
+    """
+    _validate_request(request)
+    session = session_store.create()
+    log_event(
+        logger, logging.INFO, f"Started session {session.id} with prompt: {request.prompt}",
+        "session_started", session_id=session.id, prompt=request.prompt,
+    )
+    try:
+        return await _session_turn(session, request)
+    except Exception:
+        session_store.delete(session.id)
+        raise
+
+@app.post("/sessions/{session_id}/turns", response_model=SessionResponse)
+async def session_turn_endpoint(session_id: str, request: ImageRequest):
+    """
+    Refines the session's current image with a new instruction, optionally adding base images.
+    A failed turn leaves the session at its previous image.
+    """
+    _validate_request(request)
+    session = _get_session(session_id)
+    log_event(
+        logger, logging.INFO, f"Session {session_id} turn {session.turns + 1}: {request.prompt}",
+        "session_turn", session_id=session_id, turn=session.turns + 1, prompt=request.prompt,
+    )
+    return await _session_turn(session, request)
+
+@app.get("/sessions/{session_id}", response_model=SessionStatusResponse)
+async def session_status_endpoint(session_id: str):
+    """
+    Returns a session's prompts so far, its memory use and its latest image path.
+    """
+    session = _get_session(session_id)
+    return {
+        "session_id": session.id,
+        "turns": session.turns,
+        "prompts": session.prompts,
+        "created_at": session.created_at,
+        "last_used": session.last_used,
+        "memory_bytes": session.memory_bytes,
+        "image_path": str(session.current_path) if session.current_path is not None else None,
+        "mime_type": session.current_image.mime_type if session.current_image is not None else None,
+    }
+
+@app.get("/sessions/{session_id}/image")
+async def session_image_endpoint(session_id: str):
+    """
+    Returns the session's latest image as raw bytes.
+    """
+    session = _get_session(session_id)
+    if session.current_image is None:
+        raise HTTPException(status_code=409, detail=f"Session {session_id} has no image yet.")
+    return Response(content=session.current_image.data, media_type=session.current_image.mime_type)
+
+@app.delete("/sessions/{session_id}", status_code=204)
+async def delete_session_endpoint(session_id: str):
+    """
+    Ends a session and frees its memory.
+    """
+    if not session_store.delete(session_id):
+        raise HTTPException(status_code=404, detail=f"Session not found or expired: {session_id}")
+    return Response(status_code=204)
+
+@app.get("/outputs", response_model=List[OutputRecord])
+async def outputs_endpoint(prompt: Optional[str] = None, digest: Optional[str] = None, limit: int = 50):
+    """
+    Looks up saved outputs in the store's index, newest first, e.g. every image generated for a prompt.
+    """
+    records = await asyncio.to_thread(get_store().find, prompt=prompt, digest=digest, limit=min(limit, 1000))
+    return [{key: value for key, value in record.items() if key != "id"} for record in records]
+
+@app.get("/stats", response_model=StatsResponse)
+async def stats_endpoint():
+    """
+    Returns the coalescing counters, the adaptive concurrency limit, the job queue's depth and wait time,
+    the refinement sessions' count and memory use, and this worker's pid plus counters shared by all workers.
+    """
+    shared = get_shared_state()
+    shared_counters = await asyncio.to_thread(shared.counters) if shared else {}
+    return {
+        "coalesced_requests": single_flight.coalesced,
+        "inflight_requests": len(single_flight),
+        "concurrency_limit": limiter.stats()["limit"],
+        **job_queue.stats(),
+        **session_store.stats(),
+        "worker_pid": os.getpid(),
+        "shared_counters": shared_counters,
+    }
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """
+    Exposes request outcomes, per-stage latency histograms, the in-flight gauge
+    and byte counters in the Prometheus text format.
+    """
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+@app.get("/debug/profile", response_class=PlainTextResponse)
+async def profile_endpoint(
+    seconds: float = Query(default=10.0, gt=0, le=60, description="How long to sample."),
+    interval_ms: float = Query(default=5.0, ge=1, le=1000, description="Milliseconds between samples."),
+    x_debug_token: Optional[str] = Header(default=None),
+):
+    """
+    Captures a sampled CPU profile of this worker process for `seconds` and returns
+    it as collapsed stacks ("thread;outer;...;inner count" per line), ready for
+    flamegraph.pl or speedscope.
+
+    Disabled (404) unless DEBUG_PROFILE_TOKEN is set; callers must send the same
+    value in the X-Debug-Token header. One capture runs at a time (409 otherwise).
+    """
+    expected = os.getenv("DEBUG_PROFILE_TOKEN")
+    if not expected:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not x_debug_token or not hmac.compare_digest(x_debug_token.encode(), expected.encode()):
+        raise HTTPException(status_code=403, detail="Invalid debug token.")
+    log_event(logger, logging.WARNING, f"Capturing a {seconds:.0f}s CPU profile", "profile_started", seconds=seconds)
+    try:
+        counts, rounds = await asyncio.to_thread(sample_stacks, seconds, interval_ms / 1000)
+    except ProfilerBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return PlainTextResponse(collapsed(counts), headers={"X-Profile-Samples": str(rounds), "X-Profile-PID": str(os.getpid())})
+
 # --- Main entry point to run the server ---
 if __name__ == "__main__":
-    print("Starting Gemini Image Generation Server (MCP)...")
-    print("Your CrewAI agents can now make requests to http://127.0.0.1:8000/generate-image/")
-    print("Open your browser to http://127.0.0.1:8000/docs for interactive API documentation.")
-    # Uvicorn is an ASGI server that runs our FastAPI application
-    uvicorn.run(app, host="127.0.0.1", port=8000)
+    parser = argparse.ArgumentParser(description="Gemini Image Generation Server (MCP)")
+    parser.add_argument("--backend", choices=["gemini", "fake"], help="Image backend to use (default: IMAGE_BACKEND or 'gemini').")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes. With more than one, workers share the rate limit (and, with IMAGE_CACHE_DIR set, the response cache) through SHARED_STATE_PATH.")
+    args = parser.parse_args()
+    if args.backend:
+        set_backend(args.backend)
+
+    log_event(logger, logging.INFO, "Starting Gemini Image Generation Server (MCP)...", "server_starting",
+              host=args.host, port=args.port, workers=args.workers)
+    logger.info(f"Your CrewAI agents can now make requests to http://{args.host}:{args.port}/generate-image/")
+    logger.info(f"Open your browser to http://{args.host}:{args.port}/docs for interactive API documentation.")
+    if args.workers > 1:
+        # Workers are separate processes that import this module again, so pass settings through the environment
+        if args.backend:
+            os.environ["IMAGE_BACKEND"] = args.backend
+        # The response cache stays opt-in: without IMAGE_CACHE_DIR workers share only the rate limit and counters
+        state_dir = Path(os.getenv("IMAGE_CACHE_DIR") or ".image_cache")
+        os.environ.setdefault("SHARED_STATE_PATH", str(state_dir / "shared_state.sqlite3"))
+        logger.info(f"👥 Starting {args.workers} workers sharing {os.environ['SHARED_STATE_PATH']}")
+        if not os.getenv("IMAGE_CACHE_DIR"):
+            logger.info("ℹ️ IMAGE_CACHE_DIR is not set, so identical prompts are generated by each worker; set it to share results.")
+        logger.warning("⚠️ Jobs and refinement sessions live in the worker that created them; route their follow-up calls to the same worker.")
+        uvicorn.run("server:app", host=args.host, port=args.port, workers=args.workers, app_dir=str(Path(__file__).resolve().parent))
+    else:
+        # Uvicorn is an ASGI server that runs our FastAPI application
+        uvicorn.run(app, host=args.host, port=args.port)
@@ -0,0 +1,251 @@
+import asyncio
+import hashlib
+import math
+import os
+import random
+import threading
+import time
+from io import BytesIO
+
+# google.genai and PIL are imported on first use; importing the SDK alone takes most of a second
+
+DEFAULT_MODEL = "gemini-2.5-flash-image-preview"
+
+
+class GeminiBackend:
+    """
+    Talks to the real Gemini API through the google-genai SDK.
+    """
+
+    name = "gemini"
+
+    def __init__(self, api_key=None, model=None, max_candidates=None):
+        self.model = model or os.getenv("GEMINI_MODEL", DEFAULT_MODEL)
+        # Image models answer with one candidate unless the model is known to support more
+        self.max_candidates = max_candidates or int(os.getenv("GEMINI_MAX_CANDIDATES", "1"))
+        self._api_key = api_key
+        self._client = None
+
+    @property
+    def client(self):
+        """The SDK client, created on first use so selecting another backend needs no key."""
+        if self._client is None:
+            from google import genai
+            self._client = genai.Client(api_key=self._api_key or os.getenv("GOOGLE_GENAI_API_KEY"))
+        return self._client
+
+    @staticmethod
+    def _config(candidate_count, seed):
+        """Sampling options for a call, or None to use the model's defaults."""
+        if candidate_count is None and seed is None:
+            return None
+        from google.genai import types
+        return types.GenerateContentConfig(candidate_count=candidate_count, seed=seed)
+
+    def generate_content(self, contents, candidate_count=None, seed=None):
+        return self.client.models.generate_content(
+            model=self.model, contents=contents, config=self._config(candidate_count, seed)
+        )
+
+    async def agenerate_content(self, contents, candidate_count=None, seed=None):
+        return await self.client.aio.models.generate_content(
+            model=self.model, contents=contents, config=self._config(candidate_count, seed)
+        )
+
+    def create_chat(self, history=None):
+        """Starts an async multi-turn chat, optionally seeded with earlier history."""
+        return self.client.aio.chats.create(model=self.model, history=history)
+
+
+class FakeAPIError(Exception):
+    """Error raised by FakeBackend; `code` mimics the upstream HTTP status."""
+
+    def __init__(self, code, message):
+        super().__init__(f"{code} {message}")
+        self.code = code
+
+
+class FakeBackend:
+    """
+    Deterministic offline stand-in for Gemini, for tests and benchmarks.
+
+    Every call sleeps for a latency drawn from the configured distribution, may
+    fail with a 429 or 503 or come back safety-blocked at the configured rates,
+    and otherwise returns a synthetic PNG whose colour is derived from the prompt.
+    Calls with a sampling seed get a different, patterned image per seed and
+    candidate, like distinct samples of one prompt. Random draws come from a
+    seeded generator, so runs are repeatable.
+
+    Args:
+        width (int, optional): Width of the synthetic images. Defaults to 256.
+        height (int, optional): Height of the synthetic images. Defaults to 256.
+        latency (float, optional): Median latency in seconds. Defaults to 0.
+        distribution (str, optional): "fixed", "uniform" (latency ± jitter) or
+            "lognormal" (heavy-tailed around the median). Defaults to "fixed".
+        jitter (float, optional): Spread for "uniform", or sigma for "lognormal". Defaults to 0.
+        error_rate (float, optional): Probability of a transient 503. Defaults to 0.
+        quota_error_rate (float, optional): Probability of a 429. Defaults to 0.
+        safety_rate (float, optional): Probability of a safety-blocked response. Defaults to 0.
+        seed (int, optional): Seed for the latency and fault draws. Defaults to 0.
+        max_candidates (int, optional): Most candidates one call may ask for. Defaults to 1.
+    """
+
+    name = "fake"
+
+    def __init__(self, width=256, height=256, latency=0.0, distribution="fixed", jitter=0.0,
+                 error_rate=0.0, quota_error_rate=0.0, safety_rate=0.0, seed=0, max_candidates=1):
+        self.model = "fake-image-model"
+        self.width = width
+        self.height = height
+        self.latency = latency
+        self.distribution = distribution
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.quota_error_rate = quota_error_rate
+        self.safety_rate = safety_rate
+        self.max_candidates = max_candidates
+        self.calls = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        """Builds a FakeBackend from FAKE_* environment variables."""
+        width, _, height = os.getenv("FAKE_IMAGE_SIZE", "256x256").partition("x")
+        return cls(
+            width=int(width),
+            height=int(height or width),
+            latency=float(os.getenv("FAKE_LATENCY", "0")),
+            distribution=os.getenv("FAKE_LATENCY_DISTRIBUTION", "fixed"),
+            jitter=float(os.getenv("FAKE_LATENCY_JITTER", "0")),
+            error_rate=float(os.getenv("FAKE_ERROR_RATE", "0")),
+            quota_error_rate=float(os.getenv("FAKE_QUOTA_ERROR_RATE", "0")),
+            safety_rate=float(os.getenv("FAKE_SAFETY_RATE", "0")),
+            seed=int(os.getenv("FAKE_SEED", "0")),
+            max_candidates=int(os.getenv("FAKE_MAX_CANDIDATES", "1")),
+        )
+
+    def _draw(self):
+        """Draws this call's latency and outcome under the lock."""
+        with self._lock:
+            self.calls += 1
+            if self.distribution == "uniform":
+                latency = self.latency + self._random.uniform(-self.jitter, self.jitter)
+            elif self.distribution == "lognormal":
+                latency = self.latency * math.exp(self._random.gauss(0, self.jitter)) if self.latency else 0.0
+            else:
+                latency = self.latency
+            roll = self._random.random()
+        if roll < self.quota_error_rate:
+            outcome = "quota"
+        elif roll < self.quota_error_rate + self.error_rate:
+            outcome = "error"
+        elif roll < self.quota_error_rate + self.error_rate + self.safety_rate:
+            outcome = "safety"
+        else:
+            outcome = "ok"
+        return max(latency, 0.0), outcome
+
+    def _respond(self, contents, outcome, candidate_count=None, seed=None):
+        from google.genai import types
+        if (candidate_count or 1) > self.max_candidates:
+            raise FakeAPIError(400, f"INVALID_ARGUMENT: at most {self.max_candidates} candidate(s) per call (FakeBackend)")
+        if outcome == "quota":
+            raise FakeAPIError(429, "RESOURCE_EXHAUSTED (injected by FakeBackend)")
+        if outcome == "error":
+            raise FakeAPIError(503, "UNAVAILABLE (injected by FakeBackend)")
+        if outcome == "safety":
+            return types.GenerateContentResponse(
+                candidates=[types.Candidate(finish_reason=types.FinishReason.SAFETY)]
+            )
+        return types.GenerateContentResponse(
+            candidates=[
+                types.Candidate(index=position, content=types.Content(
+                    role="model",
+                    parts=[types.Part.from_bytes(data=self._render(contents, seed, position), mime_type="image/png")],
+                ))
+                for position in range(candidate_count or 1)
+            ]
+        )
+
+    def _render(self, contents, seed=None, candidate=0):
+        """
+        Renders a PNG whose colour is a hash of the prompt and image count.
+
+        With a sampling seed the hash also covers the seed and candidate, and a
+        few rectangles are drawn so that samples differ in size and detail.
+        """
+        from PIL import Image, ImageDraw
+        prompt = contents[0] if contents and isinstance(contents[0], str) else ""
+        key = f"{prompt}|{len(contents)}" if seed is None else f"{prompt}|{len(contents)}|{seed}|{candidate}"
+        digest = hashlib.sha256(key.encode()).digest()
+        image = Image.new("RGB", (self.width, self.height), tuple(digest[:3]))
+        if seed is not None:
+            draw = ImageDraw.Draw(image)
+            shapes = random.Random(digest)
+            for _ in range(digest[3] % 8):
+                x, y = shapes.randrange(self.width), shapes.randrange(self.height)
+                box = (x, y, x + shapes.randrange(1, self.width // 2 + 2), y + shapes.randrange(1, self.height // 2 + 2))
+                draw.rectangle(box, fill=tuple(shapes.randrange(256) for _ in range(3)))
+        buffer = BytesIO()
+        image.save(buffer, "PNG")
+        return buffer.getvalue()
+
+    def generate_content(self, contents, candidate_count=None, seed=None):
+        latency, outcome = self._draw()
+        time.sleep(latency)
+        return self._respond(contents, outcome, candidate_count, seed)
+
+    async def agenerate_content(self, contents, candidate_count=None, seed=None):
+        latency, outcome = self._draw()
+        await asyncio.sleep(latency)
+        return self._respond(contents, outcome, candidate_count, seed)
+
+    def create_chat(self, history=None):
+        """Starts a fake multi-turn chat that records history like the SDK's."""
+        return FakeChat(self, history)
+
+
+class FakeChat:
+    """
+    Multi-turn chat against a FakeBackend, mirroring the SDK's AsyncChat interface.
+
+    Each turn's image depends on the prompt and the length of the history, so
+    refinements of the same prompt produce different (but repeatable) images.
+    """
+
+    def __init__(self, backend, history=None):
+        self._backend = backend
+        self._history = list(history or [])
+
+    async def send_message(self, message):
+        from google.genai import types
+        parts = message if isinstance(message, list) else [message]
+        prompt = parts[0] if parts and isinstance(parts[0], str) else ""
+        response = await self._backend.agenerate_content([f"{prompt}|turn {len(self._history) // 2}"] + parts[1:])
+        if response.candidates and response.candidates[0].content:
+            user_parts = [types.Part(text=p) if isinstance(p, str) else p for p in parts if isinstance(p, (str, types.Part))]
+            self._history.append(types.Content(role="user", parts=user_parts))
+            self._history.append(response.candidates[0].content)
+        return response
+
+    def get_history(self, curated=False):
+        return list(self._history)
+
+
+def create_backend(name=None):
+    """
+    Builds the backend selected by `name` or the IMAGE_BACKEND environment variable.
+
+    Args:
+        name (str, optional): "gemini" (default) or "fake".
+
+    Returns:
+        GeminiBackend | FakeBackend: The backend instance.
+    """
+    name = (name or os.getenv("IMAGE_BACKEND", "gemini")).lower()
+    if name == "fake":
+        return FakeBackend.from_env()
+    if name == "gemini":
+        return GeminiBackend()
+    raise ValueError(f"Unknown image backend '{name}'. Use 'gemini' or 'fake'.")
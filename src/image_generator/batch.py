@@ -0,0 +1,649 @@
+import argparse
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from pathlib import Path
+from . import metrics
+from .batch_input import BatchReader
+from .core import enable_hedging, generate_image, get_backend
+from .events import (
+    BATCH_FINISHED, BATCH_STARTED, ITEM_FAILED, ITEM_FINISHED, ITEM_QUEUED, ITEM_STARTED, EventStream,
+)
+from .images import prepare_base_image, request_budget
+from .logs import configure_logging
+from .renditions import get_pipeline
+from .resilience import FATAL, GenerationError
+from .store import get_store
+
+
+class RateLimiter:
+    """
+    Spaces out calls so that no more than `requests_per_minute` start per minute.
+
+    Thread-safe: every caller reserves the next free slot under a lock and then
+    sleeps outside of it, so waiting threads do not serialize on each other.
+    """
+
+    def __init__(self, requests_per_minute=None):
+        self.interval = 60.0 / requests_per_minute if requests_per_minute else 0.0
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until the caller is allowed to start its request."""
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        delay = slot - now
+        if delay > 0:
+            time.sleep(delay)
+
+
+class BatchProgress:
+    """
+    Keeps counts, throughput and ETA statistics for a running batch, fed by its event stream.
+
+    Args:
+        total (int, optional): Number of items, for the ETA.
+        echo (bool, optional): Print each finished item and the live summary line. Defaults to True.
+    """
+
+    def __init__(self, total=None, echo=True):
+        self.total = total
+        self.echo = echo
+        self.queued = 0
+        self.running = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.started_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def done(self):
+        return self.succeeded + self.failed
+
+    def handle(self, event):
+        """EventStream listener: updates the counts and, with `echo`, prints finished items."""
+        kind = event["type"]
+        with self._lock:
+            if kind == BATCH_STARTED and event.get("total") is not None:
+                self.total = event["total"]
+            elif kind == ITEM_QUEUED:
+                self.queued += 1
+            elif kind == ITEM_STARTED:
+                self.queued -= 1
+                self.running += 1
+            elif kind in (ITEM_FINISHED, ITEM_FAILED):
+                self.running -= 1
+                if kind == ITEM_FINISHED:
+                    self.succeeded += 1
+                else:
+                    self.failed += 1
+                if self.echo:
+                    if kind == ITEM_FINISHED:
+                        print(f"✅ Saved image {event['index']} as {event['output_path']}")
+                    else:
+                        print(f"❌ Failed to generate image {event['index']} ({event['error_class']}) "
+                              f"for prompt: '{event['prompt']}': {event['error']}")
+                    print(self.summary())
+
+    def summary(self):
+        """Returns a one-line throughput/ETA summary."""
+        elapsed = max(time.monotonic() - self.started_at, 1e-9)
+        rate = self.done / elapsed
+        line = f"📈 {self.done}/{self.total or '?'} done ({self.failed} failed) · {rate:.2f} img/s · {elapsed:.1f}s elapsed"
+        if self.total and rate > 0:
+            eta = (self.total - self.done) / rate
+            line += f" · ETA {eta:.1f}s"
+        return line
+
+
+def prompt_hash(prompt):
+    """Returns a short stable hash identifying a prompt in the manifest."""
+    return hashlib.sha256(prompt.encode()).hexdigest()[:16]
+
+
+class BatchManifest:
+    """
+    Append-only JSONL record of every finished batch item.
+
+    Each line holds the item index, prompt, prompt hash, status, output path,
+    latency and error. Later lines for the same index supersede earlier ones,
+    so the file can be replayed to find out what still needs to be generated.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def append(self, record):
+        """Writes one record and flushes it so progress survives a crash."""
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+                f.flush()
+
+    def _replay(self):
+        """Yields (record, line) for every readable line, oldest first."""
+        if not self.path.exists():
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # a torn last line from an interrupted run
+                yield record, line
+
+    def latest(self):
+        """
+        Replays the manifest into memory.
+
+        Returns:
+            dict[int, dict]: The most recent record for every index.
+        """
+        return {record["index"]: record for record, _ in self._replay()}
+
+    def latest_index(self):
+        """
+        Replays the manifest into a temporary SQLite database instead of memory.
+
+        Resuming a file with millions of rows looks records up one row at a
+        time, so only the database's page cache stays in memory.
+
+        Returns:
+            ManifestIndex: The most recent record for every index; close() it when done.
+        """
+        return ManifestIndex(self._replay())
+
+    def is_complete(self, record, prompt):
+        """True if `record` is a success for `prompt` whose output still exists."""
+        return (
+            record is not None
+            and record.get("status") == "success"
+            and record.get("prompt_hash") == prompt_hash(prompt)
+            and record.get("output_path")
+            and Path(record["output_path"]).exists()
+        )
+
+    def failed_items(self):
+        """
+        Returns (index, prompt, base images, output name) for items whose latest record is a failure.
+
+        The shared base images and filename template an item ran with (e.g. the
+        character reference and scene_{index:03d}.png of a character-scene run)
+        are folded into its own base images and output name, so a retry sends
+        the same images and writes the same file.
+
+        Raises:
+            ValueError: If a failed item used shared base images that were not files and so are not recorded.
+        """
+        items = []
+        for index, record in sorted(self.latest().items()):
+            if record.get("status") == "success":
+                continue
+            shared = record.get("shared_base_images") or []
+            if None in shared:
+                raise ValueError(
+                    f"Item {index} in {self.path} was generated with in-memory base images that the manifest "
+                    "cannot record, so it cannot be retried from the manifest."
+                )
+            output_name = record.get("output_name")
+            if not output_name and record.get("filename_template"):
+                output_name = record["filename_template"].format(index=index)
+            items.append((index, record["prompt"], shared + (record.get("base_images") or []), output_name))
+        return items
+
+
+class ManifestIndex:
+    """
+    The latest manifest record per item index, kept in a temporary SQLite database.
+
+    Args:
+        records (iterable[tuple[dict, str]]): (record, JSON line) pairs, oldest first.
+    """
+
+    def __init__(self, records):
+        # An empty name gives a private temporary database, deleted when it is closed
+        self._db = sqlite3.connect("", check_same_thread=False)
+        self._db.execute("CREATE TABLE latest (item INTEGER PRIMARY KEY, record TEXT NOT NULL)")
+        self._db.executemany(
+            "INSERT OR REPLACE INTO latest (item, record) VALUES (?, ?)",
+            ((record["index"], line) for record, line in records),
+        )
+        self._db.commit()
+
+    def get(self, index):
+        """Returns the most recent record for `index`, or None."""
+        row = self._db.execute("SELECT record FROM latest WHERE item = ?", (index,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def close(self):
+        self._db.close()
+
+
+def _output_path(output_dir, filename_template, index, output_name):
+    """Resolves an item's output file, refusing names that would land outside `output_dir`."""
+    output_dir = Path(output_dir)
+    if not output_name:
+        return output_dir / filename_template.format(index=index)
+    path = output_dir / output_name
+    if not path.resolve().is_relative_to(output_dir.resolve()):
+        raise ValueError(f"Output name '{output_name}' points outside {output_dir}")
+    return path
+
+
+def _item_event(record):
+    """The fields of an item's finished/failed event, taken from its manifest record."""
+    if record["status"] == "success":
+        return ITEM_FINISHED, {"index": record["index"], "output_path": record["output_path"], "latency": record["latency"]}
+    return ITEM_FAILED, {
+        "index": record["index"],
+        "prompt": record["prompt"],
+        "error": record["error"],
+        "error_class": record["error_class"],
+        "latency": record["latency"],
+    }
+
+
+def _generate(prompt, base_images):
+    """The default way a batch item is generated: a synchronous model call in the worker thread."""
+    return generate_image(prompt, base_images=base_images, raw=True, raise_errors=True)
+
+
+def _run_fields(filename_template, base_images):
+    """
+    Manifest fields shared by every item of a run: the filename template and the shared
+    base images' source files (None for images that did not come from a file).
+    """
+    fields = {"filename_template": filename_template}
+    if base_images:
+        fields["shared_base_images"] = [
+            str(image.source_path) if getattr(image, "source_path", None) else None for image in base_images
+        ]
+    return fields
+
+
+def _generate_item(index, prompt, output_dir, filename_template, limiter, base_images=None,
+                   item_images=None, output_name=None, events=None, generate=_generate):
+    """Generates and saves a single batch item. Returns a manifest record."""
+    limiter.acquire()
+    if events is not None:
+        events.emit(ITEM_STARTED, index=index)
+    started = time.monotonic()
+    record = {
+        "index": index,
+        "prompt": prompt,
+        "prompt_hash": prompt_hash(prompt),
+        "status": "failed",
+        "output_path": None,
+        "latency": None,
+        "error": None,
+        "error_class": None,
+        **_run_fields(filename_template, base_images),
+    }
+    if item_images:
+        record["base_images"] = [str(path) for path in item_images]
+    if output_name:
+        record["output_name"] = output_name
+    try:
+        alias = _output_path(output_dir, filename_template, index, output_name)
+        # Per-item base images are encoded here, in the worker; repeated files hit the payload cache
+        budget = request_budget()
+        base_images = list(base_images or []) + [prepare_base_image(path, budget=budget) for path in item_images or []]
+        image = generate(prompt, base_images or None)
+        # Store the model's bytes as they are and link them under the batch filename
+        save_path = get_store().put(
+            image,
+            prompt,
+            base_images=base_images,
+            model=get_backend().model,
+            latency=time.monotonic() - started,
+            alias=alias,
+        )
+        record["status"] = "success"
+        record["output_path"] = str(save_path)
+    except GenerationError as e:
+        record["error"] = str(e)
+        record["error_class"] = e.kind
+    except Exception as e:
+        record["error"] = str(e)
+        record["error_class"] = FATAL
+    record["latency"] = round(time.monotonic() - started, 3)
+    record["timestamp"] = time.time()
+    if events is not None:
+        # Published from the worker, so listeners hear of each image as soon as it lands
+        kind, fields = _item_event(record)
+        events.emit(kind, **fields)
+    return record
+
+
+def run_items(items, output_dir="output", concurrency=4, requests_per_minute=None,
+              filename_template="batch_{index:03d}.png", manifest_path=None, total=None,
+              base_images=None, on_result=None, collect=True, events=None, generate=None):
+    """
+    Generates (index, prompt) items concurrently, writing results as they complete.
+
+    Items are pulled from `items` only as workers free up, so a lazy iterable
+    (such as a BatchReader) is never read far ahead of the generations.
+
+    Progress is published as events (batch_started, then queued, started and
+    finished or failed per item, then batch_finished) on an EventStream, which
+    is closed when the run ends. Without `events`, a printing BatchProgress
+    listens to a new stream, which is the CLI's progress display.
+
+    Args:
+        items (iterable[tuple]): (index, prompt) pairs, or (index, prompt, base image paths, output name)
+            tuples; the index picks the filename unless an output name is given.
+        output_dir (str | Path, optional): Where to save the images. Defaults to "output".
+        concurrency (int, optional): Maximum number of generations in flight. Defaults to 4.
+        requests_per_minute (float, optional): Cap on requests started per minute. Defaults to no cap.
+        filename_template (str, optional): Format string for filenames, given `index`.
+        manifest_path (str | Path, optional): JSONL manifest to append a record to per item.
+        total (int, optional): Number of items, for the ETA. Taken from `items` when it has a length.
+        base_images (list[EncodedImage], optional): Base images sent with every item. Encode them once
+            with prepare_base_image() so all calls share the same payload.
+        on_result (callable, optional): Called with each item's manifest record as soon as it finishes.
+        collect (bool, optional): Keep every item's result for the return value. Turn off for inputs too
+            large to hold in memory and use the manifest or `on_result` instead. Defaults to True.
+        events (EventStream, optional): Stream to publish progress on. Defaults to a new stream with a
+            printing BatchProgress attached.
+        generate (callable, optional): Called in a worker thread as generate(prompt, base_images) to get
+            each item's GeneratedImage, raising GenerationError on failure. Defaults to a direct
+            core.generate_image call; the server passes one that runs the item through its job queue.
+
+    Returns:
+        dict[int, Path | None]: The saved path (or None on failure) for every index; empty if `collect` is off.
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    concurrency = max(1, int(concurrency))
+    limiter = RateLimiter(requests_per_minute)
+    if total is None and hasattr(items, "__len__"):
+        total = len(items)
+    if events is None:
+        events = EventStream()
+        events.add_listener(BatchProgress(total).handle)
+    manifest = BatchManifest(manifest_path) if manifest_path else None
+    results = {}
+    counts = {"success": 0, "failed": 0}
+    started = time.monotonic()
+    events.emit(BATCH_STARTED, total=total)
+
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            pending = {}
+
+            def drain(return_when):
+                done, _ = wait(pending, return_when=return_when)
+                for future in done:
+                    index = pending.pop(future)
+                    record = future.result()
+                    if manifest:
+                        manifest.append(record)
+                    if collect:
+                        results[index] = Path(record["output_path"]) if record["output_path"] else None
+                    counts[record["status"]] += 1
+                    if on_result:
+                        on_result(record)
+
+            # Submit lazily so only a bounded number of items is queued at once
+            for index, prompt, *extra in items:
+                item_images, output_name = extra if extra else (None, None)
+                if len(pending) >= concurrency * 2:
+                    drain(FIRST_COMPLETED)
+                events.emit(ITEM_QUEUED, index=index, prompt=prompt)
+                future = executor.submit(
+                    _generate_item, index, prompt, output_dir, filename_template, limiter, base_images,
+                    item_images, output_name, events, generate or _generate,
+                )
+                pending[future] = index
+
+            while pending:
+                drain(FIRST_COMPLETED)
+
+        events.emit(
+            BATCH_FINISHED,
+            succeeded=counts["success"],
+            failed=counts["failed"],
+            elapsed=round(time.monotonic() - started, 3),
+        )
+    finally:
+        events.close()
+
+    return results
+
+
+def run_batch(prompts, output_dir="output", concurrency=4, requests_per_minute=None,
+              filename_template="batch_{index:03d}.png", manifest_path=None, resume=False,
+              base_images=None, on_result=None, events=None):
+    """
+    Generates one image per prompt concurrently, writing results as they complete.
+
+    Filenames are derived from each prompt's 1-based position, so they stay
+    deterministic (`batch_001.png`, ...) no matter in which order the calls finish.
+
+    Args:
+        prompts (list[str]): The prompts to generate, in order.
+        output_dir (str | Path, optional): Where to save the images. Defaults to "output".
+        concurrency (int, optional): Maximum number of generations in flight. Defaults to 4.
+        requests_per_minute (float, optional): Cap on requests started per minute. Defaults to no cap.
+        filename_template (str, optional): Format string for filenames, given `index`.
+        manifest_path (str | Path, optional): JSONL manifest recording every item's outcome.
+        resume (bool, optional): Skip items the manifest already records as successful. Defaults to False.
+        base_images (list[EncodedImage], optional): Base images sent with every prompt.
+        on_result (callable, optional): Called with each item's manifest record as soon as it finishes.
+        events (EventStream, optional): Stream to publish progress events on (see run_items).
+
+    Returns:
+        dict[int, Path | None]: The saved path (or None on failure) for every submitted index.
+    """
+    items = list(enumerate(prompts, start=1))
+    if resume and manifest_path:
+        manifest = BatchManifest(manifest_path)
+        previous = manifest.latest()
+        items = [(i, p) for i, p in items if not manifest.is_complete(previous.get(i), p)]
+        skipped = len(prompts) - len(items)
+        if skipped:
+            print(f"⏭️ Resuming: {skipped} item(s) already done, {len(items)} left.")
+
+    return run_items(
+        items,
+        output_dir=output_dir,
+        concurrency=concurrency,
+        requests_per_minute=requests_per_minute,
+        filename_template=filename_template,
+        manifest_path=manifest_path,
+        base_images=base_images,
+        on_result=on_result,
+        events=events,
+    )
+
+
+def run_file(input_path, output_dir="output", concurrency=4, requests_per_minute=None,
+             filename_template="batch_{index:03d}.png", manifest_path=None, resume=False, dedupe=True,
+             on_result=None, events=None):
+    """
+    Streams a text, JSONL or CSV input file through the batch engine.
+
+    Rows are read lazily and duplicates dropped as they go (see BatchReader).
+    Duplicate detection and the resume state live in temporary SQLite
+    databases, so inputs with millions of rows run in bounded memory. Each finished row's
+    record is appended to the manifest as it completes, which makes the
+    manifest the streaming JSONL output of the run.
+
+    Args:
+        input_path (str | Path): The input file.
+        output_dir (str | Path, optional): Where to save the images. Defaults to "output".
+        concurrency (int, optional): Maximum number of generations in flight. Defaults to 4.
+        requests_per_minute (float, optional): Cap on requests started per minute. Defaults to no cap.
+        filename_template (str, optional): Format string for rows without an output name, given `index`.
+        manifest_path (str | Path, optional): JSONL file that receives one record per finished row.
+        resume (bool, optional): Skip rows the manifest already records as successful. Defaults to False.
+        dedupe (bool, optional): Drop rows repeating an earlier prompt and base images. Defaults to True.
+        on_result (callable, optional): Called with each row's record as soon as it finishes.
+        events (EventStream, optional): Stream to publish progress events on (see run_items).
+
+    Returns:
+        dict: Counts of succeeded, failed, duplicate, invalid and resumed (skipped) rows.
+    """
+    reader = BatchReader(input_path, dedupe=dedupe)
+    counts = {"succeeded": 0, "failed": 0, "duplicates": 0, "invalid": 0, "resumed": 0}
+    manifest = BatchManifest(manifest_path) if manifest_path else None
+    previous = manifest.latest_index() if resume and manifest else None
+
+    def rows():
+        for row in reader:
+            if previous is not None and manifest.is_complete(previous.get(row.index), row.prompt):
+                counts["resumed"] += 1
+                continue
+            yield tuple(row)
+
+    def record_result(record):
+        counts["succeeded" if record["status"] == "success" else "failed"] += 1
+        if on_result:
+            on_result(record)
+
+    try:
+        run_items(
+            rows(),
+            output_dir=output_dir,
+            concurrency=concurrency,
+            requests_per_minute=requests_per_minute,
+            filename_template=filename_template,
+            manifest_path=manifest_path,
+            on_result=record_result,
+            collect=False,
+            events=events,
+        )
+    finally:
+        if previous is not None:
+            previous.close()
+    counts["duplicates"] = reader.duplicates
+    counts["invalid"] = reader.invalid
+    if counts["resumed"]:
+        print(f"⏭️ Resumed: {counts['resumed']} row(s) were already done.")
+    if reader.duplicates:
+        print(f"🧹 Skipped {reader.duplicates} duplicate row(s).")
+    return counts
+
+
+def retry_failed(manifest_path, output_dir="output", concurrency=4, requests_per_minute=None,
+                 filename_template="batch_{index:03d}.png"):
+    """
+    Re-runs only the items whose latest manifest record is a failure.
+
+    Each item is sent with the base images and written to the file it had in
+    the original run (see BatchManifest.failed_items); `filename_template` only
+    applies to records from older manifests that did not store theirs.
+
+    Args:
+        manifest_path (str | Path): The manifest written by a previous run.
+
+    Returns:
+        dict[int, Path | None]: The saved path (or None on failure) for every retried index.
+
+    Raises:
+        ValueError: If the manifest's failed items used in-memory base images that it could not record.
+    """
+    items = BatchManifest(manifest_path).failed_items()
+    print(f"🔁 Retrying {len(items)} failed item(s) from {manifest_path}")
+    return run_items(
+        items,
+        output_dir=output_dir,
+        concurrency=concurrency,
+        requests_per_minute=requests_per_minute,
+        filename_template=filename_template,
+        manifest_path=manifest_path,
+    )
+
+
+def read_prompts(prompts_file_path):
+    """Reads one prompt per non-empty line."""
+    with open(prompts_file_path, 'r', encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def main(argv=None):
+    """Command-line entry point: python -m src.image_generator.batch prompts.txt [--resume]"""
+    parser = argparse.ArgumentParser(description="Generate one image per line of a prompts file.")
+    parser.add_argument("prompts_file", nargs="?", help="Text file with one prompt per line, or a JSONL/CSV file with prompt, base_images and output_name fields.")
+    parser.add_argument("--output-dir", default="output")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--rpm", type=float, default=None, help="Maximum requests per minute.")
+    parser.add_argument("--manifest", default=None, help="JSONL manifest path (default: <output-dir>/batch_manifest.jsonl).")
+    parser.add_argument("--resume", action="store_true", help="Skip items the manifest records as done.")
+    parser.add_argument("--retry-failed", action="store_true", help="Only re-run items the manifest records as failed.")
+    parser.add_argument("--metrics-file", default=None, help="Write Prometheus metrics here when the batch finishes.")
+    parser.add_argument("--hedge-percentile", type=float, default=None, help="Send a duplicate of calls slower than this latency percentile (e.g. 95).")
+    parser.add_argument("--character", default=None, help="Character reference image; each line becomes a scene with that character.")
+    parser.add_argument("--scene-template", default=None, help="Prompt template for --character scenes, with a {scene} placeholder.")
+    parser.add_argument("--keep-duplicates", action="store_true", help="Generate repeated prompts instead of skipping them.")
+    args = parser.parse_args(argv)
+    configure_logging("text")
+
+    manifest_path = args.manifest or str(Path(args.output_dir) / "batch_manifest.jsonl")
+    if args.hedge_percentile is not None:
+        enable_hedging(percentile=args.hedge_percentile)
+    if args.character:
+        if args.retry_failed or not args.prompts_file:
+            parser.error("--character needs a prompts_file and cannot be combined with --retry-failed")
+        if args.scene_template and "{scene}" not in args.scene_template:
+            parser.error("--scene-template must contain a {scene} placeholder")
+        from .tasks import CHARACTER_SCENE_TEMPLATE, generate_character_scenes
+        results = generate_character_scenes(
+            args.character,
+            read_prompts(args.prompts_file),
+            template=args.scene_template or CHARACTER_SCENE_TEMPLATE,
+            output_dir=args.output_dir,
+            concurrency=args.concurrency,
+            requests_per_minute=args.rpm,
+            manifest_path=manifest_path,
+            resume=args.resume,
+        )
+        failed = sum(1 for path in results.values() if path is None)
+        succeeded = len(results) - failed
+    elif args.retry_failed:
+        try:
+            results = retry_failed(manifest_path, args.output_dir, args.concurrency, args.rpm)
+        except ValueError as e:
+            parser.error(str(e))
+        failed = sum(1 for path in results.values() if path is None)
+        succeeded = len(results) - failed
+    else:
+        if not args.prompts_file:
+            parser.error("prompts_file is required unless --retry-failed is given")
+        counts = run_file(
+            args.prompts_file,
+            output_dir=args.output_dir,
+            concurrency=args.concurrency,
+            requests_per_minute=args.rpm,
+            manifest_path=manifest_path,
+            resume=args.resume,
+            dedupe=not args.keep_duplicates,
+        )
+        succeeded, failed = counts["succeeded"], counts["failed"]
+    print(f"\n🎉 Batch finished: {succeeded} succeeded, {failed} failed.")
+    pipeline = get_pipeline()
+    if pipeline is not None and pipeline.pending():
+        print(f"🖼️ Waiting for renditions of {pipeline.pending()} image(s)...")
+        pipeline.close()
+    if args.metrics_file:
+        metrics.write_textfile(args.metrics_file)
+        print(f"📊 Metrics written to {args.metrics_file}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
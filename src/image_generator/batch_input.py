@@ -0,0 +1,162 @@
+import csv
+import hashlib
+import json
+import re
+import sqlite3
+import unicodedata
+from pathlib import Path
+
+# Typographic quotes and dashes that make otherwise identical prompts look different
+_QUOTE_TRANSLATION = str.maketrans({
+    "‘": "'", "’": "'", "‚": "'", "‛": "'", "′": "'",
+    "“": '"', "”": '"', "„": '"', "‟": '"', "″": '"',
+    "«": '"', "»": '"',
+    "–": "-", "—": "-",
+})
+_WHITESPACE = re.compile(r"\s+")
+
+# Column/field names accepted for each value, first match wins
+_PROMPT_FIELDS = ("prompt", "text")
+_BASE_IMAGE_FIELDS = ("base_images", "base_image_paths", "base_image", "images")
+_OUTPUT_FIELDS = ("output_name", "output", "filename")
+
+
+def normalize_prompt(prompt):
+    """
+    Canonical form of a prompt used to detect duplicates.
+
+    Applies Unicode NFKC, turns curly quotes and dashes into their ASCII forms
+    and collapses runs of whitespace, so prompts that differ only in typography
+    or spacing compare equal. The prompt actually sent is left untouched.
+    """
+    prompt = unicodedata.normalize("NFKC", prompt).translate(_QUOTE_TRANSLATION)
+    return _WHITESPACE.sub(" ", prompt).strip()
+
+
+class BatchRow:
+    """
+    One item read from a batch input file.
+
+    Attributes:
+        index (int): 1-based position among the file's rows; it picks the default filename.
+        prompt (str): The prompt, as written in the file.
+        base_images (list[str]): Paths of base images for this row; relative ones are resolved against the input file's directory.
+        output_name (str): Filename for the result relative to the output directory, or None.
+    """
+
+    __slots__ = ("index", "prompt", "base_images", "output_name")
+
+    def __init__(self, index, prompt, base_images=None, output_name=None):
+        self.index = index
+        self.prompt = prompt
+        self.base_images = base_images or []
+        self.output_name = output_name
+
+    def __iter__(self):
+        return iter((self.index, self.prompt, self.base_images, self.output_name))
+
+
+def _first(record, names):
+    for name in names:
+        value = record.get(name)
+        if value not in (None, ""):
+            return value
+    return None
+
+
+def _split_images(value):
+    if value is None:
+        return []
+    if isinstance(value, str):
+        return [part.strip() for part in re.split(r"[;|]", value) if part.strip()]
+    return [str(part) for part in value]
+
+
+class BatchReader:
+    """
+    Lazily reads batch rows from a text, JSONL or CSV file.
+
+    Rows are yielded one at a time. The only per-row state is a 64-bit hash of
+    each distinct (prompt, base images) pair, used to drop duplicates after
+    normalize_prompt(). The hashes are kept in a temporary SQLite database that
+    spills to disk, so memory stays bounded by its page cache rather than
+    growing with the file. Relative base-image paths are resolved against the
+    input file's directory. Malformed rows are reported and skipped.
+
+    Formats, chosen by extension:
+        .jsonl / .ndjson: one object per line with "prompt" and optional "base_images" (list) and "output_name".
+        .csv: a header row with the same columns; several base images are separated by ";".
+        anything else: one prompt per line.
+
+    Args:
+        path (str | Path): The input file.
+        dedupe (bool, optional): Skip rows that repeat an earlier prompt and base images. Defaults to True.
+    """
+
+    def __init__(self, path, dedupe=True):
+        self.path = Path(path)
+        self.dedupe = dedupe
+        self.rows = 0
+        self.duplicates = 0
+        self.invalid = 0
+        self._seen = None
+
+    def _records(self):
+        """Yields (line number, dict) for every non-empty row."""
+        suffix = self.path.suffix.lower()
+        with open(self.path, "r", encoding="utf-8", newline="") as f:
+            if suffix in (".jsonl", ".ndjson"):
+                for line_number, line in enumerate(f, start=1):
+                    if not line.strip():
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError as e:
+                        yield line_number, e
+                        continue
+                    yield line_number, record if isinstance(record, dict) else {"prompt": record}
+            elif suffix == ".csv":
+                for line_number, record in enumerate(csv.DictReader(f), start=2):
+                    yield line_number, record
+            else:
+                for line_number, line in enumerate(f, start=1):
+                    if line.strip():
+                        yield line_number, {"prompt": line.strip()}
+
+    def _is_duplicate(self, prompt, base_images):
+        key = "\0".join([normalize_prompt(prompt), *base_images]).encode()
+        # Signed, to fit SQLite's 64-bit integers
+        digest = int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "big", signed=True)
+        inserted = self._seen.execute("INSERT OR IGNORE INTO seen (digest) VALUES (?)", (digest,)).rowcount
+        return inserted == 0
+
+    def __iter__(self):
+        if self.dedupe:
+            # An empty name gives a private temporary database, deleted when it is closed
+            self._seen = sqlite3.connect("", check_same_thread=False)
+            self._seen.execute("CREATE TABLE seen (digest INTEGER PRIMARY KEY)")
+        try:
+            yield from self._rows()
+        finally:
+            if self._seen is not None:
+                self._seen.close()
+                self._seen = None
+
+    def _rows(self):
+        for line_number, record in self._records():
+            if isinstance(record, Exception):
+                self.invalid += 1
+                print(f"⚠️ Skipping line {line_number} of {self.path.name}: {record}")
+                continue
+            self.rows += 1
+            prompt = _first(record, _PROMPT_FIELDS)
+            if not isinstance(prompt, str) or not prompt.strip():
+                self.invalid += 1
+                print(f"⚠️ Skipping line {line_number} of {self.path.name}: no prompt")
+                continue
+            # Relative to the input file, not the working directory the batch is started from
+            base_images = [str(self.path.parent / image) for image in _split_images(_first(record, _BASE_IMAGE_FIELDS))]
+            if self.dedupe and self._is_duplicate(prompt, base_images):
+                self.duplicates += 1
+                continue
+            yield BatchRow(self.rows, prompt.strip(), base_images, _first(record, _OUTPUT_FIELDS))
@@ -0,0 +1,162 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+
+def image_fingerprint(image):
+    """
+    Hashes a PIL image's pixel data, mode and size.
+
+    Two images with the same pixels hash the same even if they were loaded
+    from differently encoded files. Pre-encoded base images carry their own digest.
+    """
+    if getattr(image, "digest", None):
+        return image.digest
+    digest = hashlib.sha256()
+    digest.update(f"{image.mode}:{image.size[0]}x{image.size[1]}:".encode())
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+def cache_key(model, prompt, base_images=None):
+    """
+    Builds the content-addressed cache key for a generation request.
+
+    Args:
+        model (str): The model name.
+        prompt (str): The text prompt.
+        base_images (list[PIL.Image.Image], optional): The base images sent with the prompt.
+
+    Returns:
+        str: A hex SHA-256 digest identifying the request.
+    """
+    digest = hashlib.sha256()
+    digest.update(model.encode())
+    digest.update(b"\0")
+    digest.update(prompt.encode())
+    for image in base_images or []:
+        digest.update(b"\0")
+        digest.update(image_fingerprint(image).encode())
+    return digest.hexdigest()
+
+
+class ImageCache:
+    """
+    Two-tier cache of generated image bytes.
+
+    Hot entries live in a small in-memory LRU. Everything is also written to an
+    on-disk store whose total size is capped; when the cap is exceeded the least
+    recently used files (by modification time, refreshed on every hit) are evicted.
+
+    Several processes may share one directory: writes are atomic renames, and
+    the size estimate is re-read from disk periodically to include other
+    processes' writes.
+    """
+
+    # Puts between rescans of the directory size
+    RESYNC_INTERVAL = 64
+
+    def __init__(self, directory=".image_cache", max_bytes=512 * 1024 * 1024, memory_entries=32):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.memory_entries = memory_entries
+        self.hits = 0
+        self.misses = 0
+        self.memory_hits = 0
+        self._puts = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_bytes = self._scan_disk_bytes()
+
+    def _path(self, key):
+        return self.directory / f"{key}.bin"
+
+    def _scan_disk_bytes(self):
+        total = 0
+        for path in self.directory.glob("*.bin"):
+            try:
+                total += path.stat().st_size
+            except FileNotFoundError:
+                pass  # evicted by another process meanwhile
+        return total
+
+    def contains(self, key):
+        """True if `key` is cached, without touching the hit/miss counters or recency."""
+        with self._lock:
+            return key in self._memory or self._path(key).exists()
+
+    def _remember(self, key, data):
+        self._memory[key] = data
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key):
+        """Returns the cached bytes for `key`, or None on a miss."""
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                self.memory_hits += 1
+                return data
+
+            path = self._path(key)
+            try:
+                data = path.read_bytes()
+                os.utime(path)  # refresh recency for LRU eviction
+            except FileNotFoundError:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._remember(key, data)
+            return data
+
+    def put(self, key, data):
+        """Stores `data` under `key` in both tiers and evicts old entries if needed."""
+        with self._lock:
+            path = self._path(key)
+            previous = path.stat().st_size if path.exists() else 0
+            tmp_path = path.with_suffix(f".tmp{os.getpid()}.{threading.get_ident()}")
+            tmp_path.write_bytes(data)
+            os.replace(tmp_path, path)
+            self._disk_bytes += len(data) - previous
+            self._puts += 1
+            if self._puts % self.RESYNC_INTERVAL == 0:
+                self._disk_bytes = self._scan_disk_bytes()
+            self._remember(key, data)
+            self._evict()
+
+    def _evict(self):
+        if self._disk_bytes <= self.max_bytes:
+            return
+        entries = []
+        for path in self.directory.glob("*.bin"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort(key=lambda entry: entry[0])
+        for _, size, path in entries:
+            if self._disk_bytes <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            self._memory.pop(path.stem, None)
+            self._disk_bytes -= size
+
+    def stats(self):
+        """Returns hit/miss counters and current occupancy."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.hits - self.memory_hits,
+                "memory_entries": len(self._memory),
+                "disk_bytes": self._disk_bytes,
+            }
@@ -1,69 +1,874 @@
+import asyncio
+import contextvars
+import functools
+import logging
 import os
+import random
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
 from dotenv import load_dotenv
-from google import genai
-from PIL import Image
-from io import BytesIO
 from pathlib import Path
+from .backends import create_backend
+from .cache import ImageCache, cache_key
+from .hedging import HedgePolicy
+from .shared import SharedRateLimiter, SharedState
+from . import metrics
+from .logs import get_logger, log_event
+from .images import EncodedImage, GeneratedImage, pil_to_part
+from .variants import Variant, get_scorer, rank
+from .store import get_store
+from .resilience import (
+    AdaptiveLimiter,
+    GenerationError,
+    RetryPolicy,
+    FATAL,
+    SAFETY,
+    TRANSIENT,
+    classify_error,
+)
+
+logger = get_logger("core")
 
 # Load your API key from the .env file
 load_dotenv()
 
-# Create a client to talk to Gemini
-client = genai.Client(api_key=os.getenv("GOOGLE_GENAI_API_KEY"))
+# Pick the backend that serves generations: the real Gemini API or the offline fake
+backend = create_backend()
+
+
+def set_backend(new_backend):
+    """
+    Replaces the backend used by generate_image and agenerate_image.
+
+    Args:
+        new_backend (GeminiBackend | FakeBackend | str): A backend instance, or its name.
+    """
+    global backend
+    backend = create_backend(new_backend) if isinstance(new_backend, str) else new_backend
+    log_event(
+        logger, logging.INFO, f"🔌 Using the '{backend.name}' image backend ({backend.model})",
+        "backend_selected", backend=backend.name, model=backend.model,
+    )
+
+
+def get_backend():
+    """Returns the active backend."""
+    return backend
+
+
+# Retries for quota/transient errors and the AIMD limiter shared by every model call
+retry_policy = RetryPolicy(
+    max_attempts=int(os.getenv("GEMINI_MAX_ATTEMPTS", "5")),
+    base_delay=float(os.getenv("GEMINI_RETRY_BASE_DELAY", "1.0")),
+)
+limiter = AdaptiveLimiter(
+    initial=int(os.getenv("GEMINI_CONCURRENCY", "64")),
+    max_limit=int(os.getenv("GEMINI_MAX_CONCURRENCY", "256")),
+)
+
+# Optional hedging of slow calls; disabled unless enable_hedging() is called or GEMINI_HEDGE_PERCENTILE is set
+hedging = HedgePolicy(
+    budget=float(os.getenv("GEMINI_HEDGE_BUDGET", "0.1")),
+    min_samples=int(os.getenv("GEMINI_HEDGE_MIN_SAMPLES", "20")),
+)
+if os.getenv("GEMINI_HEDGE_PERCENTILE"):
+    hedging.configure(percentile=float(os.getenv("GEMINI_HEDGE_PERCENTILE")))
+
+# Threads that run hedged sync calls, so the caller can wait for whichever finishes first
+_hedge_executor = None
+
+
+def enable_hedging(percentile=95.0, budget=0.1, min_samples=20):
+    """
+    Turns on hedged requests for generate_image and agenerate_image.
+
+    A call still running after the given percentile of recent latencies gets a
+    duplicate; the first response wins and the other call is cancelled.
+
+    Args:
+        percentile (float, optional): Latency percentile (0-100) after which to hedge. Defaults to 95.
+        budget (float, optional): Maximum fraction of calls that may be duplicated. Defaults to 0.1.
+        min_samples (int, optional): Calls to observe before hedging starts. Defaults to 20.
+
+    Returns:
+        HedgePolicy: The active policy, useful for reading its stats().
+    """
+    global _hedge_executor
+    hedging.configure(percentile=percentile, budget=budget, min_samples=min_samples)
+    if _hedge_executor is not None:
+        # The pool is sized from the budget; let the next hedged call build one for the new budget
+        _hedge_executor.shutdown(wait=False)
+        _hedge_executor = None
+    return hedging
+
+
+# Optional response cache; disabled unless enable_cache() is called or IMAGE_CACHE_DIR is set
+_cache = None
+
+
+def enable_cache(directory=".image_cache", max_bytes=512 * 1024 * 1024, memory_entries=32):
+    """
+    Turns on the response cache in front of generate_image and agenerate_image.
+
+    Args:
+        directory (str | Path, optional): Where cached images are stored on disk.
+        max_bytes (int, optional): Size cap for the on-disk store. Defaults to 512 MB.
+        memory_entries (int, optional): Number of hot entries kept in memory. Defaults to 32.
+
+    Returns:
+        ImageCache: The active cache, useful for reading its stats().
+    """
+    global _cache
+    _cache = ImageCache(directory, max_bytes=max_bytes, memory_entries=memory_entries)
+    return _cache
+
+
+def get_cache():
+    """Returns the active ImageCache, or None if caching is disabled."""
+    return _cache
+
+
+if os.getenv("IMAGE_CACHE_DIR"):
+    enable_cache(
+        os.getenv("IMAGE_CACHE_DIR"),
+        max_bytes=int(os.getenv("IMAGE_CACHE_MAX_MB", "512")) * 1024 * 1024,
+    )
+
+
+# Optional coordination between processes on one host (e.g. several server workers):
+# a global rate limit and cross-process de-duplication of identical generations
+_shared = None
+_shared_limiter = None
+
+# How long another process may hold a generation before waiters give up and generate it themselves
+SHARED_LEASE_SECONDS = float(os.getenv("SHARED_LEASE_SECONDS", "120"))
+
+
+def enable_shared_state(path, requests_per_minute=None, burst=None):
+    """
+    Coordinates generations with other processes using the same SQLite file.
 
+    With a shared cache directory (see enable_cache), a request that another
+    process is already generating waits for that result instead of calling
+    the model again. With `requests_per_minute`, every model call across all
+    those processes draws from one token bucket.
 
-def generate_image(prompt, base_images=None):
+    Args:
+        path (str | Path): The shared SQLite file.
+        requests_per_minute (float, optional): Global rate limit for model calls. Defaults to none.
+        burst (float, optional): Token bucket size. Defaults to ten seconds' worth of requests.
+
+    Returns:
+        SharedState: The shared state, useful for reading its counters().
+    """
+    global _shared, _shared_limiter
+    _shared = SharedState(path)
+    _shared_limiter = SharedRateLimiter(_shared, requests_per_minute, burst) if requests_per_minute else None
+    return _shared
+
+
+def get_shared_state():
+    """Returns the active SharedState, or None if cross-process coordination is off."""
+    return _shared
+
+
+if os.getenv("SHARED_STATE_PATH"):
+    enable_shared_state(
+        os.getenv("SHARED_STATE_PATH"),
+        requests_per_minute=float(os.getenv("GEMINI_SHARED_RPM", "0")) or None,
+        burst=float(os.getenv("GEMINI_SHARED_BURST", "0")) or None,
+    )
+
+
+def _build_contents(prompt, base_images=None):
+    """
+    Builds the request contents from a prompt and optional base images.
+
+    Base images may be PIL images or pre-encoded images from images.prepare_base_image.
+    PIL images are encoded here, once, so every part carries its upload bytes.
+    """
+    contents = [prompt]
+    for image in base_images or []:
+        if isinstance(image, EncodedImage):
+            contents.append(image.to_part())
+        elif _is_pil_image(image):
+            contents.append(pil_to_part(image))
+        else:
+            contents.append(image)
+    return contents
+
+
+def _is_pil_image(image):
+    from PIL import Image
+    return isinstance(image, Image.Image)
+
+
+def _extract_images(response):
+    """
+    Pulls every inline image out of every candidate of a model response.
+
+    Args:
+        response (google.genai.types.GenerateContentResponse): The model response.
+
+    Returns:
+        list[tuple[int, GeneratedImage]]: The candidate number and encoded data of each image, in response order.
+
+    Raises:
+        GenerationError: SAFETY if the prompt was blocked, FATAL if no image came back.
+    """
+    # --- Start of robust response handling ---
+    if not response.candidates:
+        message = "The model did not return any candidates. This might be due to a safety block."
+        # Try to add more details if available
+        try:
+            message += f" Prompt Feedback: {response.prompt_feedback}"
+        except Exception:
+            pass # Ignore if prompt_feedback is not available
+        raise GenerationError(message, SAFETY)
+
+    images = []
+    for position, candidate in enumerate(response.candidates):
+        if candidate.content and candidate.content.parts:
+            images += [
+                (position, GeneratedImage(part.inline_data.data, part.inline_data.mime_type))
+                for part in candidate.content.parts
+                if part.inline_data is not None
+            ]
+    if images:
+        return images
+
+    candidate = response.candidates[0]
+    if not candidate.content or not candidate.content.parts:
+        raise GenerationError(
+            "The model's response was empty. This can happen if the prompt is blocked for safety reasons. "
+            f"Finish Reason: {candidate.finish_reason}. Safety Ratings: {candidate.safety_ratings}",
+            SAFETY,
+        )
+    # --- End of robust response handling ---
+
+    raise GenerationError("The model's response did not contain an image.", FATAL)
+
+
+def _extract_image_bytes(response):
+    """Returns the first inline image of a model response as a GeneratedImage (see _extract_images)."""
+    return _extract_images(response)[0][1]
+
+
+def _cached_lookup(prompt, base_images, bypass_cache):
+    """Returns (key, cached GeneratedImage) for a request; both are None when caching is off."""
+    if _cache is None:
+        return None, None
+    key = cache_key(backend.model, prompt, base_images)
+    if bypass_cache:
+        return key, None
+    data = _cache.get(key)
+    return key, GeneratedImage(data) if data else None
+
+
+def _finish(key, response, raw):
+    """Extracts the image from a response, caches its bytes and decodes them unless `raw`."""
+    with metrics.timed("decode"):
+        generated = _extract_image_bytes(response)
+        result = generated if raw else generated.to_pil()
+        if not raw:
+            result.load()
+    metrics.BYTES_DOWNLOADED.inc(len(generated.data))
+    if key is not None:
+        _cache.put(key, generated.data)
+    if _shared is not None:
+        _shared.incr("generations")
+    return result
+
+
+def _claim(key, bypass_cache):
+    """Claims a generation for this process. Returns (owner token, claimed_elsewhere)."""
+    if _shared is None or key is None or bypass_cache:
+        return None, False
+    owner = _shared.claim(key, SHARED_LEASE_SECONDS)
+    return owner, owner is None
+
+
+def _peer_result(key):
+    """
+    Checks on a generation another process has claimed.
+
+    Returns:
+        tuple: The GeneratedImage once it is cached (else None), and whether the claim is still held.
+    """
+    if _cache.contains(key):
+        data = _cache.get(key)
+        if data:
+            _shared.incr("shared_cache_hits")
+            return GeneratedImage(data), False
+    return None, _shared.is_claimed(key)
+
+
+def _wait_for_peer(key):
+    """Waits while another process generates `key`. Returns its GeneratedImage, or None to generate locally."""
+    deadline = time.monotonic() + SHARED_LEASE_SECONDS
+    while time.monotonic() < deadline:
+        image, claimed = _peer_result(key)
+        if image is not None or not claimed:
+            return image
+        time.sleep(0.2)
+    return None
+
+
+async def _await_peer(key):
+    """Async counterpart of _wait_for_peer."""
+    deadline = time.monotonic() + SHARED_LEASE_SECONDS
+    while time.monotonic() < deadline:
+        image, claimed = await asyncio.to_thread(_peer_result, key)
+        if image is not None or not claimed:
+            return image
+        await asyncio.sleep(0.2)
+    return None
+
+
+def _upload_size(contents):
+    """Request payload in bytes: the prompt and any text parts, plus the encoded bytes of every image part."""
+    size = 0
+    for item in contents:
+        if isinstance(item, str):
+            size += len(item.encode())
+        elif getattr(item, "inline_data", None) is not None:
+            size += len(item.inline_data.data)
+        elif getattr(item, "text", None):
+            size += len(item.text.encode())
+    return size
+
+
+def _as_generation_error(error):
+    """Wraps any exception in a classified GenerationError and records it in the metrics."""
+    if not isinstance(error, GenerationError):
+        error = GenerationError(str(error), classify_error(error))
+    metrics.REQUESTS.inc(outcome=error.kind)
+    if error.kind == SAFETY:
+        metrics.SAFETY_BLOCKS.inc()
+    return error
+
+
+def _call_model(contents, **options):
+    """
+    Calls the model under the shared limiter, retrying quota and transient errors.
+
+    Args:
+        contents (list): The request contents.
+        **options: Sampling options for the backend, e.g. seed or candidate_count.
+
+    Raises:
+        GenerationError: The classified error once retries are exhausted.
+    """
+    upload_size = _upload_size(contents)
+    for attempt in range(retry_policy.max_attempts):
+        if _shared_limiter is not None:
+            _shared_limiter.acquire()
+        ticket = limiter.acquire()
+        metrics.BYTES_UPLOADED.inc(upload_size)
+        started = time.perf_counter()
+        try:
+            with metrics.timed("model"):
+                response = backend.generate_content(contents, **options)
+        except Exception as e:
+            kind = classify_error(e)
+            limiter.release(ticket, kind)
+            if not retry_policy.should_retry(kind, attempt):
+                raise GenerationError(str(e), kind, getattr(e, "code", None)) from e
+            delay = retry_policy.delay(attempt)
+            _log_retry(kind, e, delay, attempt)
+            time.sleep(delay)
+            continue
+        limiter.release(ticket)
+        hedging.record(time.perf_counter() - started)
+        return response
+
+
+async def _acall_model(contents, send=None, **options):
+    """
+    Async counterpart of _call_model.
+
+    Args:
+        contents (list): The request contents.
+        send (callable, optional): Async function to send them with, e.g. a chat's send_message. Defaults to the backend.
+        **options: Sampling options for the backend, e.g. seed or candidate_count.
+    """
+    send = send or backend.agenerate_content
+    upload_size = _upload_size(contents)
+    for attempt in range(retry_policy.max_attempts):
+        if _shared_limiter is not None:
+            await _shared_limiter.aacquire()
+        ticket = await limiter.aacquire()
+        metrics.BYTES_UPLOADED.inc(upload_size)
+        started = time.perf_counter()
+        try:
+            with metrics.timed("model"):
+                response = await send(contents, **options)
+        except asyncio.CancelledError:
+            limiter.release(ticket, TRANSIENT)
+            raise
+        except Exception as e:
+            kind = classify_error(e)
+            limiter.release(ticket, kind)
+            if not retry_policy.should_retry(kind, attempt):
+                raise GenerationError(str(e), kind, getattr(e, "code", None)) from e
+            delay = retry_policy.delay(attempt)
+            _log_retry(kind, e, delay, attempt)
+            await asyncio.sleep(delay)
+            continue
+        limiter.release(ticket)
+        hedging.record(time.perf_counter() - started)
+        return response
+
+
+def _log_retry(kind, error, delay, attempt):
+    log_event(
+        logger, logging.WARNING,
+        f"⏳ {kind} error ({error}); retrying in {delay:.1f}s (attempt {attempt + 2}/{retry_policy.max_attempts})",
+        "model_retry", kind=kind, error=str(error), delay_s=round(delay, 3), attempt=attempt + 2,
+    )
+
+
+def _submit_hedged(executor, contents):
+    """Runs _call_model on the hedge pool in a copy of the caller's context, keeping its trace."""
+    return executor.submit(contextvars.copy_context().run, _call_model, contents)
+
+
+def _hedged_call(contents):
+    """
+    Calls the model, sending a duplicate if the first call outlives the hedge delay.
+
+    The token for a possible hedge is taken up front: without one the call runs
+    directly on the caller's thread, and with one the call and its hedge run on
+    a pool of two threads per token the budget can hold, so the pool stays small.
+    A sync call cannot be interrupted once it has started, so the losing call
+    is cancelled if it is still queued and otherwise left to finish in the
+    background with its result discarded.
+    """
+    global _hedge_executor
+    delay = hedging.delay()
+    if delay is None:
+        return _call_model(contents)
+    if not hedging.try_spend():
+        started = time.perf_counter()
+        try:
+            return _call_model(contents)
+        finally:
+            slow = time.perf_counter() - started > delay
+            metrics.HEDGES.inc(outcome="budget_exhausted" if slow else "not_needed")
+    if _hedge_executor is None:
+        _hedge_executor = ThreadPoolExecutor(max_workers=2 * hedging.max_tokens, thread_name_prefix="hedge")
+
+    primary = _submit_hedged(_hedge_executor, contents)
+    done, _ = wait([primary], timeout=delay)
+    if done:
+        hedging.refund()
+        metrics.HEDGES.inc(outcome="not_needed")
+        return primary.result()
+
+    hedge = _submit_hedged(_hedge_executor, contents)
+    pending = {primary, hedge}
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                for loser in pending:
+                    loser.cancel()
+                metrics.HEDGES.inc(outcome="hedge_won" if future is hedge else "primary_won")
+                return future.result()
+    metrics.HEDGES.inc(outcome="primary_won")
+    return primary.result()  # both failed; surface the original call's error
+
+
+async def _ahedged_call(contents):
+    """Async counterpart of _hedged_call; the losing call is cancelled outright."""
+    delay = hedging.delay()
+    if delay is None:
+        return await _acall_model(contents)
+
+    primary = asyncio.ensure_future(_acall_model(contents))
+    pending = {primary}
+    try:
+        done, _ = await asyncio.wait(pending, timeout=delay)
+        if done:
+            metrics.HEDGES.inc(outcome="not_needed")
+            return primary.result()
+        if not hedging.try_spend():
+            metrics.HEDGES.inc(outcome="budget_exhausted")
+            return await primary
+
+        hedge = asyncio.ensure_future(_acall_model(contents))
+        pending = {primary, hedge}
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    metrics.HEDGES.inc(outcome="hedge_won" if task is hedge else "primary_won")
+                    return task.result()
+        metrics.HEDGES.inc(outcome="primary_won")
+        return primary.result()  # both failed; surface the original call's error
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+def generate_image(prompt, base_images=None, bypass_cache=False, raw=False, raise_errors=False):
     """
     Generates an image from a prompt, optionally using one or more base images.
 
+    Quota (429) and transient errors are retried with jittered exponential
+    backoff, and every call goes through the shared adaptive concurrency limiter.
+    With hedging enabled, a call slower than the configured latency percentile
+    is raced against a duplicate (see enable_hedging).
+
     Args:
         prompt (str): The text prompt.
-        base_images (list[PIL.Image.Image], optional): A list of base images for refinement or composition. Defaults to None.
+        base_images (list[PIL.Image.Image | EncodedImage], optional): A list of base images for refinement or composition. Defaults to None.
+        bypass_cache (bool, optional): Skip the cache lookup and force a fresh sample. The new result still refreshes the cache. Defaults to False.
+        raw (bool, optional): Return the model's encoded bytes as a GeneratedImage instead of decoding them. Defaults to False.
+        raise_errors (bool, optional): Raise a classified GenerationError instead of printing it and returning None. Defaults to False.
 
     Returns:
-        PIL.Image.Image: The generated image object, or None.
+        PIL.Image.Image | GeneratedImage: The generated image object, or None.
     """
+    metrics.IN_FLIGHT.inc()
+    owner = key = None
     try:
-        contents = [prompt]
-        if base_images:
-            contents.extend(base_images)
+        key, cached = _cached_lookup(prompt, base_images, bypass_cache)
+        if cached is None:
+            owner, claimed_elsewhere = _claim(key, bypass_cache)
+            if claimed_elsewhere:
+                cached = _wait_for_peer(key)
+        if cached is not None:
+            metrics.REQUESTS.inc(outcome="cache_hit")
+            return cached if raw else cached.to_pil()
+
+        response = _hedged_call(_build_contents(prompt, base_images))
+        result = _finish(key, response, raw)
+        metrics.REQUESTS.inc(outcome="success")
+        return result
 
-        response = client.models.generate_content(
-            model="gemini-2.5-flash-image-preview",
-            contents=contents
+    except Exception as e:
+        error = _as_generation_error(e)
+        if raise_errors:
+            if error is e:
+                raise
+            raise error from e
+        log_event(
+            logger, logging.ERROR, f"❌ Error during image generation: {e}",
+            "generation_failed", kind=error.kind, error=str(e),
         )
+    finally:
+        if owner is not None:
+            _shared.release(key, owner)
+        metrics.IN_FLIGHT.dec()
+    
+    return None
+
+
+async def agenerate_image(prompt, base_images=None, bypass_cache=False, raw=False, raise_errors=False):
+    """
+    Async counterpart of generate_image built on the backend's async API.
+
+    Awaiting this does not block the event loop while the model call is in
+    flight, so an async server can serve many generations concurrently.
 
-        # --- Start of robust response handling ---
-        if not response.candidates:
-            print("❌ The model did not return any candidates. This might be due to a safety block.")
-            # Try to print more details if available
-            try:
-                print(f"Prompt Feedback: {response.prompt_feedback}")
-            except Exception:
-                pass # Ignore if prompt_feedback is not available
-            return None
-
-        candidate = response.candidates[0]
-        if not candidate.content or not candidate.content.parts:
-            print("❌ The model's response was empty. This can happen if the prompt is blocked for safety reasons.")
-            print(f"Finish Reason: {candidate.finish_reason}")
-            print(f"Safety Ratings: {candidate.safety_ratings}")
-            return None
-        # --- End of robust response handling ---
-
-        for part in candidate.content.parts:
-            if part.inline_data is not None:
-                return Image.open(BytesIO(part.inline_data.data))
+    Args:
+        prompt (str): The text prompt.
+        base_images (list[PIL.Image.Image | EncodedImage], optional): A list of base images for refinement or composition. Defaults to None.
+        bypass_cache (bool, optional): Skip the cache lookup and force a fresh sample. Defaults to False.
+        raw (bool, optional): Return the model's encoded bytes as a GeneratedImage instead of decoding them. Defaults to False.
+        raise_errors (bool, optional): Raise a classified GenerationError instead of printing it and returning None. Defaults to False.
+
+    Returns:
+        PIL.Image.Image | GeneratedImage: The generated image object, or None.
+    """
+    metrics.IN_FLIGHT.inc()
+    owner = key = None
+    try:
+        # Hashing base images and touching the disk store happen off the event loop
+        key, cached = await asyncio.to_thread(_cached_lookup, prompt, base_images, bypass_cache)
+        if cached is None:
+            owner, claimed_elsewhere = await asyncio.to_thread(_claim, key, bypass_cache)
+            if claimed_elsewhere:
+                cached = await _await_peer(key)
+        if cached is not None:
+            metrics.REQUESTS.inc(outcome="cache_hit")
+            return cached if raw else cached.to_pil()
+
+        response = await _ahedged_call(_build_contents(prompt, base_images))
+        result = await asyncio.to_thread(_finish, key, response, raw)
+        metrics.REQUESTS.inc(outcome="success")
+        return result
 
     except Exception as e:
-        print(f"❌ Error during image generation: {e}")
-    
+        error = _as_generation_error(e)
+        if raise_errors:
+            if error is e:
+                raise
+            raise error from e
+        log_event(
+            logger, logging.ERROR, f"❌ Error during image generation: {e}",
+            "generation_failed", kind=error.kind, error=str(e),
+        )
+    finally:
+        if owner is not None:
+            await asyncio.to_thread(_shared.release, key, owner)
+        metrics.IN_FLIGHT.dec()
+
+    return None
+
+
+# Most variants one call to the variant functions may ask for
+MAX_VARIANTS = int(os.getenv("MAX_VARIANTS", "8"))
+
+
+def _plan_variants(count, seed):
+    """
+    Splits `count` variants into model calls.
+
+    Each call asks for as many candidates as the backend supports in one
+    response (n = max_candidates) and gets its own seed, so every call samples
+    something different: call i uses seed + i * n, i.e. the seed of the first
+    variant it covers. With one candidate per call that is simply seed + i.
+
+    Returns:
+        tuple: The base seed, and a (seed, candidate_count) pair per call; candidate_count is None for one candidate.
+    """
+    if not 1 <= count <= MAX_VARIANTS:
+        raise ValueError(f"count must be between 1 and {MAX_VARIANTS}, got {count}")
+    if seed is None:
+        seed = random.randrange(2**31 - MAX_VARIANTS)
+    per_call = max(1, getattr(backend, "max_candidates", 1))
+    calls = []
+    for offset in range(0, count, per_call):
+        candidates = min(per_call, count - offset)
+        calls.append((seed + offset, candidates if candidates > 1 else None))
+    return seed, calls
+
+
+def _finish_variants(response, raw, scorer):
+    """Extracts every image of a response, scoring each and decoding it unless `raw`. Returns (candidate, image, score) tuples."""
+    results = []
+    with metrics.timed("decode"):
+        for candidate, generated in _extract_images(response):
+            metrics.BYTES_DOWNLOADED.inc(len(generated.data))
+            value = scorer(generated) if scorer is not None else None
+            image = generated
+            if not raw:
+                image = generated.to_pil()
+                image.load()
+            results.append((candidate, image, value))
+    if _shared is not None:
+        _shared.incr("generations")
+    return results
+
+
+def _variant_error(error, seed):
+    error = _as_generation_error(error)
+    log_event(
+        logger, logging.ERROR, f"❌ Variant with seed {seed} failed: {error}",
+        "variant_failed", kind=error.kind, error=str(error), seed=seed,
+    )
+    return error
+
+
+def _variant_call(contents, seed, candidate_count, raw, scorer):
+    """
+    Runs one model call of a variant fan-out.
+
+    Returns:
+        tuple: The call's seed, its (candidate, image, score) results and None; or, if
+        it failed, one empty result per candidate asked for and the GenerationError.
+    """
+    metrics.IN_FLIGHT.inc()
+    try:
+        response = _call_model(contents, seed=seed, candidate_count=candidate_count)
+        results = _finish_variants(response, raw, scorer)
+        metrics.REQUESTS.inc(outcome="success")
+        return seed, results, None
+    except Exception as e:
+        return seed, [(candidate, None, None) for candidate in range(candidate_count or 1)], _variant_error(e, seed)
+    finally:
+        metrics.IN_FLIGHT.dec()
+
+
+async def _avariant_call(contents, seed, candidate_count, raw, scorer):
+    """Async counterpart of _variant_call."""
+    metrics.IN_FLIGHT.inc()
+    try:
+        response = await _acall_model(contents, seed=seed, candidate_count=candidate_count)
+        results = await asyncio.to_thread(_finish_variants, response, raw, scorer)
+        metrics.REQUESTS.inc(outcome="success")
+        return seed, results, None
+    except Exception as e:
+        return seed, [(candidate, None, None) for candidate in range(candidate_count or 1)], _variant_error(e, seed)
+    finally:
+        metrics.IN_FLIGHT.dec()
+
+
+def _to_variants(outcome, first_index, started):
+    seed, results, error = outcome
+    latency = time.perf_counter() - started
+    return [
+        Variant(first_index + position, seed, candidate, image, value, latency, error)
+        for position, (candidate, image, value) in enumerate(results)
+    ]
+
+
+def iter_variants(prompt, count=4, base_images=None, raw=False, score=None, seed=None):
+    """
+    Generates `count` variants of a prompt concurrently and yields each as soon as it is ready.
+
+    The calls are fanned out at once (bounded only by the shared concurrency
+    limiter), so k variants take about as long as the slowest of k single
+    generations rather than k in a row. Backends that return several
+    candidates per response (max_candidates > 1) are asked for that many per
+    call, and every image part of every candidate is kept. Variants are
+    always fresh samples: they skip the response cache and hedging.
+
+    Args:
+        prompt (str): The text prompt.
+        count (int, optional): Variants to generate, at most MAX_VARIANTS. Defaults to 4.
+        base_images (list[PIL.Image.Image | EncodedImage], optional): Base images sent with every call. Defaults to None.
+        raw (bool, optional): Yield GeneratedImage bytes instead of decoded PIL images. Defaults to False.
+        score (str | callable, optional): Scoring hook run on each image ("size", "entropy" or a
+            function taking a GeneratedImage); higher is better. Defaults to None.
+        seed (int, optional): Base sampling seed. Call i asks for n = max_candidates candidates with
+            seed + i * n, so variant j comes from seed + (j // n) * n, candidate j % n. Each Variant
+            records its call's seed and candidate number. Defaults to a random seed.
+
+    Yields:
+        Variant: In completion order. Failed calls yield variants with `error` set instead of raising.
+    """
+    scorer = get_scorer(score)
+    _, calls = _plan_variants(count, seed)
+    contents = _build_contents(prompt, base_images)
+    started = time.perf_counter()
+    index = 0
+    executor = ThreadPoolExecutor(max_workers=len(calls), thread_name_prefix="variant")
+    try:
+        futures = [
+            executor.submit(_variant_call, contents, call_seed, candidates, raw, scorer)
+            for call_seed, candidates in calls
+        ]
+        for future in as_completed(futures):
+            for variant in _to_variants(future.result(), index, started):
+                index += 1
+                yield variant
+    finally:
+        # A caller that stops early does not wait for the remaining calls
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def generate_variants(prompt, count=4, base_images=None, raw=False, score=None, seed=None):
+    """
+    Generates `count` variants of a prompt concurrently and returns them ranked.
+
+    Takes the same arguments as iter_variants.
+
+    Returns:
+        list[Variant]: Best score first (completion order without a scoring hook), failures last.
+    """
+    return rank(iter_variants(prompt, count, base_images, raw=raw, score=score, seed=seed))
+
+
+async def astream_variants(prompt, count=4, base_images=None, raw=False, score=None, seed=None, submit=None):
+    """
+    Async counterpart of iter_variants: an async generator yielding each Variant as it completes.
+
+    Leaving the loop early cancels the calls still in flight.
+
+    Args:
+        submit (callable, optional): Schedules each model call of the fan-out. It is given an async
+            function without arguments and returns an awaitable of its result, e.g. a job queue's
+            submit-and-wait, so every call is counted and bounded like any other job. An error it
+            raises (such as a full queue) propagates. Defaults to starting the calls directly.
+
+        The other arguments are those of iter_variants.
+    """
+    scorer = get_scorer(score)
+    _, calls = _plan_variants(count, seed)
+    contents = _build_contents(prompt, base_images)
+    started = time.perf_counter()
+    index = 0
+    tasks = []
+    try:
+        for call_seed, candidates in calls:
+            call = functools.partial(_avariant_call, contents, call_seed, candidates, raw, scorer)
+            tasks.append(asyncio.ensure_future(submit(call) if submit is not None else call()))
+        for next_done in asyncio.as_completed(tasks):
+            for variant in _to_variants(await next_done, index, started):
+                index += 1
+                yield variant
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def agenerate_variants(prompt, count=4, base_images=None, raw=False, score=None, seed=None, submit=None):
+    """Async counterpart of generate_variants; `submit` is as for astream_variants."""
+    return rank([
+        variant
+        async for variant in astream_variants(prompt, count, base_images, raw=raw, score=score, seed=seed, submit=submit)
+    ])
+
+
+def create_chat(history=None):
+    """
+    Starts a multi-turn chat with the active backend for iterative refinement.
+
+    Args:
+        history (list[google.genai.types.Content], optional): Earlier turns to seed the chat with.
+    """
+    return backend.create_chat(history)
+
+
+async def achat_generate_image(chat, prompt, base_images=None, raw=False, raise_errors=False):
+    """
+    Sends one turn of a multi-turn chat and returns the image it produced.
+
+    The chat keeps earlier prompts and images as context, so refinements only
+    need to send the new instruction instead of re-uploading the current image.
+
+    Args:
+        chat: A chat from create_chat().
+        prompt (str): The instruction for this turn.
+        base_images (list[PIL.Image.Image | EncodedImage], optional): Extra images for this turn. Defaults to None.
+        raw (bool, optional): Return a GeneratedImage instead of a PIL image. Defaults to False.
+        raise_errors (bool, optional): Raise a classified GenerationError instead of printing it and returning None. Defaults to False.
+
+    Returns:
+        PIL.Image.Image | GeneratedImage: The generated image object, or None.
+    """
+    metrics.IN_FLIGHT.inc()
+    try:
+        response = await _acall_model(_build_contents(prompt, base_images), send=chat.send_message)
+        result = await asyncio.to_thread(_finish, None, response, raw)
+        metrics.REQUESTS.inc(outcome="success")
+        return result
+
+    except Exception as e:
+        error = _as_generation_error(e)
+        if raise_errors:
+            if error is e:
+                raise
+            raise error from e
+        log_event(
+            logger, logging.ERROR, f"❌ Error during image refinement: {e}",
+            "refinement_failed", kind=error.kind, error=str(e),
+        )
+    finally:
+        metrics.IN_FLIGHT.dec()
+
     return None
 
 
 def generate_and_save_image(prompt, filename):
    """
    Generate an image and save it to the output folder
+
+   The model's bytes are written as-is; if they are not PNG the file
+   extension is corrected to match (e.g. my_image.jpg).
   
    Args:
        prompt (str): Description of what you want to create
@@ -72,17 +877,16 @@ def generate_and_save_image(prompt, filename):
    Returns:
        bool: True if successful, False otherwise
    """
-   image = generate_image(prompt)
+   image = generate_image(prompt, raw=True)
    if image:
        try:
            # Ensure output directory exists
            output_dir = Path("output")
            output_dir.mkdir(exist_ok=True)
            
-           image_path = output_dir / filename
-           image.save(image_path)
-           print(f"✅ Image saved as {image_path}")
+           image_path = get_store().put(image, prompt, model=backend.model, alias=output_dir / filename)
+           log_event(logger, logging.INFO, f"✅ Image saved as {image_path}", "image_saved", path=str(image_path))
            return True
        except Exception as e:
-           print(f"❌ Error saving image: {e}")
+           log_event(logger, logging.ERROR, f"❌ Error saving image: {e}", "save_failed", error=str(e))
    return False
@@ -0,0 +1,114 @@
+import asyncio
+import threading
+import time
+from collections import deque
+
+# Event types of a batch run, in the order an item goes through them
+BATCH_STARTED = "batch_started"
+ITEM_QUEUED = "queued"
+ITEM_STARTED = "started"
+ITEM_FINISHED = "finished"
+ITEM_FAILED = "failed"
+BATCH_FINISHED = "batch_finished"
+
+
+class EventStream:
+    """
+    Ordered, replayable stream of progress events for one batch.
+
+    Producers call emit() from any thread. Each event is a dict with an
+    increasing `id`, its `type`, a timestamp and the producer's fields.
+    Consumers either register a listener, which is called in the producer's
+    thread (the CLI progress display), or iterate with subscribe() from an
+    event loop (the server's SSE endpoint). Recent events are kept so a
+    subscriber that connects late or reconnects with its last seen id
+    misses nothing still in the history.
+
+    Args:
+        max_history (int, optional): Events kept for replay. Defaults to 10000.
+    """
+
+    def __init__(self, max_history=10000):
+        self._events = deque(maxlen=max_history)
+        self._next_id = 1
+        self._listeners = []
+        self._waiters = set()
+        self._lock = threading.Lock()
+        self.closed = False
+
+    def add_listener(self, callback):
+        """Calls `callback(event)` for every later event."""
+        with self._lock:
+            self._listeners.append(callback)
+
+    def emit(self, event_type, **fields):
+        """
+        Records an event and notifies listeners and subscribers.
+
+        Returns:
+            dict: The event.
+        """
+        with self._lock:
+            event = {"id": self._next_id, "type": event_type, "ts": round(time.time(), 3), **fields}
+            self._next_id += 1
+            self._events.append(event)
+            listeners = list(self._listeners)
+        for listener in listeners:
+            listener(event)
+        self._wake()
+        return event
+
+    def close(self):
+        """Marks the stream as complete; subscribers stop once they have read every event."""
+        with self._lock:
+            self.closed = True
+        self._wake()
+
+    def since(self, after=0):
+        """
+        Returns the kept events with an id above `after`, and whether the stream is closed.
+        """
+        with self._lock:
+            return [event for event in self._events if event["id"] > after], self.closed
+
+    def _wake(self):
+        with self._lock:
+            waiters = list(self._waiters)
+        for loop, wakeup in waiters:
+            try:
+                loop.call_soon_threadsafe(wakeup.set)
+            except RuntimeError:
+                pass  # the subscriber's loop has shut down
+
+    async def subscribe(self, after=0, heartbeat=None):
+        """
+        Yields every event with an id above `after`, then new ones as they are emitted, until the stream closes.
+
+        Args:
+            after (int, optional): Last event id the caller has seen. Defaults to 0 (replay everything kept).
+            heartbeat (float, optional): Yield None after this many idle seconds, so the caller can keep
+                its connection alive. Defaults to never.
+        """
+        wakeup = asyncio.Event()
+        waiter = (asyncio.get_running_loop(), wakeup)
+        with self._lock:
+            self._waiters.add(waiter)
+        try:
+            while True:
+                # Clear before reading, so an emit() in between still wakes the wait below
+                wakeup.clear()
+                events, closed = self.since(after)
+                for event in events:
+                    after = event["id"]
+                    yield event
+                if events:
+                    continue
+                if closed:
+                    return
+                try:
+                    await asyncio.wait_for(wakeup.wait(), heartbeat)
+                except asyncio.TimeoutError:
+                    yield None
+        finally:
+            with self._lock:
+                self._waiters.discard(waiter)
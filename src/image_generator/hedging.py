@@ -0,0 +1,124 @@
+import math
+import threading
+from collections import deque
+
+
+class LatencyTracker:
+    """
+    Sliding window of recent model-call latencies with percentile lookups.
+
+    Args:
+        window (int, optional): Number of most recent latencies kept. Defaults to 500.
+    """
+
+    def __init__(self, window=500):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, p):
+        """Returns the p-th percentile (0-100) of the window, or None if it is empty."""
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        rank = max(0, math.ceil(p / 100 * len(samples)) - 1)
+        return samples[min(rank, len(samples) - 1)]
+
+    def __len__(self):
+        return len(self._samples)
+
+
+class HedgePolicy:
+    """
+    Decides when to send a duplicate of a slow model call, within a budget.
+
+    A call that has not returned after the `percentile`-th latency of recent
+    calls gets a hedge: a second identical request, whichever finishes first
+    wins. Hedges are paid for from a token bucket that earns `budget` tokens per
+    call, so at most that fraction of calls (10% by default) are duplicated even
+    when the backend slows down across the board. Until `min_samples` latencies
+    have been seen, nothing is hedged.
+
+    Args:
+        percentile (float, optional): Latency percentile after which to hedge. Defaults to 95.
+        budget (float, optional): Maximum hedges per call, e.g. 0.1 for 10%. Defaults to 0.1.
+        min_samples (int, optional): Latencies needed before hedging starts. Defaults to 20.
+        window (int, optional): Recent latencies the percentile is computed over. Defaults to 500.
+    """
+
+    def __init__(self, percentile=95.0, budget=0.1, min_samples=20, window=500):
+        self.percentile = percentile
+        self.budget = budget
+        self.min_samples = min_samples
+        self.enabled = False
+        self.tracker = LatencyTracker(window)
+        self._tokens = 0.0
+        self._max_tokens = max(1.0, budget * 100)
+        self._lock = threading.Lock()
+
+    def configure(self, percentile=None, budget=None, min_samples=None):
+        """Turns hedging on, optionally changing its settings."""
+        with self._lock:
+            if percentile is not None:
+                self.percentile = percentile
+            if budget is not None:
+                self.budget = budget
+                self._max_tokens = max(1.0, budget * 100)
+            if min_samples is not None:
+                self.min_samples = min_samples
+            self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def record(self, seconds):
+        """Adds a successful call's latency to the window."""
+        self.tracker.record(seconds)
+
+    def delay(self):
+        """
+        Returns how long to wait before hedging a call that is starting now.
+
+        Every call earns budget tokens here, hedged or not.
+
+        Returns:
+            float: Seconds to wait, or None if hedging is off or there is not enough history yet.
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            self._tokens = min(self._max_tokens, self._tokens + self.budget)
+        if len(self.tracker) < self.min_samples:
+            return None
+        return self.tracker.percentile(self.percentile)
+
+    def try_spend(self):
+        """Takes a token for one hedge. Returns False when the budget is exhausted."""
+        with self._lock:
+            if self._tokens >= 1.0:
+                self._tokens -= 1.0
+                return True
+            return False
+
+    def refund(self):
+        """Returns a token taken by try_spend() for a hedge that was not sent after all."""
+        with self._lock:
+            self._tokens = min(self._max_tokens, self._tokens + 1.0)
+
+    @property
+    def max_tokens(self):
+        """Most tokens the bucket holds, and so the most hedges that can be paid for at once."""
+        return math.ceil(self._max_tokens)
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "percentile": self.percentile,
+            "budget": self.budget,
+            "samples": len(self.tracker),
+            "hedge_after_seconds": self.tracker.percentile(self.percentile),
+        }
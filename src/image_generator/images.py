@@ -0,0 +1,422 @@
+import hashlib
+import math
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from io import BytesIO
+from pathlib import Path
+from .metrics import timed
+
+# PIL and the SDK types are imported where they are used, so importing this module stays cheap
+
+# Preprocessing settings for base images sent to the model
+MAX_EDGE = int(os.getenv("BASE_IMAGE_MAX_EDGE", "1536"))
+FORMAT = os.getenv("BASE_IMAGE_FORMAT", "JPEG").upper()
+QUALITY = int(os.getenv("BASE_IMAGE_QUALITY", "90"))
+PAYLOAD_CACHE_BYTES = int(os.getenv("BASE_IMAGE_CACHE_MB", "256")) * 1024 * 1024
+
+# Decoded-pixel memory allowed for all decodes in flight, and for the base images of one request
+DECODE_BUDGET_BYTES = int(os.getenv("IMAGE_DECODE_BUDGET_MB", "512")) * 1024 * 1024
+REQUEST_BUDGET_BYTES = int(os.getenv("IMAGE_REQUEST_BUDGET_MB", "256")) * 1024 * 1024
+# Longest a decode waits for room in the global budget before giving up
+DECODE_WAIT_SECONDS = float(os.getenv("IMAGE_DECODE_WAIT_SECONDS", "10"))
+
+_MIME_TYPES = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp"}
+_EXTENSIONS = {"image/png": ".png", "image/jpeg": ".jpg", "image/webp": ".webp", "image/gif": ".gif"}
+
+
+def sniff_mime_type(data):
+    """Guesses an image MIME type from its leading magic bytes."""
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if data.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    return "application/octet-stream"
+
+
+class GeneratedImage:
+    """
+    The encoded bytes of a generated image, exactly as the model returned them.
+
+    The output store writes the bytes as they are, so outputs are never decoded
+    and recompressed. Pixels are decoded only when to_pil() or show() is called.
+    """
+
+    __slots__ = ("data", "mime_type", "_pil")
+
+    def __init__(self, data, mime_type=None):
+        self.data = data
+        self.mime_type = mime_type or sniff_mime_type(data)
+        self._pil = None
+
+    @property
+    def extension(self):
+        """File extension matching the MIME type, e.g. ".png"."""
+        return _EXTENSIONS.get(self.mime_type, ".bin")
+
+    def to_pil(self):
+        """Decodes the bytes into a PIL image (once) and returns it."""
+        if self._pil is None:
+            from PIL import Image
+            self._pil = Image.open(BytesIO(self.data))
+        return self._pil
+
+    def show(self, title=None):
+        self.to_pil().show(title=title)
+
+
+class EncodedImage:
+    """
+    A base image that has already been downsized and encoded for upload.
+
+    Passing one of these to generate_image sends the bytes as-is, so the SDK
+    does not have to re-encode a full-resolution PIL image on every call.
+    """
+
+    __slots__ = ("data", "mime_type", "size", "source_bytes", "digest", "source_path")
+
+    def __init__(self, data, mime_type, size, source_bytes, source_path=None):
+        self.data = data
+        self.mime_type = mime_type
+        self.size = size
+        self.source_bytes = source_bytes
+        self.digest = hashlib.sha256(data).hexdigest()
+        # The file it was prepared from, if any, so records can point back to it
+        self.source_path = source_path
+
+    @property
+    def bytes_saved(self):
+        """Bytes saved compared to uploading the source as it was."""
+        return max(self.source_bytes - len(self.data), 0)
+
+    def to_part(self):
+        """Returns the SDK part carrying these bytes."""
+        from google.genai import types
+        return types.Part.from_bytes(data=self.data, mime_type=self.mime_type)
+
+
+def pil_to_part(image):
+    """
+    Encodes a PIL image into an SDK part the same way the SDK would on upload.
+
+    The result is lossless PNG, or the file's own JPEG data for JPEG files, so
+    what is sent does not change. Encoding it once up front lets the upload be
+    measured and spares retries from encoding it again.
+
+    Args:
+        image (PIL.Image.Image): The image to send.
+
+    Returns:
+        google.genai.types.Part: The part carrying the encoded bytes.
+    """
+    from google.genai import types
+    image_format, save_params = "PNG", {}
+    if image.format == "JPEG" and getattr(image, "filename", "") and image.mode in ("1", "L", "RGB", "RGBX", "CMYK"):
+        image_format, save_params = "JPEG", {"quality": "keep"}
+    buffer = BytesIO()
+    with timed("encode"):
+        image.save(buffer, image_format, **save_params)
+    return types.Part.from_bytes(data=buffer.getvalue(), mime_type=f"image/{image_format.lower()}")
+
+
+class ImageTooLargeError(ValueError):
+    """Raised when decoding an image would exceed a memory budget."""
+
+
+class DecodeBudgetBusyError(ImageTooLargeError):
+    """Raised when an image fits the budget but other decodes keep it full for longer than the wait timeout."""
+
+
+class MemoryBudget:
+    """
+    A byte budget for decoded pixels.
+
+    reserve() holds bytes while an image is decoded and waits, up to `timeout`,
+    until enough of the budget is free, so concurrent decodes cannot together
+    exceed it. take() spends bytes for good, which suits one-shot budgets such
+    as a single request's. Either raises ImageTooLargeError for a size the
+    budget can never fit.
+
+    Args:
+        max_bytes (int): The budget.
+        timeout (float, optional): Longest reserve() waits for room, in seconds. Defaults to no limit.
+    """
+
+    def __init__(self, max_bytes, timeout=None):
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.used = 0
+        self._condition = threading.Condition()
+
+    @contextmanager
+    def reserve(self, nbytes):
+        """
+        Holds `nbytes` of the budget for the duration of the with block.
+
+        Raises:
+            ImageTooLargeError: If `nbytes` is more than the whole budget.
+            DecodeBudgetBusyError: If the budget does not have room within `timeout` seconds.
+        """
+        if nbytes > self.max_bytes:
+            raise ImageTooLargeError(
+                f"Image needs {nbytes / 1024 / 1024:.0f} MB decoded, over the {self.max_bytes / 1024 / 1024:.0f} MB budget"
+            )
+        with self._condition:
+            if not self._condition.wait_for(lambda: self.used + nbytes <= self.max_bytes, self.timeout):
+                raise DecodeBudgetBusyError(
+                    f"Image needs {nbytes / 1024 / 1024:.0f} MB decoded, but the budget stayed full for {self.timeout:g}s"
+                )
+            self.used += nbytes
+        try:
+            yield
+        finally:
+            with self._condition:
+                self.used -= nbytes
+                self._condition.notify_all()
+
+    def take(self, nbytes):
+        """Spends `nbytes` of the budget without giving them back."""
+        with self._condition:
+            if self.used + nbytes > self.max_bytes:
+                raise ImageTooLargeError(
+                    f"Image needs {nbytes / 1024 / 1024:.0f} MB decoded, over the "
+                    f"{(self.max_bytes - self.used) / 1024 / 1024:.0f} MB budget left"
+                )
+            self.used += nbytes
+
+
+_decode_budget = MemoryBudget(DECODE_BUDGET_BYTES, timeout=DECODE_WAIT_SECONDS)
+
+
+def request_budget():
+    """Returns a fresh budget for the base images of one request (IMAGE_REQUEST_BUDGET_MB)."""
+    return MemoryBudget(REQUEST_BUDGET_BYTES)
+
+
+def open_image(source):
+    """
+    Opens an image lazily: only the header is read until the pixels are needed.
+
+    Use it as a context manager so the file handle is closed on exit.
+
+    Args:
+        source (str | Path | bytes): The image file or its encoded bytes.
+
+    Returns:
+        PIL.Image.Image: The unloaded image.
+    """
+    from PIL import Image
+    if isinstance(source, (bytes, bytearray)):
+        source = BytesIO(source)
+    return Image.open(source)
+
+
+def decoded_bytes(image):
+    """Memory the image's pixels take once decoded, from its header."""
+    return image.width * image.height * len(image.getbands())
+
+
+def _draft(image, max_edge):
+    """Lets the JPEG decoder scale down by 1/2, 1/4 or 1/8 while staying at least `max_edge` on the long side."""
+    if image.format != "JPEG" or max(image.size) <= max_edge:
+        return
+    scale = max_edge / max(image.size)
+    image.draft(image.mode, (math.ceil(image.width * scale), math.ceil(image.height * scale)))
+
+
+@contextmanager
+def _decoding(image, max_edge, budget=None):
+    """
+    Sets up a lazily opened image for decoding within the memory budgets.
+
+    JPEGs are drafted down towards `max_edge` first, so the budgets are charged
+    for the reduced size. Oversized images are rejected before any pixels are read.
+    """
+    _draft(image, max_edge)
+    nbytes = decoded_bytes(image)
+    if budget is not None:
+        budget.take(nbytes)
+    with _decode_budget.reserve(nbytes):
+        yield
+
+
+def load_image(source, max_edge=None, budget=None):
+    """
+    Decodes an image file or bytes into a PIL image and closes the file.
+
+    Args:
+        source (str | Path | bytes): The image to load.
+        max_edge (int, optional): Longest edge needed; JPEGs are decoded at a reduced scale down to it.
+            Defaults to full size.
+        budget (MemoryBudget, optional): A request budget to charge the decoded size to.
+
+    Returns:
+        PIL.Image.Image: The loaded image, no longer tied to the file.
+    """
+    with open_image(source) as image:
+        with _decoding(image, max_edge or max(image.size), budget):
+            with timed("load"):
+                image.load()
+            return image.copy()
+
+
+class _PayloadCache:
+    """Byte-capped LRU of EncodedImage objects."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._key_locks = {}
+
+    @contextmanager
+    def key_lock(self, key):
+        """
+        Serializes encoding of one key, so it is encoded only once.
+
+        The lock is dropped when the block exits, whether the encode succeeded or
+        raised, so uploads that fail to decode do not leave locks behind.
+        """
+        with self._lock:
+            lock = self._key_locks.setdefault(key, threading.Lock())
+        with lock:
+            try:
+                yield
+            finally:
+                with self._lock:
+                    if self._key_locks.get(key) is lock:
+                        del self._key_locks[key]
+
+    def get(self, key):
+        with self._lock:
+            encoded = self._entries.get(key)
+            if encoded is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return encoded
+
+    def put(self, key, encoded):
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = encoded
+            self._bytes += len(encoded.data)
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted.data)
+
+
+_payload_cache = _PayloadCache(PAYLOAD_CACHE_BYTES)
+
+
+def _encode(image, source_bytes, max_edge, image_format, quality):
+    """Downsizes `image` to `max_edge` and encodes it in `image_format`."""
+    from PIL import Image
+    if max(image.size) > max_edge:
+        scale = max_edge / max(image.size)
+        new_size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+        image = image.resize(new_size, Image.LANCZOS)
+
+    has_alpha = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+    if image_format == "JPEG" and has_alpha:
+        image_format = "PNG"  # JPEG cannot carry transparency
+    if image_format == "JPEG" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+
+    buffer = BytesIO()
+    save_params = {"quality": quality} if image_format in ("JPEG", "WEBP") else {"optimize": True}
+    image.save(buffer, image_format, **save_params)
+    return EncodedImage(buffer.getvalue(), _MIME_TYPES[image_format], image.size, source_bytes)
+
+
+def prepare_base_image(source, max_edge=None, image_format=None, quality=None, budget=None):
+    """
+    Downsizes and encodes a base image once, reusing the result on later calls.
+
+    File sources are cached by resolved path, modification time and size; uploaded
+    bytes by their hash; in-memory PIL images by a hash of their pixels.
+
+    Args:
+        source (str | Path | bytes | PIL.Image.Image): The image file, encoded bytes or object to prepare.
+        max_edge (int, optional): Longest edge in pixels. Defaults to BASE_IMAGE_MAX_EDGE.
+        image_format (str, optional): "JPEG", "WEBP" or "PNG". Defaults to BASE_IMAGE_FORMAT.
+        quality (int, optional): Encoder quality for JPEG/WEBP. Defaults to BASE_IMAGE_QUALITY.
+        budget (MemoryBudget, optional): The request's budget (see request_budget()); decoding is charged to it.
+
+    Returns:
+        EncodedImage: The encoded payload, ready to pass to generate_image.
+
+    Raises:
+        ImageTooLargeError: If decoding the image would exceed the request or global memory budget.
+    """
+    from PIL import Image
+    max_edge = max_edge or MAX_EDGE
+    image_format = (image_format or FORMAT).upper()
+    quality = quality or QUALITY
+    settings = (max_edge, image_format, quality)
+
+    if isinstance(source, Image.Image):
+        pixels = source.tobytes()
+        key = ("pixels", hashlib.sha256(pixels).hexdigest(), source.mode, source.size) + settings
+    elif isinstance(source, (bytes, bytearray)):
+        key = ("bytes", hashlib.sha256(source).hexdigest()) + settings
+    else:
+        path = Path(source).resolve()
+        stat = path.stat()
+        key = ("file", str(path), stat.st_mtime_ns, stat.st_size) + settings
+
+    cached = _payload_cache.get(key)
+    if cached is not None:
+        return cached
+
+    # Concurrent callers for the same image wait for the first encode instead of repeating it
+    with _payload_cache.key_lock(key):
+        cached = _payload_cache.get(key)
+        if cached is not None:
+            return cached
+        if isinstance(source, Image.Image):
+            # Without preprocessing the SDK uploads these pixels losslessly; count their raw size
+            with timed("encode"):
+                encoded = _encode(source, len(pixels), *settings)
+        else:
+            source_bytes = len(source) if isinstance(source, (bytes, bytearray)) else stat.st_size
+            with open_image(source if isinstance(source, (bytes, bytearray)) else path) as image:
+                with _decoding(image, max_edge, budget):
+                    with timed("load"):
+                        image.load()
+                    with timed("encode"):
+                        encoded = _encode(image, source_bytes, *settings)
+            if not isinstance(source, (bytes, bytearray)):
+                encoded.source_path = path
+        _payload_cache.put(key, encoded)
+    return encoded
+
+
+def prepare_base_images(sources, **kwargs):
+    """
+    Prepares several base images and prints how many upload bytes were saved.
+
+    Returns:
+        list[EncodedImage]: The encoded payloads, in the same order as `sources`.
+    """
+    encoded = [prepare_base_image(source, **kwargs) for source in sources]
+    if encoded:
+        sent = sum(len(e.data) for e in encoded)
+        saved = sum(e.bytes_saved for e in encoded)
+        print(f"📦 Base images: {sent / 1024:.0f} KB to upload, {saved / 1024:.0f} KB saved by preprocessing")
+    return encoded
+
+
+def payload_cache_stats():
+    """Returns hit/miss counters for the encoded-payload cache."""
+    return {"hits": _payload_cache.hits, "misses": _payload_cache.misses}
@@ -0,0 +1,179 @@
+import asyncio
+import contextvars
+import itertools
+import time
+import uuid
+from collections import OrderedDict
+from . import metrics
+from .tracing import record_stage
+
+# Lower numbers are served first
+PRIORITIES = {"high": 0, "normal": 1, "low": 2}
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while the queue is at capacity."""
+
+
+class Job:
+    """
+    One unit of work in the JobQueue and its lifecycle timestamps.
+    """
+
+    def __init__(self, payload, priority):
+        self.id = uuid.uuid4().hex
+        self.payload = payload
+        self.priority = priority
+        self.status = QUEUED
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.result = None
+        self.error = None
+        self.handler = None
+        # The submitter's context, so the handler sees its request trace
+        self.context = contextvars.copy_context()
+        self._done = asyncio.Event()
+
+    @property
+    def wait_seconds(self):
+        """Time spent queued before a worker picked the job up."""
+        end = self.started_at if self.started_at is not None else time.time()
+        return end - self.created_at
+
+    @property
+    def finished(self):
+        return self.status in (SUCCEEDED, FAILED)
+
+
+class JobQueue:
+    """
+    Bounded in-process priority queue drained by a fixed pool of asyncio workers.
+
+    Every generation, whether it arrives through the synchronous endpoint or the
+    job API, runs through one JobQueue, so the worker count is the single place
+    that governs capacity. Workers start on the first submit, inside the running
+    event loop. Finished jobs are kept for polling up to `max_finished` entries.
+
+    Args:
+        handler (callable): Async function run for each job's payload; its return value becomes the result.
+        workers (int, optional): Number of concurrent workers. Defaults to 32.
+        max_queued (int, optional): Maximum number of waiting jobs. Defaults to 1000.
+        max_finished (int, optional): Finished jobs retained for polling. Defaults to 10000.
+    """
+
+    def __init__(self, handler, workers=32, max_queued=1000, max_finished=10000):
+        self.handler = handler
+        self.workers = workers
+        self.max_queued = max_queued
+        self.max_finished = max_finished
+        self._jobs = OrderedDict()
+        self._queue = None
+        self._tasks = []
+        self._sequence = itertools.count()
+        self.running = 0
+
+    def _ensure_started(self):
+        if self._queue is None:
+            self._queue = asyncio.PriorityQueue()
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    def submit(self, payload, priority="normal", handler=None):
+        """
+        Enqueues a job and returns it immediately. Must be called from the event loop.
+
+        Args:
+            payload: Passed to the handler.
+            priority (str, optional): "high", "normal" or "low". Defaults to "normal".
+            handler (callable, optional): Async function to run instead of the queue's default handler.
+
+        Raises:
+            QueueFullError: If `max_queued` jobs are already waiting.
+            ValueError: If `priority` is not one of PRIORITIES.
+        """
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority '{priority}'. Use one of: {', '.join(PRIORITIES)}.")
+        self._ensure_started()
+        if self._queue.qsize() >= self.max_queued:
+            raise QueueFullError(f"The job queue is full ({self.max_queued} jobs waiting).")
+        job = Job(payload, priority)
+        job.handler = handler or self.handler
+        self._jobs[job.id] = job
+        self._queue.put_nowait((PRIORITIES[priority], next(self._sequence), job))
+        metrics.JOB_QUEUE_DEPTH.set(self._queue.qsize())
+        self._trim()
+        return job
+
+    def has_room(self, count=1):
+        """True if `count` more jobs can be submitted without exceeding `max_queued`."""
+        queued = self._queue.qsize() if self._queue is not None else 0
+        return queued + count <= self.max_queued
+
+    async def wait(self, job, forget=False):
+        """
+        Waits for `job` to finish and returns its result, re-raising its error.
+
+        With `forget`, the job is dropped from the finished jobs kept for polling,
+        so callers that already hold the result do not keep it alive.
+        """
+        try:
+            await job._done.wait()
+        finally:
+            if forget:
+                self._jobs.pop(job.id, None)
+        if job.error is not None:
+            raise job.error
+        return job.result
+
+    async def run(self, payload, priority="normal", handler=None):
+        """Submits a job and waits for its result. The job is not kept for polling."""
+        return await self.wait(self.submit(payload, priority, handler), forget=True)
+
+    def get(self, job_id):
+        """Returns the job with `job_id`, or None if it is unknown or was evicted."""
+        return self._jobs.get(job_id)
+
+    def stats(self):
+        """Returns queue depth, busy workers and the oldest waiting job's age."""
+        queued = [job for job in self._jobs.values() if job.status == QUEUED]
+        return {
+            "queue_depth": len(queued),
+            "running_jobs": self.running,
+            "workers": self.workers,
+            "oldest_wait_seconds": max((job.wait_seconds for job in queued), default=0.0),
+        }
+
+    def _trim(self):
+        if len(self._jobs) <= self.max_finished:
+            return
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+            del self._jobs[job_id]
+
+    async def _worker(self):
+        while True:
+            _, _, job = await self._queue.get()
+            metrics.JOB_QUEUE_DEPTH.set(self._queue.qsize())
+            job.status = RUNNING
+            job.started_at = time.time()
+            metrics.JOB_WAIT_SECONDS.observe(job.wait_seconds, priority=job.priority)
+            job.context.run(record_stage, "queue", job.wait_seconds)
+            self.running += 1
+            try:
+                job.result = await asyncio.create_task(job.handler(job.payload), context=job.context)
+                job.status = SUCCEEDED
+            except Exception as e:
+                job.error = e
+                job.status = FAILED
+            finally:
+                self.running -= 1
+                job.finished_at = time.time()
+                job.handler = None
+                job.context = None
+                job._done.set()
+                self._queue.task_done()
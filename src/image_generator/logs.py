@@ -0,0 +1,115 @@
+import json
+import logging
+import os
+import sys
+from .tracing import current_trace
+
+# Every logger of this project lives under this name, so one handler configures them all
+ROOT_LOGGER = "image_generator"
+
+
+def get_logger(name):
+    """Returns the project logger for `name`, e.g. get_logger("core")."""
+    _install_default_handler()
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
+
+
+class _StdoutFallbackHandler(logging.Handler):
+    """
+    Prints messages to stdout, as the library did before it logged, while nothing else is configured.
+
+    Once the application configures logging itself (a handler on the root
+    logger), records are left to propagate to it instead.
+    """
+
+    def emit(self, record):
+        if logging.getLogger().handlers:
+            return
+        try:
+            sys.stdout.write(self.format(record) + "\n")
+            sys.stdout.flush()
+        except Exception:
+            self.handleError(record)
+
+
+def _install_default_handler():
+    """Gives the project logger the stdout fallback unless configure_logging() or the application set it up."""
+    logger = logging.getLogger(ROOT_LOGGER)
+    if logger.handlers:
+        return
+    handler = _StdoutFallbackHandler()
+    handler.setFormatter(TextFormatter())
+    logger.addHandler(handler)
+    if logger.level == logging.NOTSET:
+        logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+
+
+def log_event(logger, level, message, event, **fields):
+    """
+    Logs `message` with a machine-readable event name and extra fields.
+
+    Args:
+        logger (logging.Logger): From get_logger().
+        level (int): A logging level, e.g. logging.INFO.
+        message (str): The human-readable message, shown as-is in text mode.
+        event (str): A stable event name, e.g. "request_finished".
+        **fields: JSON-serializable values added to the record.
+    """
+    logger.log(level, message, extra={"event": event, "fields": fields})
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line: time, level, logger, event, message, the current
+    request id (if any) and the event's fields.
+    """
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "event": getattr(record, "event", None),
+            "message": record.getMessage(),
+        }
+        trace = current_trace()
+        if trace is not None:
+            entry["request_id"] = trace.request_id
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Just the message, as the CLI printed it before logging was structured."""
+
+    def format(self, record):
+        message = record.getMessage()
+        if record.exc_info:
+            message = f"{message}\n{self.formatException(record.exc_info)}"
+        return message
+
+
+def configure_logging(default_format="json", level=None):
+    """
+    Sends the project's logs to stdout, as JSON lines or plain messages.
+
+    LOG_FORMAT ("json" or "text") and LOG_LEVEL override the arguments. Calling
+    it again replaces the earlier configuration.
+
+    Args:
+        default_format (str, optional): "json" for services, "text" for interactive tools. Defaults to "json".
+        level (str, optional): Minimum level. Defaults to LOG_LEVEL or "INFO".
+    """
+    log_format = os.getenv("LOG_FORMAT", default_format).lower()
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonFormatter() if log_format == "json" else TextFormatter())
+    logger = logging.getLogger(ROOT_LOGGER)
+    for existing in list(logger.handlers):
+        logger.removeHandler(existing)
+    logger.addHandler(handler)
+    logger.setLevel((level or os.getenv("LOG_LEVEL", "INFO")).upper())
+    logger.propagate = False
+    return logger
+
@@ -0,0 +1,219 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from pathlib import Path
+from .tracing import record_stage
+
+# Latency buckets in seconds, from sub-millisecond disk work up to slow model calls
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """Base class holding one value per label combination behind a lock."""
+
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        if not self.labelnames and self.kind in ("counter", "gauge"):
+            self._values[()] = 0  # unlabelled series are exported from the start
+        self._lock = threading.Lock()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def _key(self, labels):
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    """A monotonically increasing value."""
+
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    """A value that can go up and down."""
+
+    kind = "gauge"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Histogram(_Metric):
+    """Observations counted into fixed cumulative buckets, plus their sum and count."""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=None):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def snapshot(self, **labels):
+        """Returns (count, sum) for one label combination."""
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            return (state[2], state[1]) if state else (0, 0.0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted((key, [list(s[0]), s[1], s[2]]) for key, s in self._values.items())
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, ("le", _format_value(float(bound))))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    """A set of metrics rendered together in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# Content type for the Prometheus text exposition format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# --- Instrumentation shared by the server and the batch tool ---
+REQUESTS = Counter(
+    "image_generation_requests_total",
+    "Image generations by outcome (success, cache_hit, quota, transient, safety, fatal).",
+    ["outcome"],
+)
+STAGE_SECONDS = Histogram(
+    "image_generation_stage_seconds",
+    "Time spent per stage: load, encode, model, decode, save.",
+    ["stage"],
+)
+IN_FLIGHT = Gauge("image_generation_in_flight", "Image generations currently in progress.")
+BYTES_UPLOADED = Counter("image_generation_uploaded_bytes_total", "Request bytes sent to the model: prompt text and encoded base images.")
+BYTES_DOWNLOADED = Counter("image_generation_downloaded_bytes_total", "Generated image bytes received from the model.")
+SAFETY_BLOCKS = Counter("image_generation_safety_blocks_total", "Generations blocked by safety filters.")
+JOB_QUEUE_DEPTH = Gauge("image_job_queue_depth", "Jobs waiting for a worker.")
+HEDGES = Counter(
+    "image_generation_hedges_total",
+    "Hedging decisions per model call: not_needed, budget_exhausted, primary_won, hedge_won.",
+    ["outcome"],
+)
+RENDITIONS = Counter(
+    "image_renditions_total",
+    "Output post-processing per image: created, skipped (already up to date) or failed.",
+    ["outcome"],
+)
+JOB_WAIT_SECONDS = Histogram("image_job_wait_seconds", "Time jobs spent queued before a worker started them.", ["priority"])
+
+
+@contextmanager
+def timed(stage):
+    """Times the enclosed block into the stage latency histogram and the current request's trace."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        record_stage(stage, elapsed)
+
+
+def render():
+    """Returns every registered metric in the Prometheus text format."""
+    return REGISTRY.render()
+
+
+def write_textfile(path):
+    """
+    Writes the current metrics to `path` atomically.
+
+    The file can be picked up by node_exporter's textfile collector, which lets
+    batch runs be compared against the server's /metrics numbers.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    tmp_path.write_text(render(), encoding="utf-8")
+    tmp_path.replace(path)
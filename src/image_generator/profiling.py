@@ -0,0 +1,67 @@
+import sys
+import threading
+import time
+from collections import Counter
+
+# Only one capture at a time; overlapping samplers would just slow each other down
+_capture_lock = threading.Lock()
+
+
+class ProfilerBusyError(Exception):
+    """Raised when a profile is requested while another capture is running."""
+
+
+def _stack(frame):
+    """Frames from the outermost call to `frame`, as "function (file:line)" strings."""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{frame.f_lineno})")
+        frame = frame.f_back
+    names.reverse()
+    return names
+
+
+def sample_stacks(seconds, interval=0.005):
+    """
+    Samples every thread's Python stack for `seconds`, every `interval` seconds.
+
+    This is a statistical profiler for a live process: it needs no restart and
+    no tracing hooks, and costs one stack walk per thread per sample. Stacks
+    are counted in the collapsed format ("thread;outer;...;inner"), ready for
+    flamegraph.pl or speedscope.
+
+    Args:
+        seconds (float): How long to sample.
+        interval (float, optional): Seconds between samples. Defaults to 0.005.
+
+    Returns:
+        tuple[Counter, int]: Sample counts per collapsed stack, and the number of sampling rounds.
+
+    Raises:
+        ProfilerBusyError: If another capture is already running.
+    """
+    if not _capture_lock.acquire(blocking=False):
+        raise ProfilerBusyError("A profile is already being captured.")
+    try:
+        own_id = threading.get_ident()
+        counts = Counter()
+        rounds = 0
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = [names.get(thread_id, str(thread_id))] + _stack(frame)
+                counts[";".join(stack)] += 1
+            rounds += 1
+            time.sleep(interval)
+        return counts, rounds
+    finally:
+        _capture_lock.release()
+
+
+def collapsed(counts):
+    """Renders stack counts as collapsed-stack text, one "stack count" line per stack, busiest first."""
+    return "".join(f"{stack} {count}\n" for stack, count in counts.most_common())
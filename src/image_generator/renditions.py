@@ -0,0 +1,350 @@
+import argparse
+import hashlib
+import logging
+import multiprocessing
+import os
+import threading
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from io import BytesIO
+from pathlib import Path
+from . import metrics
+from .logs import get_logger, log_event
+
+logger = get_logger("renditions")
+
+# Renditions of `output/foo.png` live in `output/renditions/foo.<name>`
+RENDITIONS_DIR = "renditions"
+SOURCE_SUFFIXES = (".png", ".jpg", ".jpeg", ".webp")
+
+
+class Rendition:
+    """
+    One derived version of an output image.
+
+    Args:
+        name (str): Suffix in the rendition's filename, e.g. "256" for `foo.256.webp`.
+        image_format (str): "WEBP" or "PNG".
+        max_edge (int, optional): Longest edge in pixels. Defaults to the source size.
+        quality (int, optional): WebP quality (1-100).
+        compress_level (int, optional): PNG zlib level (0-9); the encoder also runs its optimize pass.
+    """
+
+    __slots__ = ("name", "image_format", "max_edge", "quality", "compress_level")
+
+    def __init__(self, name, image_format, max_edge=None, quality=None, compress_level=None):
+        self.name = name
+        self.image_format = image_format
+        self.max_edge = max_edge
+        self.quality = quality
+        self.compress_level = compress_level
+
+    @property
+    def extension(self):
+        return ".webp" if self.image_format == "WEBP" else ".png"
+
+    def path_for(self, source):
+        source = Path(source)
+        return source.parent / RENDITIONS_DIR / f"{source.stem}.{self.name}{self.extension}"
+
+
+def renditions_from_settings(sizes=(), webp_quality=None, png_level=None):
+    """
+    Builds the rendition list: a WebP thumbnail per size, a full-size WebP and an optimized PNG.
+
+    Args:
+        sizes (iterable[int], optional): Longest edges of the WebP thumbnails.
+        webp_quality (int, optional): WebP quality for the thumbnails and the full-size WebP; None skips the full-size WebP.
+        png_level (int, optional): zlib level for an optimized full-size PNG; None skips it.
+
+    Returns:
+        list[Rendition]
+    """
+    quality = webp_quality or 80
+    renditions = [Rendition(str(size), "WEBP", max_edge=size, quality=quality) for size in sizes]
+    if webp_quality is not None:
+        renditions.append(Rendition("full", "WEBP", quality=webp_quality))
+    if png_level is not None:
+        renditions.append(Rendition("opt", "PNG", compress_level=png_level))
+    return renditions
+
+
+def renditions_from_env():
+    """Reads RENDITION_SIZES, RENDITION_WEBP_QUALITY and RENDITION_PNG_LEVEL."""
+    sizes = [int(size) for size in os.getenv("RENDITION_SIZES", "256,1024").split(",") if size.strip()]
+    webp_quality = os.getenv("RENDITION_WEBP_QUALITY", "80")
+    png_level = os.getenv("RENDITION_PNG_LEVEL", "")
+    return renditions_from_settings(
+        sizes,
+        webp_quality=int(webp_quality) if webp_quality else None,
+        png_level=int(png_level) if png_level else None,
+    )
+
+
+def digest_path(source):
+    """Where the SHA-256 of the source that the renditions were made from is recorded."""
+    source = Path(source)
+    return source.parent / RENDITIONS_DIR / f"{source.stem}.sha256"
+
+
+def _atomic_write(path, write):
+    """Calls `write(tmp_path)` and renames the result into place, so readers never see a partial file."""
+    tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def is_up_to_date(source, renditions):
+    """
+    True if every rendition of `source` exists and was made from its current content.
+
+    Renditions newer than the source are current without further checks. An
+    older one is still current if the recorded source digest matches: the
+    output store touches an object when it is saved again, which moves the
+    mtime of every hard-linked alias without changing a byte.
+    """
+    source = Path(source)
+    source_mtime = source.stat().st_mtime
+    stale = False
+    for rendition in renditions:
+        try:
+            if rendition.path_for(source).stat().st_mtime < source_mtime:
+                stale = True
+        except FileNotFoundError:
+            return False
+    if not stale:
+        return True
+    try:
+        recorded = digest_path(source).read_text().strip()
+    except FileNotFoundError:
+        return False
+    return recorded == hashlib.sha256(source.read_bytes()).hexdigest()
+
+
+def render(source, renditions):
+    """
+    Writes every rendition of `source`. Runs in a pool process.
+
+    Each file is written to a temporary name and renamed into place, so readers
+    never see a partial rendition. The source's digest is recorded last, once
+    every rendition is in place (see is_up_to_date).
+
+    Returns:
+        int: Total bytes written.
+    """
+    from PIL import Image
+    data = Path(source).read_bytes()
+    written = 0
+    with Image.open(BytesIO(data)) as image:
+        image.load()
+        for rendition in renditions:
+            output = image
+            if rendition.max_edge and max(image.size) > rendition.max_edge:
+                output = image.copy()
+                output.thumbnail((rendition.max_edge, rendition.max_edge), Image.LANCZOS)
+            if rendition.image_format == "WEBP":
+                params = {"quality": rendition.quality or 80, "method": 4}
+            else:
+                params = {"optimize": True, "compress_level": rendition.compress_level if rendition.compress_level is not None else 9}
+            path = rendition.path_for(source)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            _atomic_write(path, lambda tmp_path: output.save(tmp_path, rendition.image_format, **params))
+            written += path.stat().st_size
+    digest = hashlib.sha256(data).hexdigest()
+    _atomic_write(digest_path(source), lambda tmp_path: tmp_path.write_text(digest))
+    return written
+
+
+class RenditionPipeline:
+    """
+    Generates renditions of saved outputs in a pool of worker processes.
+
+    Resizing and WebP/PNG encoding are CPU-bound and would hold the GIL, so
+    they run in separate processes; submit() returns immediately and saves are
+    never slowed down by post-processing. Outputs whose renditions are already
+    up to date are skipped, which makes backfill() incremental.
+
+    Args:
+        renditions (list[Rendition]): What to generate for each output.
+        workers (int, optional): Pool processes. Defaults to half the CPUs.
+    """
+
+    def __init__(self, renditions, workers=None):
+        self.renditions = renditions
+        self.workers = workers or max(1, (os.cpu_count() or 2) // 2)
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = set()
+
+    @classmethod
+    def from_env(cls):
+        """Builds a pipeline from the RENDITION_* environment variables."""
+        workers = os.getenv("RENDITION_WORKERS")
+        return cls(renditions_from_env(), workers=int(workers) if workers else None)
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                # Spawned workers start clean instead of inheriting the parent's threads and locks
+                self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+            return self._executor
+
+    def submit(self, source):
+        """
+        Queues renditions of `source` unless they are up to date.
+
+        Returns:
+            concurrent.futures.Future: Resolves to the bytes written, or None if nothing was needed.
+        """
+        source = Path(source)
+        if not self.renditions or is_up_to_date(source, self.renditions):
+            metrics.RENDITIONS.inc(outcome="skipped")
+            return None
+        future = self._pool().submit(render, str(source), self.renditions)
+        with self._lock:
+            self._pending.add(future)
+        future.add_done_callback(self._finished)
+        return future
+
+    def _finished(self, future):
+        with self._lock:
+            self._pending.discard(future)
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is not None:
+            metrics.RENDITIONS.inc(outcome="failed")
+            log_event(logger, logging.WARNING, f"⚠️ Rendition failed: {error}", "rendition_failed", error=str(error))
+        else:
+            metrics.RENDITIONS.inc(outcome="created")
+
+    def backfill(self, directory):
+        """
+        Queues renditions for every output image under `directory` that lacks up-to-date ones.
+
+        Rendition folders, temporary files and nested output stores (directories
+        with an index.sqlite3) are skipped; the store's files are reachable
+        through their aliases.
+
+        Returns:
+            tuple[int, int]: The number of images queued and already up to date.
+        """
+        queued = skipped = 0
+        for root, dirs, files in os.walk(directory):
+            if "index.sqlite3" in files and Path(root) != Path(directory):
+                dirs[:] = []
+                continue
+            dirs[:] = [d for d in dirs if d != RENDITIONS_DIR and not d.startswith(".")]
+            for name in files:
+                if name.startswith(".") or not name.lower().endswith(SOURCE_SUFFIXES):
+                    continue
+                self._throttle()
+                if self.submit(Path(root) / name) is None:
+                    skipped += 1
+                else:
+                    queued += 1
+        return queued, skipped
+
+    def _throttle(self):
+        """Keeps a few jobs per worker queued, so a huge backfill does not hold every future at once."""
+        while True:
+            with self._lock:
+                pending = list(self._pending)
+            if len(pending) < self.workers * 4:
+                return
+            wait(pending, return_when=FIRST_COMPLETED)
+
+    def pending(self):
+        with self._lock:
+            return len(self._pending)
+
+    def wait(self):
+        """Blocks until every queued rendition is written."""
+        with self._lock:
+            pending = list(self._pending)
+        for future in pending:
+            try:
+                future.result()
+            except Exception:
+                pass  # already reported by _finished
+
+    def close(self):
+        """Finishes the queued work and stops the worker processes."""
+        self.wait()
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+
+def get_pipeline():
+    """
+    Returns the shared RenditionPipeline if RENDITIONS is enabled, otherwise None.
+
+    The output store calls it after every save, so the CLI, the batch tool and
+    the server all get renditions from the same switch.
+    """
+    global _pipeline
+    if os.getenv("RENDITIONS", "").lower() not in ("1", "true", "yes", "on"):
+        return _pipeline
+    with _pipeline_lock:
+        if _pipeline is None:
+            _pipeline = RenditionPipeline.from_env()
+        return _pipeline
+
+
+def enable_renditions(renditions=None, workers=None):
+    """
+    Turns renditions on for every later save, independent of the RENDITIONS variable.
+
+    Args:
+        renditions (list[Rendition], optional): Defaults to the RENDITION_* settings.
+        workers (int, optional): Pool processes. Defaults to RENDITION_WORKERS or half the CPUs.
+
+    Returns:
+        RenditionPipeline: The active pipeline.
+    """
+    global _pipeline
+    with _pipeline_lock:
+        if _pipeline is not None:
+            _pipeline.close()
+        _pipeline = RenditionPipeline(renditions if renditions is not None else renditions_from_env(), workers)
+        return _pipeline
+
+
+def main(argv=None):
+    """Command-line entry point: python -m src.image_generator.renditions backfill output/"""
+    parser = argparse.ArgumentParser(description="Generate thumbnails and compact versions of output images.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    backfill = commands.add_parser("backfill", help="Create missing renditions for every image under a directory.")
+    backfill.add_argument("directory", nargs="?", default="output")
+    backfill.add_argument("--sizes", default=None, help="Comma-separated thumbnail sizes (default: RENDITION_SIZES or 256,1024).")
+    backfill.add_argument("--webp-quality", type=int, default=None, help="WebP quality (default: RENDITION_WEBP_QUALITY or 80).")
+    backfill.add_argument("--png-level", type=int, default=None, help="Also write an optimized PNG at this zlib level (0-9).")
+    backfill.add_argument("--workers", type=int, default=None, help="Worker processes (default: RENDITION_WORKERS or half the CPUs).")
+    args = parser.parse_args(argv)
+
+    if args.sizes is None and args.webp_quality is None and args.png_level is None:
+        renditions = renditions_from_env()
+    else:
+        renditions = renditions_from_settings(
+            [int(size) for size in (args.sizes or "256,1024").split(",") if size.strip()],
+            webp_quality=args.webp_quality if args.webp_quality is not None else 80,
+            png_level=args.png_level,
+        )
+    workers = args.workers or (int(os.getenv("RENDITION_WORKERS")) if os.getenv("RENDITION_WORKERS") else None)
+    pipeline = RenditionPipeline(renditions, workers=workers)
+    queued, skipped = pipeline.backfill(args.directory)
+    print(f"🖼️ Queued {queued} image(s) for renditions, {skipped} already up to date")
+    pipeline.close()
+    failed = int(metrics.RENDITIONS.value(outcome="failed"))
+    print(f"✅ Renditions written for {queued - failed} image(s)" + (f", {failed} failed" if failed else ""))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,158 @@
+import asyncio
+import random
+import threading
+
+# Error classes used across the generator
+QUOTA = "quota"
+TRANSIENT = "transient"
+SAFETY = "safety"
+FATAL = "fatal"
+
+_TRANSIENT_STATUS_CODES = {408, 500, 502, 503, 504}
+
+
+class GenerationError(Exception):
+    """
+    Raised when a generation fails, carrying the error class.
+
+    Attributes:
+        kind (str): One of QUOTA, TRANSIENT, SAFETY or FATAL.
+        status_code (int): The upstream HTTP status, when there was one.
+    """
+
+    def __init__(self, message, kind=FATAL, status_code=None):
+        super().__init__(message)
+        self.kind = kind
+        self.status_code = status_code
+
+    @property
+    def retryable(self):
+        return self.kind in (QUOTA, TRANSIENT)
+
+
+def classify_error(error):
+    """
+    Maps an exception raised while calling the model to an error class.
+
+    Args:
+        error (Exception): The exception to classify.
+
+    Returns:
+        str: QUOTA for 429s, TRANSIENT for timeouts, 5xx and network errors,
+        SAFETY for blocked prompts, and FATAL for everything else.
+    """
+    if isinstance(error, GenerationError):
+        return error.kind
+    code = getattr(error, "code", None) or getattr(error, "status_code", None)
+    if code == 429:
+        return QUOTA
+    if code in _TRANSIENT_STATUS_CODES:
+        return TRANSIENT
+    if isinstance(error, (TimeoutError, ConnectionError, asyncio.TimeoutError)):
+        return TRANSIENT
+    # httpx transport errors (connect/read timeouts, resets) without importing httpx here
+    if type(error).__module__.startswith("httpx") and "Status" not in type(error).__name__:
+        return TRANSIENT
+    return FATAL
+
+
+class RetryPolicy:
+    """
+    Jittered exponential backoff for retryable errors.
+
+    Delays use "full jitter": a uniform draw between zero and the capped
+    exponential bound, which keeps many clients from retrying in lockstep.
+    """
+
+    def __init__(self, max_attempts=5, base_delay=1.0, max_delay=30.0):
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def should_retry(self, kind, attempt):
+        """True if a failure of class `kind` on 0-based `attempt` should be retried."""
+        return kind in (QUOTA, TRANSIENT) and attempt + 1 < self.max_attempts
+
+    def delay(self, attempt):
+        """Returns the sleep before the retry following 0-based `attempt`."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency limiter shared by every caller of the model.
+
+    Each success raises the limit additively (about +1 per limit's worth of
+    successes); a quota error halves it. Only calls that started after the last
+    decrease can trigger another one, so a burst of 429s from the same window
+    counts as a single signal. Works from threads (acquire) and from asyncio
+    (aacquire) against the same budget.
+    """
+
+    def __init__(self, initial=8, min_limit=1, max_limit=64):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = float(min(max(initial, min_limit), max_limit))
+        self.in_flight = 0
+        self.decreases = 0
+        self._lock = threading.Lock()
+        self._condition = threading.Condition(self._lock)
+        self._async_waiters = []
+
+    def _try_acquire(self):
+        if self.in_flight < int(self.limit):
+            self.in_flight += 1
+            return True
+        return False
+
+    def acquire(self):
+        """
+        Blocks the calling thread until a slot is free.
+
+        Returns:
+            int: A ticket to hand back to release().
+        """
+        with self._condition:
+            while not self._try_acquire():
+                self._condition.wait()
+            return self.decreases
+
+    async def aacquire(self):
+        """Waits without blocking the event loop until a slot is free. Returns a ticket."""
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._lock:
+                if self._try_acquire():
+                    return self.decreases
+                waiter = loop.create_future()
+                self._async_waiters.append((loop, waiter))
+            await waiter
+
+    def release(self, ticket, kind=None):
+        """
+        Frees a slot and adapts the limit.
+
+        Args:
+            ticket (int): The value returned by acquire() or aacquire().
+            kind (str, optional): None for a success, otherwise the error class.
+        """
+        with self._condition:
+            self.in_flight -= 1
+            if kind is None:
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            elif kind == QUOTA and ticket == self.decreases:
+                self.limit = max(self.min_limit, self.limit / 2)
+                self.decreases += 1
+            self._condition.notify_all()
+            waiters, self._async_waiters = self._async_waiters, []
+        for loop, waiter in waiters:
+            loop.call_soon_threadsafe(_wake, waiter)
+
+    def stats(self):
+        with self._lock:
+            return {"limit": int(self.limit), "in_flight": self.in_flight, "decreases": self.decreases}
+
+
+def _wake(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
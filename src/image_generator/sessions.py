@@ -0,0 +1,157 @@
+import asyncio
+import os
+import time
+import uuid
+from collections import OrderedDict
+
+
+class RefinementSession:
+    """
+    One multi-turn refinement: the model chat, the current image and the prompts so far.
+
+    The chat keeps earlier turns (including the images it produced) as context,
+    so each refinement only sends the new instruction. Turns on one session are
+    serialized through `lock`.
+    """
+
+    def __init__(self, chat):
+        self.id = uuid.uuid4().hex
+        self.chat = chat
+        self.current_image = None
+        self.current_path = None
+        self.prompts = []
+        self.created_at = time.time()
+        self.last_used = self.created_at
+        self.memory_bytes = 0
+        self.lock = asyncio.Lock()
+
+    @property
+    def turns(self):
+        return len(self.prompts)
+
+
+def _history_bytes(history):
+    """Approximates the memory held by a chat history: inline image bytes plus text."""
+    total = 0
+    for content in history:
+        for part in content.parts or []:
+            if part.inline_data is not None and part.inline_data.data:
+                total += len(part.inline_data.data)
+            if part.text:
+                total += len(part.text)
+    return total
+
+
+class SessionStore:
+    """
+    In-memory store of refinement sessions with an idle TTL and a global memory cap.
+
+    Sessions idle for longer than `ttl` seconds are dropped on the next access.
+    When the total memory held by all sessions exceeds `max_bytes`, the least
+    recently used sessions are evicted first, skipping any with a turn in progress.
+    Each chat's history is trimmed to its last `max_turns` turns so long sessions
+    stay bounded too.
+
+    Args:
+        chat_factory (callable): Builds a chat, optionally from an earlier history (e.g. core.create_chat).
+        ttl (float, optional): Idle seconds before a session expires. Defaults to 1800.
+        max_bytes (int, optional): Memory cap across all sessions. Defaults to 512 MB.
+        max_turns (int, optional): Turns of history kept as model context. Defaults to 20.
+    """
+
+    def __init__(self, chat_factory, ttl=1800.0, max_bytes=512 * 1024 * 1024, max_turns=20):
+        self.chat_factory = chat_factory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_turns = max(1, max_turns)
+        self.expired = 0
+        self.evicted = 0
+        self._sessions = OrderedDict()
+
+    @classmethod
+    def from_env(cls, chat_factory):
+        """Builds a SessionStore from SESSION_* environment variables."""
+        return cls(
+            chat_factory,
+            ttl=float(os.getenv("SESSION_TTL_SECONDS", "1800")),
+            max_bytes=int(os.getenv("SESSION_MAX_MB", "512")) * 1024 * 1024,
+            max_turns=int(os.getenv("SESSION_MAX_TURNS", "20")),
+        )
+
+    def create(self):
+        """Starts a new session with a fresh chat."""
+        self._expire()
+        session = RefinementSession(self.chat_factory())
+        self._sessions[session.id] = session
+        return session
+
+    def get(self, session_id):
+        """Returns the session and marks it as recently used, or None if it is unknown or expired."""
+        self._expire()
+        session = self._sessions.get(session_id)
+        if session is not None:
+            session.last_used = time.time()
+            self._sessions.move_to_end(session_id)
+        return session
+
+    def delete(self, session_id):
+        """Drops a session. Returns True if it existed."""
+        return self._sessions.pop(session_id, None) is not None
+
+    def record_turn(self, session, prompt, generated_image, save_path):
+        """
+        Stores a finished turn's result, trims the chat history and enforces the memory cap.
+
+        Args:
+            session (RefinementSession): The session the turn ran on.
+            prompt (str): The turn's instruction.
+            generated_image (GeneratedImage): The image the turn produced.
+            save_path (Path): Where it was saved, or None.
+        """
+        session.prompts.append(prompt)
+        session.current_image = generated_image
+        session.current_path = save_path
+        session.last_used = time.time()
+
+        history = session.chat.get_history(curated=True)
+        if len(history) > 2 * self.max_turns:
+            # Restart the chat from its most recent turns; the latest image is always among them
+            history = history[-2 * self.max_turns:]
+            session.chat = self.chat_factory(history)
+        session.memory_bytes = _history_bytes(history) + len(generated_image.data)
+        self._evict()
+
+    def _expire(self):
+        deadline = time.time() - self.ttl
+        for session_id in [sid for sid, s in self._sessions.items() if s.last_used < deadline and not s.lock.locked()]:
+            del self._sessions[session_id]
+            self.expired += 1
+
+    def _evict(self):
+        total = self.memory_bytes()
+        for session_id in list(self._sessions):
+            if total <= self.max_bytes:
+                break
+            session = self._sessions[session_id]
+            if session.lock.locked():
+                continue
+            del self._sessions[session_id]
+            total -= session.memory_bytes
+            self.evicted += 1
+
+    def memory_bytes(self):
+        """Total memory held by all sessions."""
+        return sum(session.memory_bytes for session in self._sessions.values())
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def stats(self):
+        """Returns the session count, memory use and eviction counters."""
+        self._expire()
+        return {
+            "active_sessions": len(self._sessions),
+            "session_memory_bytes": self.memory_bytes(),
+            "sessions_expired": self.expired,
+            "sessions_evicted": self.evicted,
+        }
@@ -0,0 +1,154 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS leases (key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+"""
+
+
+class SharedState:
+    """
+    Coordination state shared by every process on one host, kept in a SQLite file.
+
+    SQLite's file locking serializes the read-modify-write transactions, so
+    several server workers (or batch runs) can share a rate limit, hand off
+    duplicate generations and keep common counters without an external
+    service. Each thread uses its own connection.
+
+    Args:
+        path (str | Path): The SQLite file. Every cooperating process must use the same path.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        self._connection().executescript(_SCHEMA)
+
+    def _connection(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def _transaction(self):
+        return _Transaction(self._connection())
+
+    # --- Token bucket ---
+    def take_token(self, name, rate, burst):
+        """
+        Takes one token from the named bucket, refilling it at `rate` tokens per second.
+
+        Returns:
+            float: 0 if a token was taken, otherwise the seconds until one will be available.
+        """
+        now = time.time()
+        with self._transaction() as db:
+            row = db.execute("SELECT tokens, updated FROM buckets WHERE name = ?", (name,)).fetchone()
+            tokens = burst if row is None else min(burst, row[0] + (now - row[1]) * rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0.0
+            else:
+                wait = (1 - tokens) / rate
+            db.execute("INSERT OR REPLACE INTO buckets (name, tokens, updated) VALUES (?, ?, ?)", (name, tokens, now))
+        return wait
+
+    # --- Leases for cross-process single-flight ---
+    def claim(self, key, ttl):
+        """
+        Claims `key` for `ttl` seconds.
+
+        Returns:
+            str: An owner token if the claim succeeded, or None if another live claim holds the key.
+        """
+        owner = f"{os.getpid()}:{uuid.uuid4().hex}"
+        now = time.time()
+        with self._transaction() as db:
+            db.execute("DELETE FROM leases WHERE key = ? AND expires < ?", (key, now))
+            inserted = db.execute(
+                "INSERT OR IGNORE INTO leases (key, owner, expires) VALUES (?, ?, ?)", (key, owner, now + ttl)
+            ).rowcount
+        return owner if inserted else None
+
+    def is_claimed(self, key):
+        row = self._connection().execute(
+            "SELECT 1 FROM leases WHERE key = ? AND expires >= ?", (key, time.time())
+        ).fetchone()
+        return row is not None
+
+    def release(self, key, owner):
+        with self._transaction() as db:
+            db.execute("DELETE FROM leases WHERE key = ? AND owner = ?", (key, owner))
+
+    # --- Counters ---
+    def incr(self, name, amount=1):
+        with self._transaction() as db:
+            db.execute(
+                "INSERT INTO counters (name, value) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = value + ?",
+                (name, amount, amount),
+            )
+
+    def counters(self):
+        """Returns every shared counter."""
+        return dict(self._connection().execute("SELECT name, value FROM counters").fetchall())
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE ... COMMIT, so concurrent writers queue on the file lock instead of failing."""
+
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        self.db.execute("BEGIN IMMEDIATE")
+        return self.db
+
+    def __exit__(self, exc_type, exc, tb):
+        self.db.execute("COMMIT" if exc_type is None else "ROLLBACK")
+        return False
+
+
+class SharedRateLimiter:
+    """
+    Global token bucket across processes, for an upstream quota shared by all workers.
+
+    Args:
+        state (SharedState): The shared state file.
+        requests_per_minute (float): Sustained rate allowed across all processes.
+        burst (float, optional): Bucket size; how many calls may start at once after an idle period.
+            Defaults to ten seconds' worth of requests.
+        name (str, optional): Bucket name, so several limits can live in one file. Defaults to "model".
+    """
+
+    def __init__(self, state, requests_per_minute, burst=None, name="model"):
+        self.state = state
+        self.rate = requests_per_minute / 60.0
+        self.burst = max(1.0, burst if burst is not None else self.rate * 10)
+        self.name = name
+
+    def acquire(self):
+        """Blocks the calling thread until a token is available."""
+        while True:
+            wait = self.state.take_token(self.name, self.rate, self.burst)
+            if not wait:
+                return
+            time.sleep(wait)
+
+    async def aacquire(self):
+        """Waits without blocking the event loop until a token is available."""
+        while True:
+            wait = await asyncio.to_thread(self.state.take_token, self.name, self.rate, self.burst)
+            if not wait:
+                return
+            await asyncio.sleep(wait)
@@ -0,0 +1,337 @@
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from io import BytesIO
+from pathlib import Path
+from .cache import image_fingerprint
+from .images import GeneratedImage
+from .metrics import timed
+from .renditions import RENDITIONS_DIR, get_pipeline
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outputs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    digest TEXT NOT NULL,
+    path TEXT NOT NULL,
+    prompt TEXT NOT NULL,
+    prompt_hash TEXT NOT NULL,
+    base_hashes TEXT NOT NULL,
+    model TEXT,
+    mime_type TEXT,
+    size_bytes INTEGER NOT NULL,
+    width INTEGER,
+    height INTEGER,
+    latency REAL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS outputs_prompt_hash ON outputs (prompt_hash);
+CREATE INDEX IF NOT EXISTS outputs_digest ON outputs (digest);
+CREATE INDEX IF NOT EXISTS outputs_created_at ON outputs (created_at);
+"""
+
+
+def _prompt_hash(prompt):
+    return hashlib.sha256(prompt.encode()).hexdigest()
+
+
+def _as_generated(image):
+    """
+    Checks that `image` holds the model's encoded bytes.
+
+    Raises:
+        TypeError: For anything but a GeneratedImage. Re-encoding decoded pixels would
+            recompress the output, so callers should generate with raw=True instead.
+    """
+    if not isinstance(image, GeneratedImage):
+        raise TypeError(
+            f"OutputStore.put() needs a GeneratedImage, got {type(image).__name__}; "
+            "generate with raw=True to keep the model's bytes."
+        )
+    return image
+
+
+def _link_count(path):
+    """Number of hard links to `path`, or 0 if it no longer exists."""
+    try:
+        return path.stat().st_nlink
+    except FileNotFoundError:
+        return 0
+
+
+def _dimensions(data):
+    """Reads width and height from the image header without decoding the pixels."""
+    try:
+        from PIL import Image
+        with Image.open(BytesIO(data)) as image:
+            return image.size
+    except Exception:
+        return None, None
+
+
+class OutputStore:
+    """
+    Content-addressed store for generated images with a SQLite index.
+
+    Each image is written once under `objects/<aa>/<bb>/<sha256><ext>`, so
+    identical outputs share a file, names never collide and no directory grows
+    past a few hundred entries. Files are written to a temporary name in the
+    same directory and renamed into place, so readers never see partial files.
+    Every save adds a row to `index.sqlite3` with the prompt, base-image hashes,
+    model, size, latency and timestamp.
+
+    Friendly names (e.g. `output/batch_001.png`) can be requested as aliases;
+    they are hard links to the stored object, or copies where links are not supported.
+    With RENDITIONS enabled, each saved file is also queued for thumbnails and
+    compact formats (see renditions.py).
+
+    Args:
+        root (str | Path, optional): Directory holding the objects and the index. Defaults to "output/store".
+    """
+
+    def __init__(self, root="output/store"):
+        self.root = Path(root)
+        self.objects = self.root / "objects"
+        self.objects.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.root / "index.sqlite3", check_same_thread=False, timeout=30)
+        self._db.row_factory = sqlite3.Row
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.executescript(_SCHEMA)
+            self._db.commit()
+
+    def _object_path(self, digest, extension):
+        return self.objects / digest[:2] / digest[2:4] / f"{digest}{extension}"
+
+    def _write_object(self, generated):
+        digest = hashlib.sha256(generated.data).hexdigest()
+        path = self._object_path(digest, generated.extension)
+        if path.exists():
+            os.utime(path)  # tells a concurrent gc() the object is in use again
+        else:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+            with open(tmp_path, "wb") as f:
+                f.write(generated.data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        return digest, path
+
+    def _link_alias(self, path, alias):
+        """Points `alias` at the stored object atomically, replacing any earlier file there."""
+        alias = Path(alias).with_suffix(path.suffix)
+        alias.parent.mkdir(parents=True, exist_ok=True)
+        tmp_alias = alias.with_name(f".{alias.name}.{uuid.uuid4().hex}.tmp")
+        try:
+            os.link(path, tmp_alias)
+        except OSError:
+            tmp_alias.write_bytes(path.read_bytes())
+        os.replace(tmp_alias, alias)
+        return alias
+
+    def put(self, image, prompt, base_images=None, model=None, latency=None, alias=None):
+        """
+        Stores a generated image and indexes it.
+
+        Args:
+            image (GeneratedImage): The model's encoded image, as returned with raw=True.
+            prompt (str): The prompt that produced it.
+            base_images (list[PIL.Image.Image | EncodedImage], optional): The base images sent with the prompt.
+            model (str, optional): The model that generated it.
+            latency (float, optional): Generation time in seconds.
+            alias (str | Path, optional): Friendly path to link to the stored file; its suffix follows the image type.
+
+        Returns:
+            Path: The alias if one was given, otherwise the stored object's path.
+
+        Raises:
+            TypeError: If `image` is a decoded image rather than a GeneratedImage.
+        """
+        generated = _as_generated(image)
+        base_hashes = [image_fingerprint(base) for base in base_images or []]
+        with timed("save"):
+            digest, path = self._write_object(generated)
+            width, height = _dimensions(generated.data)
+            with self._lock:
+                self._db.execute(
+                    "INSERT INTO outputs (digest, path, prompt, prompt_hash, base_hashes, model, mime_type,"
+                    " size_bytes, width, height, latency, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (digest, str(path.relative_to(self.root)), prompt, _prompt_hash(prompt), json.dumps(base_hashes),
+                     model, generated.mime_type, len(generated.data), width, height, latency, time.time()),
+                )
+                self._db.commit()
+            if alias is not None:
+                path = self._link_alias(path, alias)
+        pipeline = get_pipeline()
+        if pipeline is not None:
+            pipeline.submit(path)  # thumbnails and compact formats are made in worker processes
+        return path
+
+    def _rows(self, query, params=()):
+        with self._lock:
+            rows = self._db.execute(query, params).fetchall()
+        return [self._record(row) for row in rows]
+
+    def _record(self, row):
+        record = dict(row)
+        record["path"] = str(self.root / record["path"])
+        record["base_hashes"] = json.loads(record["base_hashes"])
+        return record
+
+    def find(self, prompt=None, digest=None, base_hash=None, limit=100):
+        """
+        Looks up stored outputs, newest first.
+
+        Args:
+            prompt (str, optional): Only outputs generated from exactly this prompt.
+            digest (str, optional): Only outputs with this content hash.
+            base_hash (str, optional): Only outputs that used this base image (see cache.image_fingerprint).
+            limit (int, optional): Maximum number of records. Defaults to 100.
+
+        Returns:
+            list[dict]: One record per save, with the object's absolute path.
+        """
+        clauses, params = [], []
+        if prompt is not None:
+            clauses.append("prompt_hash = ?")
+            params.append(_prompt_hash(prompt))
+        if digest is not None:
+            clauses.append("digest = ?")
+            params.append(digest)
+        if base_hash is not None:
+            clauses.append("base_hashes LIKE ?")
+            params.append(f'%"{base_hash}"%')
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        return self._rows(f"SELECT * FROM outputs {where} ORDER BY created_at DESC LIMIT ?", (*params, limit))
+
+    def gc(self, max_age=None, max_bytes=None):
+        """
+        Applies the retention policy: drops entries older than `max_age`, then the
+        oldest entries until the stored objects fit in `max_bytes`.
+
+        Objects are deleted once no index entry refers to them. Objects touched
+        in the last minute are kept, since a concurrent put() may be about to
+        index them. Aliases are hard links and are left alone, so deleting an
+        aliased object frees no space: the size limit keeps such objects and
+        drops older unaliased ones instead, and their bytes are only counted
+        as freed once the last link is gone.
+
+        Args:
+            max_age (float, optional): Maximum age in seconds.
+            max_bytes (int, optional): Maximum total size of the stored objects.
+
+        Returns:
+            tuple[int, int]: The number of objects removed and the bytes actually freed on disk.
+        """
+        started = time.time()
+        with self._lock:
+            if max_age is not None:
+                self._db.execute("DELETE FROM outputs WHERE created_at < ?", (time.time() - max_age,))
+            if max_bytes is not None:
+                objects = self._db.execute(
+                    "SELECT digest, path, size_bytes, MAX(created_at) AS last_used FROM outputs"
+                    " GROUP BY digest ORDER BY last_used DESC"
+                ).fetchall()
+                total = 0
+                for row in objects:
+                    links = _link_count(self.root / row["path"])
+                    if not links:
+                        continue  # already gone from disk
+                    total += row["size_bytes"]
+                    # An aliased object stays on disk through its alias; dropping it would free nothing
+                    if total > max_bytes and links == 1:
+                        self._db.execute("DELETE FROM outputs WHERE digest = ?", (row["digest"],))
+            self._db.commit()
+            live = {row[0] for row in self._db.execute("SELECT DISTINCT digest FROM outputs")}
+
+        removed = freed = 0
+        for path in self.objects.glob("*/*/*"):
+            if path.name.startswith(".") or path.name == RENDITIONS_DIR or path.stem in live:
+                continue
+            # Another process or gc() run may delete the file between listing and unlinking it
+            try:
+                stat = path.stat()
+                if stat.st_mtime > started - 60:
+                    continue
+                path.unlink()
+            except FileNotFoundError:
+                continue
+            if stat.st_nlink == 1:
+                freed += stat.st_size
+            for rendition in (path.parent / RENDITIONS_DIR).glob(f"{path.stem}.*"):
+                try:
+                    size = rendition.stat().st_size
+                    rendition.unlink()
+                except FileNotFoundError:
+                    continue
+                freed += size
+            removed += 1
+        return removed, freed
+
+    def stats(self):
+        """Returns the number of index entries, distinct objects and their total size."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT COUNT(*), COUNT(DISTINCT digest), (SELECT COALESCE(SUM(size_bytes), 0) FROM"
+                " (SELECT DISTINCT digest, size_bytes FROM outputs)) FROM outputs"
+            ).fetchone()
+        return {"entries": row[0], "objects": row[1], "bytes": row[2]}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """Returns the shared OutputStore, rooted at OUTPUT_STORE_DIR (default "output/store")."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = OutputStore(os.getenv("OUTPUT_STORE_DIR", "output/store"))
+        return _store
+
+
+def main(argv=None):
+    """Command-line entry point: python -m src.image_generator.store {find,gc,stats}"""
+    parser = argparse.ArgumentParser(description="Query and clean up the generated image store.")
+    parser.add_argument("--root", default=None, help="Store directory (default: OUTPUT_STORE_DIR or output/store).")
+    commands = parser.add_subparsers(dest="command", required=True)
+    find = commands.add_parser("find", help="List stored outputs, newest first.")
+    find.add_argument("--prompt", default=None)
+    find.add_argument("--digest", default=None)
+    find.add_argument("--limit", type=int, default=20)
+    gc = commands.add_parser("gc", help="Delete outputs by age or total size.")
+    gc.add_argument("--max-age-days", type=float, default=None)
+    gc.add_argument("--max-gb", type=float, default=None)
+    commands.add_parser("stats", help="Show entry and object counts.")
+    args = parser.parse_args(argv)
+
+    store = OutputStore(args.root) if args.root else get_store()
+    if args.command == "find":
+        for record in store.find(prompt=args.prompt, digest=args.digest, limit=args.limit):
+            print(json.dumps(record, ensure_ascii=False))
+    elif args.command == "gc":
+        if args.max_age_days is None and args.max_gb is None:
+            parser.error("gc needs --max-age-days and/or --max-gb")
+        removed, freed = store.gc(
+            max_age=args.max_age_days * 86400 if args.max_age_days is not None else None,
+            max_bytes=int(args.max_gb * 1024 ** 3) if args.max_gb is not None else None,
+        )
+        print(f"🧹 Removed {removed} object(s), freed {freed / 1024 / 1024:.1f} MB")
+    else:
+        print(json.dumps(store.stats()))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
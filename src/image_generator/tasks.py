@@ -1,6 +1,11 @@
-from PIL import Image
 from pathlib import Path
-from .core import generate_image
+from .core import generate_image, get_cache
+from .batch import run_batch, run_file, read_prompts
+from .images import load_image, prepare_base_image, prepare_base_images
+from .store import get_store
+
+# Default prompt for placing a character in a scene; `{scene}` is replaced by the scene description
+CHARACTER_SCENE_TEMPLATE = "Place the character from the reference image in this scene: {scene}"
 
 def style_transfer(base_image_path, prompt):
     """
@@ -11,11 +16,11 @@ def style_transfer(base_image_path, prompt):
         prompt (str): The prompt describing the style to apply.
 
     Returns:
-        PIL.Image.Image: The generated image object, or None.
+        GeneratedImage: The model's encoded image, or None.
     """
     try:
-        base_object = Image.open(base_image_path)
-        return generate_image(prompt, base_images=[base_object])
+        base_object = prepare_base_image(base_image_path)
+        return generate_image(prompt, base_images=[base_object], raw=True)
     except FileNotFoundError:
         print(f"❌ Error: Base image not found at {base_image_path}")
         return None
@@ -33,7 +38,8 @@ def chat_with_image():
     try:
         # 1. Initial Generation
         initial_prompt = input("Enter the prompt for the first image: ")
-        current_image = generate_image(initial_prompt)
+        current_image = generate_image(initial_prompt, raw=True)
+        current_prompt = initial_prompt
 
         if not current_image:
             print("Could not generate the initial image. Exiting.")
@@ -65,7 +71,7 @@ def chat_with_image():
                 
                 save_path = output_dir / filename
                 try:
-                    current_image.save(save_path)
+                    save_path = get_store().put(current_image, current_prompt, alias=save_path)
                     print(f"✅ Image saved successfully to {save_path}")
                 except Exception as e:
                     print(f"❌ Failed to save image: {e}")
@@ -75,10 +81,14 @@ def chat_with_image():
 
             # Refine the image
             print("🖌️  Refining image based on your prompt...")
-            refined_image = generate_image(refinement_prompt, base_images=[current_image])
+            # Encoded once from the model's bytes, like any other base image
+            refined_image = generate_image(
+                refinement_prompt, base_images=[prepare_base_image(current_image.data)], raw=True
+            )
 
             if refined_image:
                 current_image = refined_image
+                current_prompt = refinement_prompt
                 print("✅ Refinement complete.")
                 current_image.show(title="Refined Image")
             else:
@@ -118,8 +128,8 @@ def compose_images():
         print(f"- {path}")
 
     try:
-        # Load PIL images
-        pil_images = [Image.open(p) for p in image_paths]
+        # Load, downsize and encode the source images once
+        base_images = prepare_base_images(image_paths)
 
         # Get composition prompt
         print("\nNow, describe how to combine these images.")
@@ -131,7 +141,7 @@ def compose_images():
 
         # Generate the composed image
         print("🎨 Composing image based on your prompt...")
-        composed_image = generate_image(prompt, base_images=pil_images)
+        composed_image = generate_image(prompt, base_images=base_images, raw=True)
 
         if composed_image:
             print("✅ Composition complete!")
@@ -147,7 +157,7 @@ def compose_images():
                     filename = "composed_image.png"
                 
                 save_path = output_dir / filename
-                composed_image.save(save_path)
+                save_path = get_store().put(composed_image, prompt, base_images=base_images, alias=save_path)
                 print(f"✅ Image saved to {save_path}")
         else:
             print("❌ Failed to compose the image.")
@@ -157,10 +167,11 @@ def compose_images():
 
 def batch_generate_from_file():
     """
-    Generates images in a batch from a text file containing prompts.
+    Generates images in a batch from a prompts file: plain text with one prompt
+    per line, or JSONL/CSV rows with prompt, base_images and output_name fields.
     """
     print("📚 Welcome to the Batch Image Generation Tool!")
-    print("Create a text file (e.g., prompts.txt) with one image prompt per line.")
+    print("Create a text file (e.g., prompts.txt) with one image prompt per line, or a .jsonl/.csv file with a 'prompt' field.")
     
     prompts_file_path_str = input("Enter the path to your prompts file: ")
     prompts_file_path = Path(prompts_file_path_str.strip())
@@ -170,27 +181,38 @@ def batch_generate_from_file():
         return
 
     try:
-        with open(prompts_file_path, 'r') as f:
-            prompts = [line.strip() for line in f if line.strip()]
-
-        if not prompts:
+        concurrency_input = input("How many images should be generated in parallel? [4]: ").strip()
+        concurrency = int(concurrency_input) if concurrency_input else 4
+        rpm_input = input("Maximum requests per minute (press Enter for no limit): ").strip()
+        requests_per_minute = float(rpm_input) if rpm_input else None
+
+        manifest_path = Path("output") / f"{prompts_file_path.stem}_manifest.jsonl"
+        resume = False
+        if manifest_path.exists():
+            resume = input(f"Found a previous run in '{manifest_path}'. Resume it? (y/n): ").lower() == 'y'
+
+        print("Starting batch generation...")
+        failed = []
+        counts = run_file(
+            prompts_file_path,
+            output_dir="output",
+            concurrency=concurrency,
+            requests_per_minute=requests_per_minute,
+            manifest_path=manifest_path,
+            resume=resume,
+            on_result=lambda record: failed.append(record["index"]) if record["status"] != "success" else None,
+        )
+
+        if not counts["succeeded"] and not failed and not counts["resumed"]:
             print("❌ No valid prompts found in the file.")
             return
+        if failed:
+            print(f"⚠️ {len(failed)} prompt(s) failed: {', '.join(str(i) for i in sorted(failed))}")
 
-        print(f"Found {len(prompts)} prompts. Starting batch generation...")
-        output_dir = Path("output")
-        output_dir.mkdir(exist_ok=True)
-
-        for i, prompt in enumerate(prompts):
-            print(f"🔄 Generating image {i + 1}/{len(prompts)} for prompt: '{prompt}'")
-            image = generate_image(prompt)
-            if image:
-                filename = f"batch_{i + 1:03d}.png"
-                save_path = output_dir / filename
-                image.save(save_path)
-                print(f"✅ Saved as {save_path}")
-            else:
-                print(f"❌ Failed to generate image for prompt: '{prompt}'")
+        cache = get_cache()
+        if cache:
+            stats = cache.stats()
+            print(f"🗄️ Cache: {stats['hits']} hits, {stats['misses']} misses")
         
         print("\n🎉 Batch generation complete!")
 
@@ -205,6 +227,7 @@ def create_character_sheet():
     print("👤 Welcome to the Character Consistency Tool!")
     
     character_image = None
+    character_source = None
     
     try:
         # --- Ask user to create or load character ---
@@ -218,7 +241,7 @@ def create_character_sheet():
                 return
 
             print("👤 Generating character reference image...")
-            character_image = generate_image(character_prompt)
+            character_image = generate_image(character_prompt, raw=True)
 
             if not character_image:
                 print("❌ Could not create the character reference. Aborting.")
@@ -226,6 +249,7 @@ def create_character_sheet():
 
             print("✅ Character reference created!")
             character_image.show(title="Character Reference")
+            character_source = character_image.data
 
             # 1b. Immediately save the new character
             save = input("Would you like to save this character reference image? (y/n): ")
@@ -236,7 +260,7 @@ def create_character_sheet():
                 if not filename:
                     filename = "character_reference.png"
                 save_path = output_dir / filename
-                character_image.save(save_path)
+                save_path = get_store().put(character_image, character_prompt, alias=save_path)
                 print(f"✅ Character saved to {save_path}")
 
         elif choice == '2':
@@ -244,7 +268,8 @@ def create_character_sheet():
             path_input = input("Enter the path to your character image file: ")
             image_path = Path(path_input.strip())
             if image_path.exists():
-                character_image = Image.open(image_path)
+                character_image = load_image(image_path)
+                character_source = image_path
                 print(f"✅ Loaded character '{image_path.name}'")
                 character_image.show(title=f"Loaded Character: {image_path.name}")
             else:
@@ -259,6 +284,27 @@ def create_character_sheet():
             print("No character image available to proceed. Exiting.")
             return
 
+        # Encode the reference once; every scene reuses the same payload
+        character_reference = prepare_base_image(character_source)
+
+        scenes_file = input("Enter a file with one scene per line to generate them all at once, or press Enter to describe scenes one by one: ").strip()
+        if scenes_file:
+            if not Path(scenes_file).exists():
+                print(f"❌ File not found at '{scenes_file}'.")
+                return
+            concurrency = input("How many scenes should be generated at once? (default 4): ").strip()
+            results = generate_character_scenes(
+                character_reference,
+                read_prompts(scenes_file),
+                concurrency=int(concurrency) if concurrency else 4,
+                manifest_path=Path("output") / f"{Path(scenes_file).stem}_scenes_manifest.jsonl",
+            )
+            failed = sorted(index for index, path in results.items() if path is None)
+            print(f"\n🎉 Character sheet finished: {len(results) - len(failed)} scene(s) generated.")
+            if failed:
+                print(f"⚠️ Failed scenes: {', '.join(map(str, failed))}")
+            return
+
         while True:
             print("\nNow, let's place this character in a new scene.")
             scene_prompt = input("Describe the scene (or type 'quit'): ")
@@ -266,10 +312,10 @@ def create_character_sheet():
             if scene_prompt.lower() in ['quit', 'exit']:
                 break
 
-            full_prompt = f"Place the character from the reference image in this scene: {scene_prompt}"
+            full_prompt = CHARACTER_SCENE_TEMPLATE.format(scene=scene_prompt)
             
             print("🎬 Generating new scene...")
-            scene_image = generate_image(full_prompt, base_images=[character_image])
+            scene_image = generate_image(full_prompt, base_images=[character_reference], raw=True)
 
             if scene_image:
                 print("✅ Scene generated!")
@@ -282,7 +328,7 @@ def create_character_sheet():
                     if not filename:
                         filename = "character_scene.png"
                     save_path = output_dir / filename
-                    scene_image.save(save_path)
+                    save_path = get_store().put(scene_image, full_prompt, base_images=[character_reference], alias=save_path)
                     print(f"✅ Saved to {save_path}")
             else:
                 print("❌ Failed to generate the new scene.")
@@ -292,3 +338,45 @@ def create_character_sheet():
     except Exception as e:
         print(f"An unexpected error occurred: {e}")
 
+
+def generate_character_scenes(character_image, scene_prompts, template=CHARACTER_SCENE_TEMPLATE, output_dir="output",
+                              concurrency=4, requests_per_minute=None, filename_template="scene_{index:03d}.png",
+                              manifest_path=None, resume=False, on_result=None):
+    """
+    Places one character in many scenes concurrently, without prompting.
+
+    The reference image is encoded once and the same payload is shared by every
+    call. Scenes are saved (and passed to `on_result`) as soon as each finishes.
+
+    Args:
+        character_image (str | Path | PIL.Image.Image | EncodedImage): The character reference.
+        scene_prompts (list[str]): One description per scene.
+        template (str, optional): Prompt template with a `{scene}` placeholder. Defaults to CHARACTER_SCENE_TEMPLATE.
+        output_dir (str | Path, optional): Where to save the scenes. Defaults to "output".
+        concurrency (int, optional): Maximum number of scenes in flight. Defaults to 4.
+        requests_per_minute (float, optional): Cap on requests started per minute. Defaults to no cap.
+        filename_template (str, optional): Format string for filenames, given `index`.
+        manifest_path (str | Path, optional): JSONL manifest recording every scene's outcome.
+        resume (bool, optional): Skip scenes the manifest already records as done. Defaults to False.
+        on_result (callable, optional): Called with each scene's manifest record as soon as it finishes.
+
+    Returns:
+        dict[int, Path | None]: The saved path (or None on failure) for every scene index.
+    """
+    if "{scene}" not in template:
+        raise ValueError("The scene template must contain a '{scene}' placeholder.")
+    if not getattr(character_image, "digest", None):
+        character_image = prepare_base_image(character_image)
+    prompts = [template.format(scene=scene) for scene in scene_prompts]
+    print(f"🎬 Generating {len(prompts)} scene(s) with up to {concurrency} at once...")
+    return run_batch(
+        prompts,
+        output_dir=output_dir,
+        concurrency=concurrency,
+        requests_per_minute=requests_per_minute,
+        filename_template=filename_template,
+        manifest_path=manifest_path,
+        resume=resume,
+        base_images=[character_image],
+        on_result=on_result,
+    )
@@ -0,0 +1,75 @@
+import contextvars
+import threading
+import time
+import uuid
+
+# The trace of the request being served, if any. Worker threads started with
+# asyncio.to_thread, jobs run by the JobQueue and hedged sync model calls inherit it.
+_current_trace = contextvars.ContextVar("image_generator_trace", default=None)
+
+
+class RequestTrace:
+    """
+    Time spent per stage (load, encode, model, decode, save, ...) while serving one request.
+
+    metrics.timed() adds every timed block to the current trace, so the same
+    stages that feed the Prometheus histograms are broken down per request.
+    Repeated stages (e.g. retried model calls) accumulate.
+
+    Args:
+        request_id (str, optional): The caller's request id. Defaults to a new random id.
+    """
+
+    def __init__(self, request_id=None):
+        self.request_id = request_id or uuid.uuid4().hex
+        self.started = time.perf_counter()
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def timings_ms(self):
+        """Returns each stage's time and the total so far, in milliseconds."""
+        with self._lock:
+            timings = {stage: round(seconds * 1000, 1) for stage, seconds in self.stages.items()}
+        timings["total"] = round(self.elapsed * 1000, 1)
+        return timings
+
+    def server_timing(self):
+        """Formats the timings and request id as a Server-Timing header value."""
+        entries = [f"{stage};dur={ms}" for stage, ms in self.timings_ms().items()]
+        entries.append(f'request;desc="{self.request_id}"')
+        return ", ".join(entries)
+
+
+def start_trace(request_id=None):
+    """
+    Starts a trace for the current context.
+
+    Returns:
+        tuple: The RequestTrace and a token for end_trace().
+    """
+    trace = RequestTrace(request_id)
+    return trace, _current_trace.set(trace)
+
+
+def end_trace(token):
+    _current_trace.reset(token)
+
+
+def current_trace():
+    """Returns the RequestTrace of the request being served, or None."""
+    return _current_trace.get()
+
+
+def record_stage(stage, seconds):
+    """Adds `seconds` to `stage` on the current trace, if there is one."""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(stage, seconds)
@@ -0,0 +1,82 @@
+from io import BytesIO
+
+# PIL is imported by the scorers that decode; scoring by size needs no decode at all
+
+# Longest edge the entropy scorer decodes to; detail at thumbnail scale ranks variants well enough
+SCORE_EDGE = 128
+
+
+class Variant:
+    """
+    One image from a multi-variant generation.
+
+    Args:
+        index (int): Position in completion order, starting at 0.
+        seed (int): Sampling seed of the model call that produced it; pass it back to reproduce the call.
+        candidate (int): Candidate number within that call's response.
+        image (PIL.Image.Image | GeneratedImage, optional): The image, or None if the call failed.
+        score (float, optional): The scoring hook's result, if one was given.
+        latency (float, optional): Seconds from the start of the fan-out until this variant was ready.
+        error (GenerationError, optional): Why the call failed.
+    """
+
+    __slots__ = ("index", "seed", "candidate", "image", "score", "latency", "error")
+
+    def __init__(self, index, seed, candidate=0, image=None, score=None, latency=None, error=None):
+        self.index = index
+        self.seed = seed
+        self.candidate = candidate
+        self.image = image
+        self.score = score
+        self.latency = latency
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        outcome = f"score={self.score}" if self.ok else f"error={self.error.kind}"
+        return f"Variant(index={self.index}, seed={self.seed}, candidate={self.candidate}, {outcome})"
+
+
+def score_size(generated):
+    """Encoded size in bytes. Compressed size grows with detail, so flat or empty images rank last."""
+    return float(len(generated.data))
+
+
+def score_entropy(generated):
+    """Shannon entropy of the pixel histogram, computed on a small decode of the image."""
+    from PIL import Image
+    with Image.open(BytesIO(generated.data)) as image:
+        image.draft("RGB", (SCORE_EDGE, SCORE_EDGE))
+        image.thumbnail((SCORE_EDGE, SCORE_EDGE))
+        return round(image.entropy(), 4)
+
+
+# Built-in scoring hooks, selectable by name
+SCORERS = {"size": score_size, "entropy": score_entropy}
+
+
+def get_scorer(score):
+    """
+    Resolves a scoring hook.
+
+    Args:
+        score (str | callable | None): A name from SCORERS, a function taking a GeneratedImage
+            and returning a number (higher is better), or None for no scoring.
+
+    Returns:
+        callable | None
+    """
+    if score is None or callable(score):
+        return score
+    try:
+        return SCORERS[score]
+    except KeyError:
+        raise ValueError(f"Unknown scorer '{score}'. Use one of: {', '.join(SCORERS)}.") from None
+
+
+def rank(variants):
+    """Orders variants best first: successes by descending score, then failures; ties keep completion order."""
+    return sorted(variants, key=lambda v: (not v.ok, -(v.score or 0.0), v.index))
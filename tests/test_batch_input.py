@@ -0,0 +1,60 @@
+import json
+import tempfile
+import unittest
+from pathlib import Path
+
+from src.image_generator.batch import BatchManifest
+from src.image_generator.batch_input import BatchReader
+
+
+class BatchReaderTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self._tmp.name)
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def _write(self, name, lines):
+        path = self.root / name
+        path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+        return path
+
+    def test_drops_rows_that_differ_only_in_typography(self):
+        path = self._write("prompts.txt", ["a “red” door", 'a  "red" door', "a blue door"])
+        reader = BatchReader(path)
+
+        self.assertEqual([row.prompt for row in reader], ["a “red” door", "a blue door"])
+        self.assertEqual(reader.duplicates, 1)
+
+    def test_base_images_are_relative_to_the_input_file(self):
+        inputs = self.root / "inputs"
+        inputs.mkdir()
+        path = self._write("inputs/rows.jsonl", [
+            json.dumps({"prompt": "p1", "base_images": ["refs/cat.png", str(self.root / "abs.png")]}),
+        ])
+
+        (row,) = BatchReader(path)
+
+        self.assertEqual(row.base_images, [str(inputs / "refs" / "cat.png"), str(self.root / "abs.png")])
+
+
+class ManifestIndexTest(unittest.TestCase):
+    def test_keeps_the_latest_record_per_index(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            manifest = BatchManifest(Path(tmp) / "manifest.jsonl")
+            manifest.append({"index": 1, "status": "failed"})
+            manifest.append({"index": 2, "status": "success"})
+            manifest.append({"index": 1, "status": "success"})
+
+            index = manifest.latest_index()
+            try:
+                self.assertEqual(index.get(1), {"index": 1, "status": "success"})
+                self.assertEqual(index.get(2), manifest.latest()[2])
+                self.assertIsNone(index.get(3))
+            finally:
+                index.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
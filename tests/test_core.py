@@ -0,0 +1,38 @@
+import unittest
+
+from src.image_generator import core, metrics
+from src.image_generator.backends import FakeBackend
+from src.image_generator.images import prepare_base_image
+
+
+class UploadSizeTest(unittest.TestCase):
+    def setUp(self):
+        self._saved_backend = core.backend
+        core.set_backend(FakeBackend(width=8, height=8))
+
+    def tearDown(self):
+        core.backend = self._saved_backend
+
+    def _uploaded(self, base_images):
+        before = metrics.BYTES_UPLOADED.value()
+        core.generate_image("a lighthouse", base_images=base_images, bypass_cache=True, raise_errors=True)
+        return metrics.BYTES_UPLOADED.value() - before
+
+    def test_pil_base_images_count_their_encoded_size(self):
+        from PIL import Image
+        image = Image.effect_noise((64, 64), 50).convert("RGB")
+
+        contents = core._build_contents("a lighthouse", [image])
+
+        self.assertEqual(contents[1].inline_data.mime_type, "image/png")
+        self.assertEqual(self._uploaded([image]), len("a lighthouse") + len(contents[1].inline_data.data))
+
+    def test_encoded_base_images_count_their_payload(self):
+        from PIL import Image
+        encoded = prepare_base_image(Image.new("RGB", (32, 32), "red"))
+
+        self.assertEqual(self._uploaded([encoded]), len("a lighthouse") + len(encoded.data))
+
+
+if __name__ == "__main__":
+    unittest.main()
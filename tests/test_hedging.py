@@ -0,0 +1,114 @@
+import asyncio
+import unittest
+
+from src.image_generator import core, metrics
+from src.image_generator.backends import FakeBackend
+from src.image_generator.hedging import HedgePolicy
+from src.image_generator.tracing import end_trace, start_trace
+
+OUTCOMES = ("not_needed", "budget_exhausted", "primary_won", "hedge_won")
+
+
+def hedge_counts():
+    return {outcome: metrics.HEDGES.value(outcome=outcome) for outcome in OUTCOMES}
+
+
+class HedgePolicyTest(unittest.TestCase):
+    def test_no_hedging_until_enough_samples(self):
+        policy = HedgePolicy(min_samples=5)
+        self.assertIsNone(policy.delay())  # disabled
+        policy.configure(percentile=50)
+        for seconds in (0.1, 0.2, 0.3, 0.4):
+            policy.record(seconds)
+        self.assertIsNone(policy.delay())
+        policy.record(0.5)
+        self.assertEqual(policy.delay(), 0.3)
+
+    def test_budget_limits_hedges_to_a_fraction_of_calls(self):
+        policy = HedgePolicy(budget=0.1, min_samples=0)
+        policy.configure()
+        spent = 0
+        for _ in range(100):
+            policy.delay()
+            spent += policy.try_spend()
+        self.assertLessEqual(spent, 10)
+        self.assertGreaterEqual(spent, 9)
+
+    def test_refunded_tokens_can_be_spent_again(self):
+        policy = HedgePolicy(budget=1.0, min_samples=0)
+        policy.configure()
+        policy.delay()
+        self.assertTrue(policy.try_spend())
+        self.assertFalse(policy.try_spend())
+        policy.refund()
+        self.assertTrue(policy.try_spend())
+        self.assertEqual(HedgePolicy(budget=0.1).max_tokens, 10)
+
+
+class HedgedCallTest(unittest.TestCase):
+    """Hedged model calls against the fake backend's heavy-tailed latency."""
+
+    def setUp(self):
+        self._saved = core.backend, core.hedging
+
+    def tearDown(self):
+        core.backend, core.hedging = self._saved
+
+    def _hedge_after(self, seconds, budget):
+        # Seed the latency window so every call that outlives `seconds` is a hedging candidate
+        core.hedging = HedgePolicy(budget=budget, min_samples=20)
+        core.hedging.configure(percentile=50)
+        for _ in range(500):
+            core.hedging.record(seconds)
+
+    def test_hedges_win_against_the_latency_tail(self):
+        backend = FakeBackend(width=8, height=8, latency=0.02, distribution="lognormal", jitter=1.5, seed=7)
+        core.set_backend(backend)
+        self._hedge_after(0.001, budget=1.0)
+        before = hedge_counts()
+
+        async def run():
+            for _ in range(30):
+                await core.agenerate_image("a lighthouse", bypass_cache=True, raise_errors=True)
+
+        asyncio.run(run())
+
+        counts = {outcome: hedge_counts()[outcome] - before[outcome] for outcome in OUTCOMES}
+        self.assertEqual(sum(counts.values()), 30)
+        self.assertEqual(counts["budget_exhausted"], 0)
+        self.assertGreater(counts["hedge_won"], 0)
+        self.assertGreater(counts["primary_won"], 0)
+        self.assertLessEqual(backend.calls, 30 + counts["hedge_won"] + counts["primary_won"])
+
+    def test_hedging_stops_when_the_budget_runs_out(self):
+        backend = FakeBackend(width=8, height=8, latency=0.02, distribution="lognormal", jitter=0.5, seed=7)
+        core.set_backend(backend)
+        self._hedge_after(0.001, budget=0.1)
+        before = hedge_counts()
+
+        for _ in range(20):
+            core.generate_image("a lighthouse", bypass_cache=True, raise_errors=True)
+
+        counts = {outcome: hedge_counts()[outcome] - before[outcome] for outcome in OUTCOMES}
+        hedged = counts["hedge_won"] + counts["primary_won"]
+        self.assertEqual(sum(counts.values()), 20)
+        self.assertIn(hedged, (1, 2))  # 0.1 tokens per call buys at most 2 hedges in 20 calls
+        self.assertEqual(counts["budget_exhausted"], 20 - hedged)  # every call outlived the 1 ms hedge delay
+        self.assertLessEqual(backend.calls, 20 + hedged)
+
+    def test_sync_hedged_calls_keep_the_request_trace(self):
+        core.set_backend(FakeBackend(width=8, height=8, latency=0.02, distribution="lognormal", jitter=0.5, seed=7))
+        self._hedge_after(0.001, budget=1.0)
+
+        trace, token = start_trace()
+        try:
+            core.generate_image("a lighthouse", bypass_cache=True, raise_errors=True)
+        finally:
+            end_trace(token)
+
+        self.assertIn("model", trace.stages)
+        self.assertLessEqual(core._hedge_executor._max_workers, 2 * core.hedging.max_tokens)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,34 @@
+import threading
+import time
+import unittest
+
+from src.image_generator.images import DecodeBudgetBusyError, ImageTooLargeError, MemoryBudget
+
+
+class MemoryBudgetTest(unittest.TestCase):
+    def test_rejects_sizes_over_the_whole_budget(self):
+        with self.assertRaises(ImageTooLargeError):
+            with MemoryBudget(100).reserve(101):
+                pass
+
+    def test_gives_up_when_the_budget_stays_full(self):
+        budget = MemoryBudget(100, timeout=0.05)
+        with budget.reserve(80):
+            started = time.monotonic()
+            with self.assertRaises(DecodeBudgetBusyError):
+                with budget.reserve(40):
+                    pass
+            self.assertLess(time.monotonic() - started, 1.0)
+        self.assertEqual(budget.used, 0)
+
+    def test_waits_for_room_within_the_timeout(self):
+        budget = MemoryBudget(100, timeout=5)
+        holding = budget.reserve(80)
+        holding.__enter__()
+        threading.Timer(0.05, holding.__exit__, (None, None, None)).start()
+        with budget.reserve(40):
+            self.assertEqual(budget.used, 40)
+
+
+if __name__ == "__main__":
+    unittest.main()
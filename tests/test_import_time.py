@@ -0,0 +1,34 @@
+import importlib.util
+import statistics
+import unittest
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+# The benchmark is a standalone script rather than a package module
+_spec = importlib.util.spec_from_file_location("import_time", REPO_ROOT / "benchmarks" / "import_time.py")
+import_time = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(import_time)
+
+BUDGET_MS = 100.0
+RUNS = 7
+
+
+class ImportTimeTest(unittest.TestCase):
+    def test_cli_defers_heavy_modules(self):
+        """`import app` never loads the SDK, PIL or requests; this does not depend on machine speed."""
+        _, imported = import_time.measure("app")
+        eager = sorted(
+            name for name in imported
+            if any(name == module or name.startswith(module + ".") for module in import_time.DEFERRED_MODULES)
+        )
+        self.assertEqual(eager, [])
+
+    def test_cli_imports_within_budget(self):
+        """The median of several fresh interpreters stays under 100 ms, so one slow run on a busy machine does not fail it."""
+        timings = [import_time.measure("app")[0] for _ in range(RUNS)]
+        self.assertLess(statistics.median(timings), BUDGET_MS, f"import app took {sorted(timings)} ms")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+import asyncio
+import unittest
+
+from src.image_generator import core
+from src.image_generator.backends import FakeAPIError, FakeBackend
+from src.image_generator.resilience import (
+    FATAL,
+    QUOTA,
+    TRANSIENT,
+    AdaptiveLimiter,
+    GenerationError,
+    RetryPolicy,
+    classify_error,
+)
+
+
+class ClassifyErrorTest(unittest.TestCase):
+    def test_status_codes(self):
+        self.assertEqual(classify_error(FakeAPIError(429, "RESOURCE_EXHAUSTED")), QUOTA)
+        self.assertEqual(classify_error(FakeAPIError(503, "UNAVAILABLE")), TRANSIENT)
+        self.assertEqual(classify_error(FakeAPIError(400, "INVALID_ARGUMENT")), FATAL)
+        self.assertEqual(classify_error(TimeoutError()), TRANSIENT)
+        self.assertEqual(classify_error(ValueError("bad prompt")), FATAL)
+
+
+class AdaptiveLimiterTest(unittest.TestCase):
+    def test_quota_error_halves_the_limit_once_per_window(self):
+        limiter = AdaptiveLimiter(initial=8)
+        first, second = limiter.acquire(), limiter.acquire()
+        limiter.release(first, QUOTA)
+        limiter.release(second, QUOTA)  # started before the decrease, so it is the same signal
+        self.assertEqual(limiter.stats(), {"limit": 4, "in_flight": 0, "decreases": 1})
+
+        limiter.release(limiter.acquire(), QUOTA)
+        self.assertEqual(limiter.stats()["limit"], 2)
+
+    def test_success_raises_the_limit_additively(self):
+        limiter = AdaptiveLimiter(initial=2, max_limit=3)
+        for _ in range(10):
+            limiter.release(limiter.acquire())
+        self.assertEqual(limiter.stats()["limit"], 3)
+
+
+class RetryTest(unittest.TestCase):
+    """Retries and limiter backoff through generate_image against injected faults."""
+
+    def setUp(self):
+        self._saved = core.backend, core.limiter, core.retry_policy
+        core.limiter = AdaptiveLimiter(initial=8)
+        core.retry_policy = RetryPolicy(max_attempts=4, base_delay=0.0)
+
+    def tearDown(self):
+        core.backend, core.limiter, core.retry_policy = self._saved
+
+    def test_quota_errors_back_off_and_are_retried(self):
+        # With seed 1 the first draw is a 429 and the second succeeds
+        backend = FakeBackend(width=8, height=8, quota_error_rate=0.5, seed=1)
+        core.set_backend(backend)
+
+        image = core.generate_image("a lighthouse", bypass_cache=True, raise_errors=True)
+
+        self.assertIsNotNone(image)
+        self.assertEqual(backend.calls, 2)
+        self.assertEqual(core.limiter.stats()["decreases"], 1)
+        self.assertLess(core.limiter.stats()["limit"], 8)
+
+    def test_persistent_quota_errors_exhaust_the_retries(self):
+        backend = FakeBackend(width=8, height=8, quota_error_rate=1.0)
+        core.set_backend(backend)
+
+        with self.assertRaises(GenerationError) as caught:
+            core.generate_image("a lighthouse", bypass_cache=True, raise_errors=True)
+
+        self.assertEqual(caught.exception.kind, QUOTA)
+        self.assertEqual(caught.exception.status_code, 429)
+        self.assertEqual(backend.calls, 4)
+        self.assertEqual(core.limiter.stats(), {"limit": 1, "in_flight": 0, "decreases": 4})
+
+    def test_async_quota_errors_back_off_and_are_retried(self):
+        backend = FakeBackend(width=8, height=8, quota_error_rate=0.5, seed=1)
+        core.set_backend(backend)
+
+        image = asyncio.run(core.agenerate_image("a lighthouse", bypass_cache=True, raise_errors=True))
+
+        self.assertIsNotNone(image)
+        self.assertEqual(backend.calls, 2)
+        self.assertEqual(core.limiter.stats()["decreases"], 1)
+
+    def test_fatal_errors_are_not_retried(self):
+        # Asking for more candidates than the backend allows is a 400
+        backend = FakeBackend(width=8, height=8, max_candidates=0)
+        core.set_backend(backend)
+
+        with self.assertRaises(GenerationError) as caught:
+            core.generate_image("a lighthouse", bypass_cache=True, raise_errors=True)
+
+        self.assertEqual(caught.exception.kind, FATAL)
+        self.assertFalse(caught.exception.retryable)
+        self.assertEqual(backend.calls, 1)
+        self.assertEqual(core.limiter.stats(), {"limit": 8, "in_flight": 0, "decreases": 0})
+
+
+if __name__ == "__main__":
+    unittest.main()
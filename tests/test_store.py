@@ -0,0 +1,86 @@
+import os
+import tempfile
+import time
+import unittest
+from pathlib import Path
+
+from src.image_generator import core
+from src.image_generator.backends import FakeBackend
+from src.image_generator.store import OutputStore
+
+
+class OutputStoreTest(unittest.TestCase):
+    def setUp(self):
+        self._saved_backend = core.backend
+        core.set_backend(FakeBackend(width=8, height=8))
+        self._tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self._tmp.name)
+        self.store = OutputStore(self.root / "store")
+
+    def tearDown(self):
+        self.store.close()
+        self._tmp.cleanup()
+        core.backend = self._saved_backend
+
+    def test_put_keeps_the_model_bytes(self):
+        generated = core.generate_image("a lighthouse", raw=True, raise_errors=True)
+        path = self.store.put(generated, "a lighthouse", alias=self.root / "lighthouse.png")
+
+        self.assertEqual(path.read_bytes(), generated.data)
+        self.assertEqual(self.store.stats()["objects"], 1)
+
+    def test_put_rejects_decoded_images(self):
+        image = core.generate_image("a lighthouse", raise_errors=True)
+        with self.assertRaises(TypeError):
+            self.store.put(image, "a lighthouse")
+        self.assertEqual(self.store.stats()["entries"], 0)
+
+    def _put(self, prompt, alias=None):
+        generated = core.generate_image(prompt, raw=True, raise_errors=True)
+        self.store.put(generated, prompt, alias=alias)
+        path = Path(self.store.find(prompt=prompt, limit=1)[0]["path"])
+        # Age the object past gc()'s grace period for concurrent puts
+        old = time.time() - 3600
+        os.utime(path, (old, old))
+        time.sleep(0.01)  # keeps created_at ordering stable
+        return path
+
+    def test_gc_counts_only_bytes_whose_last_link_goes(self):
+        plain = self._put("plain")
+        aliased = self._put("aliased", alias=self.root / "aliased.png")
+        plain_size = plain.stat().st_size
+
+        removed, freed = self.store.gc(max_age=0)
+
+        self.assertEqual(removed, 2)
+        self.assertEqual(freed, plain_size)
+        self.assertFalse(aliased.exists())
+        self.assertTrue((self.root / "aliased.png").exists())
+
+    def test_gc_size_limit_drops_unaliased_objects_instead_of_aliased_ones(self):
+        oldest = self._put("oldest")
+        aliased = self._put("aliased", alias=self.root / "aliased.png")
+        newest = self._put("newest")
+        oldest_size = oldest.stat().st_size
+
+        removed, freed = self.store.gc(max_bytes=newest.stat().st_size)
+
+        self.assertEqual((removed, freed), (1, oldest_size))
+        self.assertFalse(oldest.exists())
+        self.assertTrue(aliased.exists())
+        self.assertTrue(newest.exists())
+
+    def test_gc_skips_files_deleted_after_listing(self):
+        path = self._put("vanishing")
+        self.store.gc(max_age=0)
+        self.assertFalse(path.exists())
+
+        class StaleListing:
+            def glob(self, pattern):
+                return [path]
+
+        self.store.objects = StaleListing()
+        self.assertEqual(self.store.gc(max_age=0), (0, 0))
+
+if __name__ == "__main__":
+    unittest.main()